@@ -0,0 +1,152 @@
+import numpy
+
+# Each case builds a callable that performs one unit of work on n cells.
+# Geometry independent cases run once, with geometry None. Scalar cases
+# are capped, since they are far too slow on the larger grids.
+
+geometries = ['planar', 'spherical']
+
+def get_geometry(name):
+
+    from sobek import physical_geometry
+
+    return getattr(physical_geometry, name+'_geometry')
+
+def make_data(n, geometry):
+
+    from sobek.ideal_gas import IdealGas
+    from sobek.simple_cfl import SimpleCFL
+    from sobek.eulerian import Eulerian
+    from sobek.boundaries import BoundaryConditions, Outflow
+    from sobek.simple_extensive_updater import simple_extensive_updater
+    from sobek.simple_cell_updater import simple_cell_updater
+
+    grid = numpy.linspace(1, 2, n+1)
+    data = {}
+    data['grid'] = grid
+    data['cells'] = {'density':numpy.ones(n),
+                     'pressure':numpy.where(grid[:-1]<1.5, 2.0, 1.0),
+                     'velocity':numpy.zeros(n)}
+    data['equation_of_state'] = IdealGas(5./3.)
+    data['physical_geometry'] = get_geometry(geometry)
+    data['time_step_function'] = SimpleCFL(0.3)
+    data['grid_motion'] = Eulerian()
+    data['boundary_conditions'] = BoundaryConditions(Outflow(), Outflow())
+    data['extensive_updater'] = simple_extensive_updater
+    data['cell_updater'] = simple_cell_updater
+    return data
+
+def make_simulation(n, geometry):
+
+    from sobek.simulation import Simulation
+
+    sim = Simulation(make_data(n, geometry))
+    sim.timeAdvance()
+    return sim
+
+def setup_scalar_hllc(n, geometry):
+
+    from sobek.hllc import HLLC
+    from sobek.vectorised_hllc import make_random_states
+
+    rs = HLLC()
+    left_states = make_random_states(n)
+    right_states = make_random_states(n)
+    fields = list(left_states.keys())
+    lefts = [dict((field, left_states[field][i]) for field in fields) for i in range(n)]
+    rights = [dict((field, right_states[field][i]) for field in fields) for i in range(n)]
+
+    def run():
+        for left, right in zip(lefts, rights):
+            rs(left, right, 0.0)
+    return run
+
+def setup_vectorised_hllc(n, geometry):
+
+    from sobek.vectorised_hllc import make_random_states, calc_vectorised_hllc
+
+    left_states = make_random_states(n)
+    right_states = make_random_states(n)
+    velocities = numpy.zeros(n)
+    return lambda: calc_vectorised_hllc(left_states, right_states, velocities)
+
+def setup_batched_hllc(n, geometry):
+
+    from sobek.vectorised_hllc import make_random_states, calc_batched_hllc
+    from sobek.hydro_state import HydroState, conserved_fields
+
+    left_states = make_random_states(n)
+    right_states = make_random_states(n)
+    velocities = numpy.zeros(n)
+    out = HydroState(n, conserved_fields)
+    return lambda: calc_batched_hllc(left_states, right_states, velocities, out=out)
+
+def setup_scalar_eos(n, geometry):
+
+    from sobek.ideal_gas import IdealGas
+
+    eos = IdealGas(5./3.)
+    states = make_eos_states(n)
+    dp2e = numpy.vectorize(eos.dp2e)
+    return lambda: dp2e(states['density'], states['pressure'])
+
+def make_eos_states(n):
+
+    from sobek.vectorised_hllc import make_random_states
+
+    states = make_random_states(n)
+    states['out'] = numpy.empty(n)
+    return states
+
+def setup_vectorised_eos(name):
+
+    def setup(n, geometry):
+
+        from sobek.ideal_gas import IdealGas
+
+        method = getattr(IdealGas(5./3.), 'vectorised_'+name)
+        states = make_eos_states(n)
+        second = states['energy'] if name == 'de2p' else states['pressure']
+        return lambda: method(states['density'], second, out=states['out'])
+    return setup
+
+def setup_flux_calculator(n, geometry):
+
+    sim = make_simulation(n, geometry)
+    grid_velocity = sim.data['grid_motion'](sim.data['grid'], sim.data['cells'])
+    return lambda: sim.data['flux_calculator'](sim.data['grid'], sim.data['cells'],
+                                               grid_velocity, out=sim.fluxes)
+
+def setup_extensive_updater(n, geometry):
+
+    sim = make_simulation(n, geometry)
+    data = sim.data
+    extensive = data['extensive'].copy()
+    return lambda: data['extensive_updater'](data['grid'], data['cells'], data['extensive'],
+                                             sim.fluxes, data['physical_geometry'], 1e-6,
+                                             out=extensive)
+
+def setup_cell_updater(n, geometry):
+
+    sim = make_simulation(n, geometry)
+    data = sim.data
+    cells = data['cells'].copy()
+    return lambda: data['cell_updater'](data['grid'], data['extensive'],
+                                        data['equation_of_state'],
+                                        data['physical_geometry'], cells, out=cells)
+
+def setup_time_advance(n, geometry):
+
+    return make_simulation(n, geometry).timeAdvance
+
+cases = [{'name':'hllc_scalar', 'setup':setup_scalar_hllc, 'geometries':[None], 'max_cells':10**4},
+         {'name':'hllc_vectorised', 'setup':setup_vectorised_hllc, 'geometries':[None], 'max_cells':None},
+         {'name':'hllc_batched', 'setup':setup_batched_hllc, 'geometries':[None], 'max_cells':None},
+         {'name':'eos_scalar_dp2e', 'setup':setup_scalar_eos, 'geometries':[None], 'max_cells':10**5},
+         {'name':'eos_dp2e', 'setup':setup_vectorised_eos('dp2e'), 'geometries':[None], 'max_cells':None},
+         {'name':'eos_dp2c', 'setup':setup_vectorised_eos('dp2c'), 'geometries':[None], 'max_cells':None},
+         {'name':'eos_de2p', 'setup':setup_vectorised_eos('de2p'), 'geometries':[None], 'max_cells':None},
+         {'name':'flux_calculator', 'setup':setup_flux_calculator, 'geometries':geometries, 'max_cells':None},
+         {'name':'extensive_updater', 'setup':setup_extensive_updater, 'geometries':geometries, 'max_cells':None},
+         {'name':'cell_updater', 'setup':setup_cell_updater, 'geometries':geometries, 'max_cells':None},
+         {'name':'time_advance', 'setup':setup_time_advance, 'geometries':geometries, 'max_cells':None}]
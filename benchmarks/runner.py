@@ -0,0 +1,140 @@
+import unittest
+
+default_sizes = [10**k for k in range(2, 8)]
+
+def time_callable(func, min_time=0.1, repeat=3):
+
+    import timeit
+
+    # Grow the number of calls per measurement until one measurement
+    # takes min_time, then report the best of repeat measurements.
+    number = 1
+    while True:
+        elapsed = timeit.timeit(func, number=number)
+        if elapsed >= min_time or number >= 2**20:
+            break
+        number *= 2
+    best = min([elapsed]+timeit.repeat(func, number=number, repeat=repeat-1))
+    return best/number, number
+
+def run_benchmarks(cases, sizes, min_time=0.1, repeat=3, names=None, log=None):
+
+    res = []
+    for case in cases:
+        if names is not None and case['name'] not in names:
+            continue
+        for geometry in case['geometries']:
+            for n in sizes:
+                if case['max_cells'] is not None and n > case['max_cells']:
+                    continue
+                seconds, number = time_callable(case['setup'](n, geometry), min_time, repeat)
+                record = {'benchmark':case['name'],
+                          'geometry':geometry or 'none',
+                          'cells':n,
+                          'seconds':seconds,
+                          'ns_per_cell':1e9*seconds/n,
+                          'calls':number}
+                if log is not None:
+                    log.write('%-18s %-10s %9d %12.4g s %10.4g ns/cell\n' %
+                              (record['benchmark'], record['geometry'], n,
+                               seconds, record['ns_per_cell']))
+                res.append(record)
+    return res
+
+def make_metadata():
+
+    import platform
+    import time
+    import numpy
+
+    return {'python':platform.python_version(),
+            'numpy':numpy.__version__,
+            'machine':platform.machine(),
+            'processor':platform.processor(),
+            'date':time.strftime('%Y-%m-%dT%H:%M:%S')}
+
+def record_key(record):
+
+    return (record['benchmark'], record['geometry'], record['cells'])
+
+def compare(results, baseline, tolerance=0.1):
+
+    reference = dict((record_key(record), record) for record in baseline)
+    res = []
+    for record in results:
+        old = reference.get(record_key(record))
+        if old is None:
+            continue
+        ratio = record['seconds']/old['seconds']
+        res.append({'benchmark':record['benchmark'],
+                    'geometry':record['geometry'],
+                    'cells':record['cells'],
+                    'baseline':old['seconds'],
+                    'seconds':record['seconds'],
+                    'ratio':ratio,
+                    'regression':ratio > 1+tolerance})
+    return res
+
+def main(argv=None):
+
+    import argparse
+    import json
+    import sys
+    from cases import cases
+
+    parser = argparse.ArgumentParser(description='time sobek solvers, updaters and steps')
+    parser.add_argument('--sizes', type=int, nargs='+', default=default_sizes)
+    parser.add_argument('--benchmarks', nargs='+', default=None)
+    parser.add_argument('--min-time', type=float, default=0.1)
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--output', default=None,
+                        help='write results as json to this file')
+    parser.add_argument('--compare', default=None,
+                        help='json results of an earlier run to compare against')
+    parser.add_argument('--tolerance', type=float, default=0.1,
+                        help='relative slow down reported as a regression')
+    args = parser.parse_args(argv)
+
+    results = run_benchmarks(cases, args.sizes, args.min_time, args.repeat,
+                             args.benchmarks, log=sys.stderr)
+    if args.output is not None:
+        with open(args.output, 'w') as f:
+            json.dump({'metadata':make_metadata(), 'results':results}, f,
+                      indent=1, sort_keys=True)
+
+    if args.compare is None:
+        return 0
+    with open(args.compare) as f:
+        baseline = json.load(f)['results']
+    comparison = compare(results, baseline, args.tolerance)
+    for entry in comparison:
+        sys.stdout.write('%-18s %-10s %9d %8.3fx %s\n' %
+                         (entry['benchmark'], entry['geometry'], entry['cells'],
+                          entry['ratio'], 'REGRESSION' if entry['regression'] else ''))
+    return 1 if any(entry['regression'] for entry in comparison) else 0
+
+class TestRunner(unittest.TestCase):
+
+    def test_small_run(self):
+
+        from cases import cases
+
+        res = run_benchmarks(cases, [100], min_time=1e-3, repeat=1)
+        names = set(record['benchmark'] for record in res)
+        self.assertEqual(names, set(case['name'] for case in cases))
+        self.assertEqual(len([record for record in res
+                              if record['benchmark']=='time_advance']), 2)
+
+    def test_compare_flags_regressions(self):
+
+        baseline = [{'benchmark':'a', 'geometry':'none', 'cells':100, 'seconds':1.0},
+                    {'benchmark':'b', 'geometry':'none', 'cells':100, 'seconds':1.0}]
+        results = [{'benchmark':'a', 'geometry':'none', 'cells':100, 'seconds':1.05},
+                   {'benchmark':'b', 'geometry':'none', 'cells':100, 'seconds':2.0},
+                   {'benchmark':'c', 'geometry':'none', 'cells':100, 'seconds':2.0}]
+        res = compare(results, baseline, tolerance=0.1)
+        self.assertEqual([entry['regression'] for entry in res], [False, True])
+
+if __name__ == '__main__':
+
+    unittest.main()
@@ -15,8 +15,8 @@ def main():
              'pressure':10**random.randrange(-2,2),
              'velocity':10**random.randrange(-2,2)}
     for p in [left, right]:
-        p['energy'] = eos.dp2e(p['density'], p['pressure'], p)
-        p['sound_speed'] = eos.dp2c(p['density'], p['pressure'], p)
+        p['energy'] = eos.dp2e(p['density'], p['pressure'])
+        p['sound_speed'] = eos.dp2c(p['density'], p['pressure'])
     velocity = 10**random.randrange(-2,2)
     
     for i in range(10000):
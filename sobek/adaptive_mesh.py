@@ -0,0 +1,202 @@
+import unittest
+import numpy
+
+# Cells of the initial grid are roots of binary trees. A cell is
+# identified by its level below its root and its index among the cells of
+# that level, so two neighbours are siblings when they share a level and
+# the left one has an even index. Splitting gives each child the share of
+# the parent's conserved quantities that a uniform state would put in its
+# volume, and merging adds the siblings, so both conserve exactly.
+
+class GradientCriterion:
+
+    # Flags cells by the largest relative jump of field across their faces.
+    # The field must stay positive, like density or pressure.
+
+    def __init__(self, field, refine_above=0.2, coarsen_below=0.05):
+
+        self.field = field
+        self.refine_above = refine_above
+        self.coarsen_below = coarsen_below
+
+    def __call__(self, grid, cells):
+
+        values = cells[self.field]
+        jumps = numpy.abs(numpy.diff(values))
+        jumps /= numpy.minimum(values[:-1], values[1:])
+        indicator = numpy.zeros(len(values))
+        indicator[:-1] = jumps
+        numpy.maximum(indicator[1:], jumps, out=indicator[1:])
+        return indicator > self.refine_above, indicator < self.coarsen_below
+
+class AdaptiveMesh:
+
+    # Use as a run callback. A cell is refined if any criterion asks for it,
+    # and a pair of siblings merged if every criterion allows it for both.
+
+    def __init__(self, criteria, every=10, max_level=2):
+
+        self.criteria = criteria
+        self.every = every
+        self.max_level = max_level
+        self.levels = None
+        self.indices = None
+
+    def checkpointState(self):
+
+        return {'levels':self.levels, 'indices':self.indices}
+
+    def restoreState(self, state):
+
+        self.levels = state.get('levels')
+        self.indices = state.get('indices')
+
+    def calcFlags(self, grid, cells):
+
+        n = cells.shape[-1]
+        refine = numpy.zeros(n, dtype=bool)
+        coarsen = numpy.ones(n, dtype=bool)
+        for criterion in self.criteria:
+            refine_flags, coarsen_flags = criterion(grid, cells)
+            refine |= refine_flags
+            coarsen &= coarsen_flags
+        refine &= self.levels < self.max_level
+        coarsen &= ~refine
+        return refine, coarsen
+
+    def adapt(self, sim):
+
+        from grid import Grid
+        from hydro_state import HydroState
+
+        grid = sim.data['grid']
+        cells = sim.data['cells']
+        extensive = sim.data['extensive']
+        if len(cells.shape) != 1:
+            raise ValueError('adaptive mesh refinement only supports a single one dimensional run')
+        n = cells.shape[-1]
+        if self.levels is None or len(self.levels) != n:
+            self.levels = numpy.zeros(n, dtype=int)
+            self.indices = numpy.zeros(n, dtype=int)
+        refine, coarsen = self.calcFlags(grid, cells)
+        levels = self.levels
+        indices = self.indices
+        pairs = ((levels[:-1] > 0) & (levels[:-1] == levels[1:]) &
+                 (indices[:-1]%2 == 0) & (indices[1:] == indices[:-1]+1) &
+                 coarsen[:-1] & coarsen[1:])
+        if not numpy.any(refine) and not numpy.any(pairs):
+            return False
+
+        first = numpy.flatnonzero(pairs)
+        counts = numpy.ones(n, dtype=int)
+        counts[refine] = 2
+        counts[first+1] = 0
+        keep = counts > 0
+        counts = counts[keep]
+
+        storage = extensive.storage.copy()
+        storage[...,first] += storage[...,first+1]
+        storage = numpy.repeat(storage[...,keep], counts, axis=-1)
+        faces = numpy.concatenate((grid.faces[:-1][keep], grid.centres[refine], grid.faces[-1:]))
+        faces.sort()
+        new_grid = Grid(faces, grid.geometry)
+
+        levels = levels.copy()
+        indices = indices.copy()
+        levels[first] -= 1
+        indices[first] //= 2
+        levels[refine] += 1
+        indices[refine] *= 2
+        levels = numpy.repeat(levels[keep], counts)
+        indices = numpy.repeat(indices[keep], counts)
+        children = numpy.cumsum(counts)[refine[keep]]-1
+        indices[children] += 1
+
+        volumes = new_grid.volumes
+        fractions = volumes[children-1]/(volumes[children-1]+volumes[children])
+        storage[...,children-1] *= fractions
+        storage[...,children] -= storage[...,children-1]
+
+        self.levels = levels
+        self.indices = indices
+        sim.remesh(new_grid, HydroState(len(levels), extensive.fields, storage=storage))
+        return True
+
+    def __call__(self, sim):
+
+        if sim.data['cycle']%self.every == 0:
+            self.adapt(sim)
+
+class TestAdaptiveMesh(unittest.TestCase):
+
+    def make_simulation(self, n=40):
+
+        from checkpoint import make_shock_tube
+        from simulation import Simulation
+
+        return Simulation(make_shock_tube(n, ratio=10.0))
+
+    def make_mesh(self, max_level=2):
+
+        return AdaptiveMesh([GradientCriterion('density'), GradientCriterion('pressure')],
+                            every=5, max_level=max_level)
+
+    def test_refinement_conserves(self):
+
+        sim = self.make_simulation()
+        totals = numpy.sum(sim.data['extensive'].storage, axis=-1)
+        mesh = self.make_mesh()
+        self.assertTrue(mesh.adapt(sim))
+        self.assertTrue(mesh.adapt(sim))
+        self.assertFalse(mesh.adapt(sim))
+        self.assertEqual(len(sim.data['grid']), 45)
+        self.assertEqual(list(mesh.levels[18:28]), [0, 1, 2, 2, 2, 2, 1, 0, 0, 0])
+        self.assertEqual(list(mesh.indices[18:28]), [0, 0, 2, 3, 0, 1, 1, 0, 0, 0])
+        self.assertTrue(numpy.all(numpy.diff(sim.data['grid'].faces) > 0))
+        self.assertTrue(numpy.allclose(numpy.sum(sim.data['extensive'].storage, axis=-1),
+                                       totals, rtol=1e-14))
+        self.assertTrue(numpy.allclose(sim.data['cells']['density'], 1, rtol=1e-13))
+        self.assertEqual(sim.fluxes.shape, (45,))
+
+    def test_coarsens_back_to_the_initial_grid(self):
+
+        sim = self.make_simulation()
+        faces = sim.data['grid'].faces.copy()
+        mesh = self.make_mesh()
+        mesh.adapt(sim)
+        mesh.adapt(sim)
+        totals = numpy.sum(sim.data['extensive'].storage, axis=-1)
+        mesh.criteria = [lambda grid, cells: (numpy.zeros(cells.shape, dtype=bool),
+                                              numpy.ones(cells.shape, dtype=bool))]
+        mesh.adapt(sim)
+        mesh.adapt(sim)
+        self.assertTrue(numpy.array_equal(mesh.levels, numpy.zeros(40)))
+        self.assertTrue(numpy.array_equal(sim.data['grid'].faces, faces))
+        self.assertTrue(numpy.allclose(numpy.sum(sim.data['extensive'].storage, axis=-1),
+                                       totals, rtol=1e-14))
+
+    def test_fine_grid_accuracy_with_fewer_cells(self):
+
+        def base_cell_masses(sim):
+            faces = numpy.linspace(1, 2, 41)
+            index = numpy.searchsorted(faces, sim.data['grid'].centres)-1
+            return numpy.bincount(index, sim.data['extensive']['mass'], minlength=40)
+
+        reference = self.make_simulation(160)
+        reference.run(t_end=0.1)
+        coarse = self.make_simulation(40)
+        coarse.run(t_end=0.1)
+        adaptive = self.make_simulation(40)
+        mesh = self.make_mesh()
+        mesh.adapt(adaptive)
+        mesh.adapt(adaptive)
+        adaptive.run(t_end=0.1, callbacks=[mesh])
+        self.assertTrue(len(adaptive.data['grid']) < 100)
+        exact = base_cell_masses(reference)
+        coarse_error = numpy.sum(numpy.abs(base_cell_masses(coarse)-exact))
+        adaptive_error = numpy.sum(numpy.abs(base_cell_masses(adaptive)-exact))
+        self.assertTrue(adaptive_error < 0.5*coarse_error)
+
+if __name__ == '__main__':
+
+    unittest.main()
@@ -0,0 +1,153 @@
+import unittest
+
+# A boundary condition writes the ghost cell at padded index ghost of a
+# HydroState with ghost cells, given the padded index of its mirror image
+# among the real cells. Each field gets exactly one write per layer.
+
+class Outflow:
+
+    def __init__(self):
+
+        pass
+
+    def __call__(self, grid, cells, ghost, neighbour):
+
+        for field in cells.fields:
+            padded = cells.padded(field)
+            padded[...,ghost] = padded[...,neighbour]
+
+class Reflective:
+
+    def __init__(self):
+
+        pass
+
+    def __call__(self, grid, cells, ghost, neighbour):
+
+        for field in cells.fields:
+            padded = cells.padded(field)
+            if field == 'velocity':
+                padded[...,ghost] = -padded[...,neighbour]
+            else:
+                padded[...,ghost] = padded[...,neighbour]
+
+class FixedInflow:
+
+    # The state may hold arrays with one value per ensemble member.
+
+    def __init__(self, state, eos=None):
+
+        import numpy
+        from vectorised_eos import calc_vectorised_dp2e, calc_vectorised_dp2c
+
+        self.state = dict(state)
+        if eos is not None:
+            d = self.state['density']
+            p = self.state['pressure']
+            batched = numpy.ndim(d) > 0 or numpy.ndim(p) > 0
+            if 'energy' not in self.state:
+                self.state['energy'] = calc_vectorised_dp2e(eos, d, p) if batched else eos.dp2e(d, p)
+            if 'sound_speed' not in self.state:
+                self.state['sound_speed'] = calc_vectorised_dp2c(eos, d, p) if batched else eos.dp2c(d, p)
+
+    def __call__(self, grid, cells, ghost, neighbour):
+
+        for field in cells.fields:
+            cells.padded(field)[...,ghost] = self.state[field]
+
+class CustomBoundary:
+
+    def __init__(self, func):
+
+        self.func = func
+
+    def __call__(self, grid, cells, ghost, neighbour):
+
+        state = self.func(grid, cells, neighbour)
+        for field in cells.fields:
+            cells.padded(field)[...,ghost] = state[field]
+
+class BoundaryConditions:
+
+    def __init__(self, left, right):
+
+        self.left = left
+        self.right = right
+
+    def __call__(self, grid, cells):
+
+        g = cells.ghost_cells
+        for k in range(g):
+            self.left(grid, cells, g-1-k, g+k)
+            self.right(grid, cells, -g+k, -g-1-k)
+
+    def interface_states(self, grid, cells):
+
+        self(grid, cells)
+        return cells.interface_states()
+
+class BoundaryFluxCalculator:
+
+    def __init__(self, boundary_conditions, riemann_solver=None, reconstruction=None):
+
+        from vectorised_hllc import calc_batched_hllc
+
+        self.boundary_conditions = boundary_conditions
+        if riemann_solver is None:
+            riemann_solver = calc_batched_hllc
+        self.riemann_solver = riemann_solver
+        self.reconstruction = reconstruction
+
+    def interfaceStates(self, grid, cells):
+
+        left_states, right_states = self.boundary_conditions.interface_states(grid, cells)
+        if self.reconstruction is None:
+            return left_states, right_states
+        return self.reconstruction(cells, grid)
+
+    def __call__(self, grid, cells, velocity_list, out=None, signal_speeds=None):
+
+        left_states, right_states = self.interfaceStates(grid, cells)
+        if signal_speeds is None:
+            return self.riemann_solver(left_states, right_states, velocity_list, out=out)
+        return self.riemann_solver(left_states, right_states, velocity_list, out=out,
+                                   signal_speeds=signal_speeds)
+
+class TestBoundaries(unittest.TestCase):
+
+    def make_cells(self):
+
+        from hydro_state import HydroState, primitive_fields
+
+        cells = HydroState(3, primitive_fields, ghost_cells=1)
+        for n, field in enumerate(primitive_fields):
+            cells[field] = [n+1.0, n+2.0, n+3.0]
+        return cells
+
+    def test_outflow_and_reflective(self):
+
+        cells = self.make_cells()
+        BoundaryConditions(Outflow(), Reflective())(None, cells)
+        left, right = cells.interface_states()
+        self.assertEqual(left['density'][0], 1.0)
+        self.assertEqual(right['density'][-1], 3.0)
+        self.assertEqual(left['velocity'][0], 3.0)
+        self.assertEqual(right['velocity'][-1], -5.0)
+
+    def test_fixed_and_custom(self):
+
+        from ideal_gas import IdealGas
+
+        cells = self.make_cells()
+        inflow = FixedInflow({'density':2.0, 'pressure':3.0, 'velocity':1.0}, IdealGas(5./3.))
+        custom = CustomBoundary(lambda grid, cells, neighbour:
+                                dict((field, 10*cells.padded(field)[neighbour]) for field in cells.fields))
+        BoundaryConditions(inflow, custom)(None, cells)
+        left, right = cells.interface_states()
+        self.assertEqual(left['density'][0], 2.0)
+        self.assertAlmostEqual(left['energy'][0], 3.0/2.0/(2./3.))
+        self.assertEqual(right['pressure'][-1], 40.0)
+
+if __name__ == '__main__':
+
+    unittest.main()
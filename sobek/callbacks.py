@@ -0,0 +1,143 @@
+import unittest
+import numpy
+
+# Simulation.run calls every callback with the simulation after each step.
+# Scheduled wraps a callback so that it only fires every so many cycles
+# and/or every so much simulated time.
+
+class Scheduled:
+
+    def __init__(self, func, cycle_interval=None, time_interval=None):
+
+        assert(cycle_interval is not None or time_interval is not None)
+        self.func = func
+        self.cycle_interval = cycle_interval
+        self.time_interval = time_interval
+        self.fired = 0
+
+    def isDue(self, sim):
+
+        if self.cycle_interval is not None and sim.data['cycle']%self.cycle_interval==0:
+            return True
+        if self.time_interval is not None:
+            # Fire at the first step on or after each multiple of the
+            # interval, skipping multiples that a long step jumped over
+            time = numpy.min(sim.data['time'])
+            if time >= (self.fired+1)*self.time_interval:
+                self.fired = max(self.fired+1, int(numpy.floor(time/self.time_interval)))
+                return True
+        return False
+
+    def __call__(self, sim):
+
+        if self.isDue(sim):
+            self.func(sim)
+
+class LivePlot:
+
+    def __init__(self, fields=['density','pressure','velocity'], logx=False, pause=0.01):
+
+        self.fields = fields
+        self.logx = logx
+        self.pause = pause
+        self.figure = None
+
+    def start(self, sim):
+
+        import matplotlib.pyplot as plt
+        plt.ion()
+
+        self.plt = plt
+        self.figure = plt.figure()
+        self.axes_list = [self.figure.add_subplot(len(self.fields),1,n+1)
+                          for n in range(len(self.fields))]
+        self.plots = {}
+        r_list = sim.data['grid'].centres
+        for axes, field in zip(self.axes_list, self.fields):
+            plot = axes.semilogx if self.logx else axes.plot
+            self.plots[field], = plot(r_list, sim.data['cells'][field])
+            axes.set_ylabel(field)
+
+    def __call__(self, sim):
+
+        if self.figure is None:
+            self.start(sim)
+        for axes, field in zip(self.axes_list, self.fields):
+            y_list = sim.data['cells'][field]
+            self.plots[field].set_xdata(sim.data['grid'].centres)
+            self.plots[field].set_ydata(y_list)
+            if field == 'velocity':
+                slack = 0.1*(numpy.max(y_list)-numpy.min(y_list))
+                axes.set_ylim((numpy.min(y_list)-slack, numpy.max(y_list)+slack))
+            else:
+                axes.set_ylim((numpy.min(y_list), numpy.max(y_list)))
+        self.plt.suptitle('t = '+str(sim.data['time'])+', c = '+str(sim.data['cycle']))
+        self.plt.pause(self.pause)
+
+class TestCallbacks(unittest.TestCase):
+
+    def make_data(self):
+
+        from ideal_gas import IdealGas
+        from simple_cfl import SimpleCFL
+        from eulerian import Eulerian
+        from boundaries import BoundaryConditions, Outflow
+        from simple_extensive_updater import simple_extensive_updater
+        from simple_cell_updater import simple_cell_updater
+        from physical_geometry import planar_geometry
+
+        grid = numpy.linspace(0, 1, 51)
+        data = {}
+        data['grid'] = grid
+        data['cells'] = {'density':numpy.ones(50),
+                         'pressure':numpy.where(grid[:-1]<0.5, 2.0, 1.0),
+                         'velocity':numpy.zeros(50)}
+        data['equation_of_state'] = IdealGas(5./3.)
+        data['physical_geometry'] = planar_geometry
+        data['time_step_function'] = SimpleCFL(0.3)
+        data['grid_motion'] = Eulerian()
+        data['boundary_conditions'] = BoundaryConditions(Outflow(), Outflow())
+        data['extensive_updater'] = simple_extensive_updater
+        data['cell_updater'] = simple_cell_updater
+        return data
+
+    def test_run_until_time(self):
+
+        import sys
+        from simulation import Simulation
+
+        sim = Simulation(self.make_data())
+        cycles = []
+        times = []
+        sim.run(t_end=0.1,
+                callbacks=[Scheduled(lambda sim: cycles.append(sim.data['cycle']), cycle_interval=5),
+                           Scheduled(lambda sim: times.append(sim.data['time']), time_interval=0.025)])
+        self.assertEqual(sim.data['time'], 0.1)
+        self.assertEqual(cycles, range(5, sim.data['cycle']+1, 5))
+        self.assertEqual(len(times), 4)
+        self.assertFalse('matplotlib' in sys.modules)
+
+    def test_max_cycles(self):
+
+        from simulation import Simulation
+
+        sim = Simulation(self.make_data())
+        sim.run(t_end=10.0, max_cycles=7)
+        self.assertEqual(sim.data['cycle'], 7)
+        sim.run(max_cycles=9)
+        self.assertEqual(sim.data['cycle'], 9)
+
+    def test_ensemble_run_until_time(self):
+
+        from ensemble_simulation import EnsembleSimulation
+
+        data = self.make_data()
+        data['cells']['pressure'] = numpy.array([data['cells']['pressure'],
+                                                 10*data['cells']['pressure']])
+        sim = EnsembleSimulation(data)
+        sim.run(t_end=0.05)
+        self.assertTrue(numpy.all(sim.data['time']==0.05))
+
+if __name__ == '__main__':
+
+    unittest.main()
@@ -0,0 +1,361 @@
+import unittest
+import os
+import numpy
+
+# A checkpoint file holds the array state of a simulation: an 8 byte magic
+# string, the format version and header length as little endian uint32, a
+# json header, and then one chunk per array, each starting on a 64 byte
+# boundary so it can be memory mapped in place. The header records every
+# chunk's dtype, shape and offset from the start of the first chunk, the
+# clock, and the registered setup that rebuilds the physics. Controllers
+# that keep state between steps, like an adaptive mesh, are passed by name
+# and save their arrays through checkpointState as extra chunks named
+# owner.key, which restoreState hands back to them on restart. A time
+# step function with checkpointState is saved that way without asking.
+
+magic = b'SOBEKCHK'
+format_version = 1
+alignment = 64
+
+# Setups are functions that take keyword parameters and return a data
+# dictionary for Simulation. Callables cannot be saved, so a checkpoint
+# stores the setup name and its parameters instead.
+setups = {}
+
+def register_setup(name, factory):
+
+    setups[name] = factory
+
+def calc_module_name(factory):
+
+    # A setup registered by a script reports __main__, which a restart
+    # from another script would not find, so name the script's module
+    import sys
+
+    module = factory.__module__
+    main = sys.modules.get(module)
+    if module != '__main__' or getattr(main, '__file__', None) is None:
+        return module
+    module = os.path.splitext(os.path.basename(main.__file__))[0]
+    if getattr(main, '__package__', None):
+        module = main.__package__+'.'+module
+    return module
+
+def build_simulation(name, parameters={}, simulation_class=None):
+
+    from simulation import Simulation
+
+    if simulation_class is None:
+        simulation_class = Simulation
+    data = setups[name](**parameters)
+    data['setup'] = {'name':name,
+                     'module':calc_module_name(setups[name]),
+                     'parameters':dict(parameters)}
+    return simulation_class(data)
+
+def aligned(offset):
+
+    return -(-offset//alignment)*alignment
+
+def write_checkpoint(sim, path, controllers={}):
+
+    import json
+    import struct
+
+    data = sim.data
+    arrays = [('grid', numpy.asarray(data['grid']), {}),
+              ('time', numpy.asarray(data['time'], dtype='d'), {}),
+              ('cells', data['cells'].storage, {'fields':data['cells'].fields,
+                                                'ghost_cells':data['cells'].ghost_cells}),
+              ('extensive', data['extensive'].storage, {'fields':data['extensive'].fields,
+                                                        'ghost_cells':data['extensive'].ghost_cells})]
+    for owner, controller in sorted(calc_controllers(sim, controllers).items()):
+        for key, value in sorted(controller.checkpointState().items()):
+            if value is not None:
+                arrays.append((owner+'.'+key, numpy.asarray(value), {}))
+    chunks = []
+    offset = 0
+    for name, array, extra in arrays:
+        chunk = {'name':name,
+                 'dtype':array.dtype.newbyteorder('<').str,
+                 'shape':list(array.shape),
+                 'offset':offset}
+        chunk.update(extra)
+        chunks.append(chunk)
+        offset = aligned(offset+array.nbytes)
+    header = json.dumps({'cycle':int(data['cycle']),
+                         'simulation_class':sim.__class__.__name__,
+                         'setup':data.get('setup'),
+                         'chunks':chunks}, sort_keys=True).encode('utf-8')
+
+    temp_path = path+'.part'
+    with open(temp_path, 'wb') as f:
+        f.write(magic)
+        f.write(struct.pack('<II', format_version, len(header)))
+        f.write(header)
+        start = aligned(f.tell())
+        for chunk, (name, array, extra) in zip(chunks, arrays):
+            f.write(b'\0'*(start+chunk['offset']-f.tell()))
+            f.write(numpy.ascontiguousarray(array, dtype=chunk['dtype']).tobytes())
+    os.rename(temp_path, path)
+
+def read_checkpoint(path, mmap=True):
+
+    import json
+    import struct
+
+    with open(path, 'rb') as f:
+        if f.read(len(magic)) != magic:
+            raise ValueError(path+' is not a sobek checkpoint')
+        version, header_length = struct.unpack('<II', f.read(8))
+        if version > format_version:
+            raise ValueError('checkpoint format version '+str(version)+
+                             ' is newer than the supported version '+str(format_version))
+        header = json.loads(f.read(header_length).decode('utf-8'))
+        start = aligned(f.tell())
+        arrays = {}
+        for chunk in header['chunks']:
+            shape = tuple(chunk['shape'])
+            if mmap and numpy.prod(shape) > 0:
+                arrays[chunk['name']] = numpy.memmap(path, dtype=chunk['dtype'], mode='r',
+                                                     offset=start+chunk['offset'], shape=shape)
+            else:
+                f.seek(start+chunk['offset'])
+                arrays[chunk['name']] = numpy.fromfile(f, dtype=chunk['dtype'],
+                                                       count=int(numpy.prod(shape))).reshape(shape)
+    header['version'] = version
+    return header, arrays
+
+def calc_controllers(sim, controllers):
+
+    res = dict(controllers)
+    if hasattr(sim.data['time_step_function'], 'checkpointState'):
+        res.setdefault('time_step_function', sim.data['time_step_function'])
+    return res
+
+def restore_state(sim, header, arrays, controllers={}):
+
+    from grid import Grid
+    from hydro_state import HydroState
+
+    data = sim.data
+    if data['cells'].storage.shape != arrays['cells'].shape:
+        # A refined or coarsened run only differs in the number of cells
+        if data['cells'].storage.shape[:-1] != arrays['cells'].shape[:-1]:
+            raise ValueError('checkpoint cells do not fit the simulation')
+        chunk = [chunk for chunk in header['chunks'] if chunk['name'] == 'extensive'][0]
+        storage = numpy.array(arrays['extensive'])
+        extensive = HydroState(storage.shape[1:-1]+(len(arrays['grid'])-1,), chunk['fields'],
+                               ghost_cells=chunk['ghost_cells'], storage=storage)
+        sim.remesh(Grid(arrays['grid'], data['grid'].geometry), extensive)
+    data['grid'].faces = numpy.array(arrays['grid'])
+    data['grid'].update_metrics()
+    data['cells'].storage[...] = arrays['cells']
+    data['extensive'].storage[...] = arrays['extensive']
+    if numpy.ndim(arrays['time']) == 0:
+        data['time'] = float(arrays['time'])
+    else:
+        data['time'] = numpy.array(arrays['time'])
+    data['cycle'] = header['cycle']
+    for owner, controller in calc_controllers(sim, controllers).items():
+        prefix = owner+'.'
+        controller.restoreState(dict((name[len(prefix):], numpy.array(array))
+                                     for name, array in arrays.items()
+                                     if name.startswith(prefix)))
+
+def restart(path, simulation_class=None, controllers={}):
+
+    import importlib
+
+    header, arrays = read_checkpoint(path)
+    setup = header['setup']
+    if setup is None:
+        raise ValueError(path+' was not written from a registered setup')
+    if setup['name'] not in setups:
+        importlib.import_module(setup['module'])
+    sim = build_simulation(setup['name'], setup['parameters'], simulation_class)
+    restore_state(sim, header, arrays, controllers)
+    return sim
+
+class CheckpointWriter:
+
+    def __init__(self, directory, keep=2, controllers={}):
+
+        self.directory = directory
+        self.keep = keep
+        self.controllers = controllers
+        self.written = []
+
+    def __call__(self, sim):
+
+        if not os.path.isdir(self.directory):
+            os.makedirs(self.directory)
+        path = os.path.join(self.directory, 'checkpoint_%08d.sbk' % sim.data['cycle'])
+        write_checkpoint(sim, path, self.controllers)
+        self.written.append(path)
+        while len(self.written) > self.keep:
+            os.remove(self.written.pop(0))
+
+def make_shock_tube(n=40, ratio=2.0):
+
+    from ideal_gas import IdealGas
+    from simple_cfl import SimpleCFL
+    from eulerian import Eulerian
+    from boundaries import BoundaryConditions, Outflow
+    from simple_extensive_updater import simple_extensive_updater
+    from simple_cell_updater import simple_cell_updater
+    from physical_geometry import spherical_geometry
+
+    grid = numpy.linspace(1, 2, n+1)
+    data = {}
+    data['grid'] = grid
+    data['cells'] = {'density':numpy.ones(n),
+                     'pressure':numpy.where(grid[:-1]<1.5, ratio, 1.0),
+                     'velocity':numpy.zeros(n)}
+    data['equation_of_state'] = IdealGas(5./3.)
+    data['physical_geometry'] = spherical_geometry
+    data['time_step_function'] = SimpleCFL(0.3)
+    data['grid_motion'] = Eulerian()
+    data['boundary_conditions'] = BoundaryConditions(Outflow(), Outflow())
+    data['extensive_updater'] = simple_extensive_updater
+    data['cell_updater'] = simple_cell_updater
+    return data
+
+register_setup('shock_tube', make_shock_tube)
+
+class TestCheckpoint(unittest.TestCase):
+
+    def setUp(self):
+
+        import tempfile
+
+        self.directory = tempfile.mkdtemp()
+
+    def tearDown(self):
+
+        import shutil
+
+        shutil.rmtree(self.directory)
+
+    def test_restart_continues_bit_for_bit(self):
+
+        sim = build_simulation('shock_tube', {'ratio':5.0})
+        sim.run(max_cycles=10)
+        path = os.path.join(self.directory, 'a.sbk')
+        write_checkpoint(sim, path)
+        sim.run(max_cycles=25)
+        restarted = restart(path)
+        self.assertEqual(restarted.data['cycle'], 10)
+        restarted.run(max_cycles=25)
+        self.assertEqual(restarted.data['time'], sim.data['time'])
+        self.assertTrue(numpy.array_equal(restarted.data['cells'].storage,
+                                          sim.data['cells'].storage))
+        self.assertTrue(numpy.array_equal(restarted.data['extensive'].storage,
+                                          sim.data['extensive'].storage))
+
+    def test_restart_after_refinement(self):
+
+        from adaptive_mesh import AdaptiveMesh, GradientCriterion
+
+        def make_mesh():
+            return AdaptiveMesh([GradientCriterion('density'), GradientCriterion('pressure')],
+                                every=5)
+
+        sim = build_simulation('shock_tube', {'ratio':10.0})
+        mesh = make_mesh()
+        sim.run(max_cycles=12, callbacks=[mesh])
+        self.assertNotEqual(len(sim.data['grid']), 41)
+        path = os.path.join(self.directory, 'a.sbk')
+        write_checkpoint(sim, path, {'mesh':mesh})
+        sim.run(max_cycles=30, callbacks=[mesh])
+        restarted_mesh = make_mesh()
+        restarted = restart(path, controllers={'mesh':restarted_mesh})
+        self.assertEqual(restarted.data['cycle'], 12)
+        restarted.run(max_cycles=30, callbacks=[restarted_mesh])
+        self.assertEqual(restarted.data['time'], sim.data['time'])
+        self.assertTrue(numpy.array_equal(restarted.data['grid'].faces, sim.data['grid'].faces))
+        self.assertTrue(numpy.array_equal(restarted.data['cells'].storage,
+                                          sim.data['cells'].storage))
+        self.assertTrue(numpy.array_equal(restarted_mesh.levels, mesh.levels))
+        self.assertTrue(numpy.array_equal(restarted_mesh.indices, mesh.indices))
+
+    def test_restart_keeps_time_step_state(self):
+
+        from signal_speed_cfl import SignalSpeedCFL
+
+        def make_setup(ratio):
+            data = make_shock_tube(ratio=ratio)
+            data['time_step_function'] = SignalSpeedCFL(0.3)
+            return data
+
+        register_setup('signal_speed_shock_tube', make_setup)
+        sim = build_simulation('signal_speed_shock_tube', {'ratio':10.0})
+        sim.run(max_cycles=10)
+        path = os.path.join(self.directory, 'a.sbk')
+        write_checkpoint(sim, path)
+        sim.run(max_cycles=25)
+        restarted = restart(path)
+        cfl = restarted.data['time_step_function']
+        self.assertTrue(cfl.fresh)
+        restarted.run(max_cycles=25)
+        self.assertEqual(restarted.data['time'], sim.data['time'])
+        self.assertTrue(numpy.array_equal(restarted.data['cells'].storage,
+                                          sim.data['cells'].storage))
+        self.assertEqual(cfl.last_dt, sim.data['time_step_function'].last_dt)
+
+    def test_scripts_record_their_module(self):
+
+        import sys
+        import types
+
+        def factory():
+            pass
+
+        factory.__module__ = '__main__'
+        main = sys.modules['__main__']
+        script = types.ModuleType('__main__')
+        script.__file__ = os.path.join(self.directory, 'run_bondi.py')
+        sys.modules['__main__'] = script
+        try:
+            self.assertEqual(calc_module_name(factory), 'run_bondi')
+            script.__package__ = 'sobek'
+            self.assertEqual(calc_module_name(factory), 'sobek.run_bondi')
+        finally:
+            sys.modules['__main__'] = main
+        self.assertEqual(calc_module_name(make_shock_tube), make_shock_tube.__module__)
+
+    def test_chunks_are_memory_mapped(self):
+
+        sim = build_simulation('shock_tube')
+        sim.run(max_cycles=3)
+        path = os.path.join(self.directory, 'a.sbk')
+        write_checkpoint(sim, path)
+        header, arrays = read_checkpoint(path)
+        self.assertEqual(header['version'], format_version)
+        self.assertTrue(isinstance(arrays['cells'], numpy.memmap))
+        self.assertEqual(arrays['cells'].shape, (5, 42))
+        self.assertEqual(header['chunks'][2]['fields'], sim.data['cells'].fields)
+        self.assertTrue(numpy.array_equal(arrays['grid'], sim.data['grid'].faces))
+
+    def test_rejects_newer_versions(self):
+
+        import struct
+
+        path = os.path.join(self.directory, 'a.sbk')
+        with open(path, 'wb') as f:
+            f.write(magic+struct.pack('<II', format_version+1, 2)+b'{}')
+        self.assertRaises(ValueError, read_checkpoint, path)
+
+    def test_writer_keeps_latest(self):
+
+        from callbacks import Scheduled
+
+        sim = build_simulation('shock_tube')
+        writer = CheckpointWriter(self.directory, keep=2)
+        sim.run(max_cycles=9, callbacks=[Scheduled(writer, cycle_interval=2)])
+        self.assertEqual(sorted(os.listdir(self.directory)),
+                         ['checkpoint_00000006.sbk', 'checkpoint_00000008.sbk'])
+
+if __name__ == '__main__':
+
+    unittest.main()
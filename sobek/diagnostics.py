@@ -0,0 +1,237 @@
+import unittest
+import numpy
+
+# A reduction maps the simulation to one number per run (or one per member
+# of an ensemble), using whole-array numpy operations.
+
+def calc_total_mass(sim):
+
+    return numpy.sum(sim.data['extensive']['mass'], axis=-1)
+
+def calc_total_momentum(sim):
+
+    return numpy.sum(sim.data['extensive']['momentum'], axis=-1)
+
+def calc_total_energy(sim):
+
+    return numpy.sum(sim.data['extensive']['energy'], axis=-1)
+
+def calc_max_mach(sim):
+
+    cells = sim.data['cells']
+    return numpy.max(numpy.abs(cells['velocity'])/cells['sound_speed'], axis=-1)
+
+def calc_accretion_rate(sim):
+
+    cells = sim.data['cells']
+    return -sim.data['grid'].areas[0]*cells['density'][...,0]*cells['velocity'][...,0]
+
+reductions = {}
+
+def register_reduction(name, func):
+
+    reductions[name] = func
+
+register_reduction('total_mass', calc_total_mass)
+register_reduction('total_momentum', calc_total_momentum)
+register_reduction('total_energy', calc_total_energy)
+register_reduction('max_mach', calc_max_mach)
+register_reduction('accretion_rate', calc_accretion_rate)
+
+class ColumnStore:
+
+    # Rows live in a preallocated array that doubles when full. With a path
+    # the array is only a write buffer: rows are appended to a raw float64
+    # file, described by a json file next to it, which open_column_store
+    # memory maps.
+
+    def __init__(self, columns, capacity=1024, path=None):
+
+        import json
+
+        self.columns = list(columns)
+        self.index = dict((column, k) for k, column in enumerate(self.columns))
+        self.rows = numpy.empty((capacity, len(self.columns)))
+        self.size = 0
+        self.path = path
+        self.flushed = 0
+        self.file = None
+        if path is not None:
+            with open(path+'.json', 'w') as f:
+                json.dump({'columns':self.columns, 'dtype':'<f8'}, f)
+            self.file = open(path, 'wb')
+
+    def append(self, row):
+
+        if self.size == len(self.rows):
+            if self.file is not None:
+                self.flush()
+                self.size = 0
+            else:
+                rows = numpy.empty((2*len(self.rows), len(self.columns)))
+                rows[:self.size] = self.rows
+                self.rows = rows
+        self.rows[self.size] = row
+        self.size += 1
+
+    def flush(self):
+
+        if self.file is None:
+            return
+        self.file.write(self.rows[self.flushed:self.size].astype('<f8').tobytes())
+        self.file.flush()
+        self.flushed = self.size
+        if self.flushed == len(self.rows):
+            self.flushed = 0
+
+    def __len__(self):
+
+        if self.file is None:
+            return self.size
+        return self.file.tell()//(8*len(self.columns))+self.size-self.flushed
+
+    def __getitem__(self, column):
+
+        if self.file is None:
+            return self.rows[:self.size,self.index[column]]
+        self.flush()
+        return open_column_store(self.path)[column]
+
+    def close(self):
+
+        if self.file is not None:
+            self.flush()
+            self.file.close()
+
+def open_column_store(path):
+
+    import json
+
+    with open(path+'.json') as f:
+        header = json.load(f)
+    columns = header['columns']
+    rows = numpy.memmap(path, dtype=header['dtype'], mode='r')
+    rows = rows.reshape(-1, len(columns))
+    return dict((column, rows[:,k]) for k, column in enumerate(columns))
+
+class Diagnostics:
+
+    def __init__(self, names=None, every=1, capacity=1024, path=None):
+
+        if names is None:
+            names = ['total_mass','total_momentum','total_energy','max_mach']
+        self.names = names
+        self.every = every
+        self.capacity = capacity
+        self.path = path
+        self.store = None
+
+    def start(self, values):
+
+        # Ensembles give one column per member, named field_k
+        columns = ['cycle','time']
+        self.widths = []
+        for name, value in zip(self.names, values):
+            width = numpy.size(value)
+            self.widths.append(width)
+            if numpy.ndim(value) == 0:
+                columns.append(name)
+            else:
+                columns.extend(name+'_'+str(k) for k in range(width))
+        self.row = numpy.empty(len(columns))
+        self.store = ColumnStore(columns, self.capacity, self.path)
+
+    def __call__(self, sim):
+
+        if sim.data['cycle']%self.every != 0:
+            return
+        values = [reductions[name](sim) for name in self.names]
+        if self.store is None:
+            self.start(values)
+        self.row[0] = sim.data['cycle']
+        self.row[1] = numpy.min(sim.data['time'])
+        k = 2
+        for width, value in zip(self.widths, values):
+            self.row[k:k+width] = numpy.ravel(value)
+            k += width
+        self.store.append(self.row)
+
+    def __getitem__(self, column):
+
+        return self.store[column]
+
+    def close(self):
+
+        if self.store is not None:
+            self.store.close()
+
+class TestDiagnostics(unittest.TestCase):
+
+    def make_data(self):
+
+        from boundaries import BoundaryConditions, Reflective
+        from physical_geometry import planar_geometry
+        from checkpoint import make_shock_tube
+
+        data = make_shock_tube()
+        data['physical_geometry'] = planar_geometry
+        data['boundary_conditions'] = BoundaryConditions(Reflective(), Reflective())
+        return data
+
+    def test_conservation_in_closed_box(self):
+
+        from simulation import Simulation
+
+        data = self.make_data()
+        data['diagnostics'] = Diagnostics(names=['total_mass','total_energy','max_mach','accretion_rate'],
+                                          capacity=4)
+        sim = Simulation(data)
+        sim.run(max_cycles=30)
+        diagnostics = sim.data['diagnostics']
+        self.assertEqual(list(diagnostics['cycle']), range(1, 31))
+        self.assertEqual(diagnostics['time'][-1], sim.data['time'])
+        self.assertTrue(numpy.allclose(diagnostics['total_mass'], 1.0, rtol=1e-12))
+        self.assertTrue(numpy.allclose(diagnostics['total_energy'], diagnostics['total_energy'][0],
+                                       rtol=1e-12))
+        self.assertTrue(numpy.all(diagnostics['max_mach'] > 0))
+        self.assertEqual(diagnostics['accretion_rate'][0], 0)
+
+    def test_file_backed_store(self):
+
+        import os
+        import shutil
+        import tempfile
+        from simulation import Simulation
+
+        directory = tempfile.mkdtemp()
+        try:
+            path = os.path.join(directory, 'diagnostics.f8')
+            data = self.make_data()
+            data['diagnostics'] = Diagnostics(every=2, capacity=3, path=path)
+            sim = Simulation(data)
+            sim.run(max_cycles=20)
+            self.assertEqual(len(sim.data['diagnostics'].store), 10)
+            self.assertEqual(list(sim.data['diagnostics']['cycle']), range(2, 21, 2))
+            sim.data['diagnostics'].close()
+            columns = open_column_store(path)
+            self.assertTrue(isinstance(columns['cycle'], numpy.memmap))
+            self.assertEqual(list(columns['cycle']), range(2, 21, 2))
+        finally:
+            shutil.rmtree(directory)
+
+    def test_ensemble_columns(self):
+
+        from ensemble_simulation import EnsembleSimulation
+
+        data = self.make_data()
+        data['cells']['pressure'] = numpy.array([data['cells']['pressure'],
+                                                 2*data['cells']['pressure']])
+        diagnostics = Diagnostics(names=['total_energy'])
+        sim = EnsembleSimulation(data)
+        sim.run(max_cycles=3, callbacks=[diagnostics])
+        self.assertEqual(diagnostics.store.columns, ['cycle','time','total_energy_0','total_energy_1'])
+        self.assertTrue(diagnostics['total_energy_1'][0] > diagnostics['total_energy_0'][0])
+
+if __name__ == '__main__':
+
+    unittest.main()
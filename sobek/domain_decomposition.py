@@ -0,0 +1,159 @@
+import unittest
+import numpy
+
+def shared_hydro_state(shape, fields, ghost_cells=0):
+
+    from multiprocessing.sharedctypes import RawArray
+    from hydro_state import HydroState
+
+    if numpy.ndim(shape)==0:
+        shape = (int(shape),)
+    storage_shape = (len(fields),)+tuple(shape[:-1])+(shape[-1]+2*ghost_cells,)
+    raw = RawArray('d', int(numpy.prod(storage_shape)))
+    storage = numpy.frombuffer(raw, dtype='d').reshape(storage_shape)
+    return HydroState(shape, fields, ghost_cells=ghost_cells, storage=storage)
+
+def calc_block_edges(n, blocks):
+
+    return [(n*k)//blocks for k in range(blocks+1)]
+
+def worker_loop(connection, data, velocities, lo, hi):
+
+    from hydro_state import HydroState, conserved_fields
+
+    geometry = data['physical_geometry']
+    eos = data['equation_of_state']
+    grid = data['grid'].block(lo, hi)
+    cells = data['cells'].block(lo, hi)
+    extensive = data['extensive'].block(lo, hi)
+    fluxes = HydroState(hi-lo+1, conserved_fields)
+    velocity_list = velocities[lo:hi+1]
+    riemann_solver = data['flux_calculator'].riemann_solver
+    while True:
+        command, dt = connection.recv()
+        if command == 'time_step':
+            connection.send(data['time_step_function'](grid, cells))
+        elif command == 'flux':
+            left_states, right_states = cells.interface_states()
+            riemann_solver(left_states, right_states, velocity_list, out=fluxes)
+            connection.send(None)
+        elif command == 'update':
+            data['extensive_updater'](grid, cells, extensive, fluxes, geometry, dt, out=extensive)
+            data['cell_updater'](grid, extensive, eos, geometry, cells, out=cells)
+            connection.send(None)
+        else:
+            connection.send(None)
+            break
+
+class DomainDecomposition:
+
+    def __init__(self, data, blocks):
+
+        import multiprocessing
+        from multiprocessing.sharedctypes import RawArray
+        from boundaries import BoundaryFluxCalculator
+
+        if not isinstance(data['flux_calculator'], BoundaryFluxCalculator):
+            raise ValueError('domain decomposition needs boundary_conditions and a BoundaryFluxCalculator')
+        if data['flux_calculator'].reconstruction is not None:
+            raise ValueError('domain decomposition does not support reconstruction')
+        if len(data['cells'].shape) != 1:
+            raise ValueError('domain decomposition only supports a single one dimensional run')
+        self.data = data
+        n = len(data['grid'])-1
+        self.velocities = numpy.frombuffer(RawArray('d', n+1), dtype='d')
+        self.connections = []
+        self.workers = []
+        edges = calc_block_edges(n, blocks)
+        for lo, hi in zip(edges[:-1], edges[1:]):
+            parent, child = multiprocessing.Pipe()
+            worker = multiprocessing.Process(target=worker_loop,
+                                             args=(child, data, self.velocities, lo, hi))
+            worker.daemon = True
+            worker.start()
+            self.connections.append(parent)
+            self.workers.append(worker)
+
+    def broadcast(self, command, dt=None):
+
+        for connection in self.connections:
+            connection.send((command, dt))
+        return [connection.recv() for connection in self.connections]
+
+    def timeAdvance(self, clip=None):
+
+        # SimpleCFL-like time step functions return cfl/max over cells, so
+        # the minimum over blocks is exactly the serial value.
+        dt = min(self.broadcast('time_step'))
+        if clip is not None:
+            dt = clip(dt)
+        grid_velocity = self.data['grid_motion'](self.data['grid'], self.data['cells'])
+        if numpy.any(grid_velocity):
+            raise ValueError('domain decomposition needs a static grid')
+        self.velocities[...] = grid_velocity
+        self.data['boundary_conditions'](self.data['grid'], self.data['cells'])
+        self.broadcast('flux')
+        self.broadcast('update', dt)
+        return dt
+
+    def close(self):
+
+        if self.workers:
+            self.broadcast('close')
+            for worker in self.workers:
+                worker.join()
+        self.workers = []
+        self.connections = []
+
+class TestDomainDecomposition(unittest.TestCase):
+
+    def make_data(self):
+
+        from ideal_gas import IdealGas
+        from simple_cfl import SimpleCFL
+        from eulerian import Eulerian
+        from boundaries import BoundaryConditions, Outflow, Reflective
+        from simple_extensive_updater import simple_extensive_updater
+        from simple_cell_updater import simple_cell_updater
+        from physical_geometry import spherical_geometry
+
+        grid = numpy.linspace(1, 2, 101)
+        data = {}
+        data['grid'] = grid
+        data['cells'] = {'density':numpy.ones(100),
+                         'pressure':numpy.where(grid[:-1]<1.5, 2.0, 1.0),
+                         'velocity':numpy.zeros(100)}
+        data['equation_of_state'] = IdealGas(5./3.)
+        data['physical_geometry'] = spherical_geometry
+        data['time_step_function'] = SimpleCFL(0.3)
+        data['grid_motion'] = Eulerian()
+        data['boundary_conditions'] = BoundaryConditions(Reflective(), Outflow())
+        data['extensive_updater'] = simple_extensive_updater
+        data['cell_updater'] = simple_cell_updater
+        return data
+
+    def test_matches_serial_run(self):
+
+        from simulation import Simulation
+
+        serial = Simulation(self.make_data())
+        data = self.make_data()
+        data['domain_blocks'] = 3
+        parallel = Simulation(data)
+        try:
+            for i in range(30):
+                serial.timeAdvance()
+                parallel.timeAdvance()
+        finally:
+            parallel.close()
+        self.assertEqual(serial.data['time'], parallel.data['time'])
+        for field in serial.data['cells'].fields:
+            self.assertTrue(numpy.array_equal(serial.data['cells'][field],
+                                              parallel.data['cells'][field]))
+        for field in serial.data['extensive'].fields:
+            self.assertTrue(numpy.array_equal(serial.data['extensive'][field],
+                                              parallel.data['extensive'][field]))
+
+if __name__ == '__main__':
+
+    unittest.main()
@@ -0,0 +1,228 @@
+import unittest
+import numpy
+
+from simulation import Simulation
+
+class EnsembleSimulation(Simulation):
+
+    # Members differ in their initial cells and in any source or inflow
+    # parameters given as arrays with one value per member, such as the
+    # mass of PointMassGravity, the rate and exponent of MassInjection or
+    # the state of FixedInflow. They share one static grid and equation of
+    # state, so resolution, the adiabatic index and moving grids still
+    # need separate simulations.
+
+    def __init__(self, data):
+
+        import warnings
+        from eulerian import Eulerian
+
+        if not isinstance(data['grid_motion'], Eulerian):
+            raise ValueError('ensemble members share one grid, which cannot move')
+        if isinstance(data['equation_of_state'], (list, tuple)):
+            raise ValueError('ensemble members share one equation_of_state, '
+                             'run separate simulations to vary it')
+        if data.get('local_time_stepping'):
+            raise ValueError('local time stepping is not supported with ensembles')
+        Simulation.__init__(self, data)
+        if self.fused_step is not None:
+            warnings.warn('the numba backend does not support ensembles, using numpy')
+            self.fused_step = None
+        self.data['time'] = numpy.zeros(self.data['cells'].shape[0])
+
+    def calcStateShape(self):
+
+        members = self.data.get('ensemble_size')
+        if members is None:
+            members = max(numpy.shape(self.data['cells'][field])[0]
+                          for field in ['density','pressure','velocity']
+                          if numpy.ndim(self.data['cells'][field])==2)
+        return (members, len(self.data['grid'])-1)
+
+    def calcTimeStep(self):
+
+        dt = numpy.asarray(Simulation.calcTimeStep(self), dtype='d')
+        if self.data.get('shared_time_step', False):
+            dt = numpy.min(dt)*numpy.ones_like(dt)
+        return dt.reshape(-1, 1)
+
+    def clipTimeStep(self, dt, t_end):
+
+        return numpy.minimum(dt, (t_end-self.data['time']).reshape(-1, 1))
+
+    def advanceClock(self, dt, t_end=None):
+
+        if t_end is None:
+            self.data['time'] += dt[:,0]
+        else:
+            clipped = dt[:,0] == t_end-self.data['time']
+            self.data['time'] += dt[:,0]
+            self.data['time'][clipped] = t_end
+        self.data['cycle'] += 1
+
+    def member(self, index):
+
+        return dict((field, self.data['cells'][field][index])
+                    for field in self.data['cells'].fields)
+
+class TestEnsembleSimulation(unittest.TestCase):
+
+    def make_data(self, pressure):
+
+        from ideal_gas import IdealGas
+        from simple_cfl import SimpleCFL
+        from eulerian import Eulerian
+        from boundaries import BoundaryConditions, Outflow
+        from simple_extensive_updater import simple_extensive_updater
+        from simple_cell_updater import simple_cell_updater
+        from physical_geometry import spherical_geometry
+
+        grid = numpy.linspace(1, 2, 31)
+        data = {}
+        data['grid'] = grid
+        data['cells'] = {'density':numpy.ones(30),
+                         'pressure':pressure,
+                         'velocity':numpy.zeros(30)}
+        data['equation_of_state'] = IdealGas(5./3.)
+        data['physical_geometry'] = spherical_geometry
+        data['time_step_function'] = SimpleCFL(0.3)
+        data['grid_motion'] = Eulerian()
+        data['boundary_conditions'] = BoundaryConditions(Outflow(), Outflow())
+        data['extensive_updater'] = simple_extensive_updater
+        data['cell_updater'] = simple_cell_updater
+        return data
+
+    def make_pressures(self):
+
+        r_list = numpy.linspace(1, 2, 31)[:-1]
+        return [numpy.where(r_list<1.5, ratio, 1.0) for ratio in [2.0, 5.0, 10.0]]
+
+    def test_matches_separate_runs(self):
+
+        pressures = self.make_pressures()
+        ensemble = EnsembleSimulation(self.make_data(numpy.array(pressures)))
+        singles = [Simulation(self.make_data(pressure)) for pressure in pressures]
+        for i in range(20):
+            ensemble.timeAdvance()
+            for sim in singles:
+                sim.timeAdvance()
+        for n, sim in enumerate(singles):
+            self.assertAlmostEqual(ensemble.data['time'][n], sim.data['time'])
+            for field in sim.data['cells'].fields:
+                self.assertTrue(numpy.allclose(ensemble.data['cells'][field][n],
+                                               sim.data['cells'][field],
+                                               rtol=1e-12))
+
+    def test_rejects_unsupported_configurations(self):
+
+        from ideal_gas import IdealGas
+        from lagrangian import Lagrangian
+
+        data = self.make_data(numpy.array(self.make_pressures()))
+        data['grid_motion'] = Lagrangian(data['boundary_conditions'])
+        self.assertRaises(ValueError, EnsembleSimulation, data)
+        data = self.make_data(numpy.array(self.make_pressures()))
+        data['equation_of_state'] = [IdealGas(5./3.), IdealGas(1.4), IdealGas(1.1)]
+        self.assertRaises(ValueError, EnsembleSimulation, data)
+
+    def make_bondi_data(self, mass, exponent):
+
+        from ideal_gas import IdealGas
+        from simple_cfl import SimpleCFL
+        from eulerian import Eulerian
+        from boundaries import BoundaryConditions, CustomBoundary
+        from simple_extensive_updater import simple_extensive_updater
+        from simple_cell_updater import simple_cell_updater
+        from physical_geometry import spherical_geometry
+        from source_terms import PointMassGravity, GeometricPressureSource, MassInjection
+
+        def sink(grid, cells, neighbour):
+            return {'density':cells.padded('density')[...,neighbour]/10,
+                    'pressure':cells.padded('pressure')[...,neighbour]/10,
+                    'energy':cells.padded('energy')[...,neighbour],
+                    'sound_speed':cells.padded('sound_speed')[...,neighbour],
+                    'velocity':0}
+
+        data = {}
+        data['grid'] = numpy.logspace(-1, 1, 30)
+        data['cells'] = {'density':1e-9*numpy.ones(29),
+                         'pressure':1e-9*numpy.ones(29),
+                         'velocity':numpy.zeros(29)}
+        data['equation_of_state'] = IdealGas(5./3.)
+        data['physical_geometry'] = spherical_geometry
+        data['time_step_function'] = SimpleCFL(0.3)
+        data['grid_motion'] = Eulerian()
+        data['boundary_conditions'] = BoundaryConditions(CustomBoundary(sink), CustomBoundary(sink))
+        data['extensive_updater'] = simple_extensive_updater
+        data['cell_updater'] = simple_cell_updater
+        data['source_terms'] = [PointMassGravity(mass),
+                                GeometricPressureSource(2),
+                                MassInjection(rate=1.0, exponent=exponent, wind_velocity=1.0)]
+        return data
+
+    def test_per_member_source_parameters(self):
+
+        masses = [1e-3, 1e-1]
+        exponents = [-2.5, -2.0]
+        data = self.make_bondi_data(numpy.array(masses), numpy.array(exponents))
+        data['ensemble_size'] = 2
+        ensemble = EnsembleSimulation(data)
+        singles = [Simulation(self.make_bondi_data(mass, exponent))
+                   for mass, exponent in zip(masses, exponents)]
+        for i in range(50):
+            ensemble.timeAdvance()
+            for sim in singles:
+                sim.timeAdvance()
+        for n, sim in enumerate(singles):
+            self.assertAlmostEqual(ensemble.data['time'][n], sim.data['time'], delta=1e-14)
+            for field in sim.data['cells'].fields:
+                self.assertTrue(numpy.allclose(ensemble.data['cells'][field][n],
+                                               sim.data['cells'][field],
+                                               rtol=1e-12))
+        self.assertFalse(numpy.allclose(ensemble.data['cells']['velocity'][0],
+                                        ensemble.data['cells']['velocity'][1]))
+
+    def test_per_member_inflow(self):
+
+        from boundaries import BoundaryConditions, FixedInflow, Outflow
+
+        states = [{'density':1.0, 'pressure':1.0, 'velocity':0.1},
+                  {'density':2.0, 'pressure':3.0, 'velocity':0.5}]
+
+        def make_data(state):
+            data = self.make_data(numpy.ones(30))
+            data['boundary_conditions'] = BoundaryConditions(FixedInflow(state, data['equation_of_state']),
+                                                             Outflow())
+            return data
+
+        data = make_data(dict((field, numpy.array([state[field] for state in states]))
+                              for field in states[0]))
+        data['ensemble_size'] = 2
+        ensemble = EnsembleSimulation(data)
+        singles = [Simulation(make_data(state)) for state in states]
+        ensemble.run(max_cycles=10)
+        for n, sim in enumerate(singles):
+            sim.run(max_cycles=10)
+            self.assertTrue(numpy.allclose(ensemble.data['cells'].storage[:,n],
+                                           sim.data['cells'].storage, rtol=1e-12))
+
+    def test_live_view_is_rejected(self):
+
+        from live_view import LiveView
+
+        ensemble = EnsembleSimulation(self.make_data(numpy.array(self.make_pressures())))
+        ensemble.timeAdvance()
+        self.assertRaises(ValueError, LiveView(renderer=lambda frame, dropped: None), ensemble)
+
+    def test_shared_time_step(self):
+
+        data = self.make_data(numpy.array(self.make_pressures()))
+        data['shared_time_step'] = True
+        ensemble = EnsembleSimulation(data)
+        ensemble.timeAdvance()
+        ensemble.timeAdvance()
+        self.assertTrue(numpy.all(ensemble.data['time']==ensemble.data['time'][0]))
+
+if __name__ == '__main__':
+
+    unittest.main()
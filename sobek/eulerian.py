@@ -2,10 +2,12 @@ class Eulerian:
 
     def __init__(self):
     
-        pass
+        self.velocities = None
         
     def __call__(self, grid, cells):
     
         import numpy
     
-        return numpy.zeros_like(grid)
\ No newline at end of file
+        if self.velocities is None or len(self.velocities) != len(grid):
+            self.velocities = numpy.zeros(len(grid))
+        return self.velocities
@@ -1,8 +1,11 @@
+import unittest
+
 class FluxConditionAction:
 
-    def __init__(self, ca_list):
+    def __init__(self, ca_list, vectorised=False):
     
         self.ca_list = ca_list
+        self.vectorised = vectorised
         
     def calcSingleFlux(self, grid, cells, velocity_list, i):
     
@@ -10,11 +13,133 @@ class FluxConditionAction:
             if case['condition'](grid, cells, velocity_list, i):
                 return case['action'](grid, cells, velocity_list, i)
         
-    def __call__(self, grid, cells, velocity_list):
+    def calcVectorisedFlux(self, grid, cells, velocity_list, out=None):
+
+        import numpy
+        from hydro_state import make_output, conserved_fields
+
+        res = make_output(out, len(velocity_list), conserved_fields)
+        remaining = numpy.ones(len(velocity_list), dtype=bool)
+        for case in self.ca_list:
+            selected = numpy.flatnonzero(numpy.logical_and(case['condition'](grid, cells, velocity_list),
+                                                           remaining))
+            if len(selected) == 0:
+                continue
+            remaining[selected] = False
+            fluxes = case['action'](grid, cells, velocity_list, selected)
+            for field in conserved_fields:
+                res[field][selected] = fluxes[field]
+        if numpy.any(remaining):
+            raise ValueError('no condition matched interfaces '+str(numpy.flatnonzero(remaining)))
+        return res
+        
+    def __call__(self, grid, cells, velocity_list, out=None):
     
         import numpy
+        from stage_stats import count_event
     
+        if self.vectorised:
+            return self.calcVectorisedFlux(grid, cells, velocity_list, out=out)
+        count_event('fallbacks')
+
         def wrapper(i):
             return self.calcSingleFlux(grid,cells,velocity_list, i)
         #return [self.calcSingleFlux(grid, cells, velocity_list, i) for i in range(len(velocity_list))]
-        return numpy.vectorize(wrapper)(range(len(velocity_list)))
\ No newline at end of file
+        return numpy.vectorize(wrapper)(range(len(velocity_list)))
+
+class RiemannAction:
+
+    # Fills the ghost cells before reading the states on either side of the
+    # selected interfaces, so it can also serve the outermost ones.
+
+    def __init__(self, boundary_conditions, riemann_solver=None):
+
+        from vectorised_hllc import calc_batched_hllc
+
+        if riemann_solver is None:
+            riemann_solver = calc_batched_hllc
+        self.boundary_conditions = boundary_conditions
+        self.riemann_solver = riemann_solver
+
+    def __call__(self, grid, cells, velocity_list, indices):
+
+        left_states, right_states = self.boundary_conditions.interface_states(grid, cells)
+        return self.riemann_solver(dict((field, left_states[field][indices]) for field in cells.fields),
+                                   dict((field, right_states[field][indices]) for field in cells.fields),
+                                   velocity_list[indices])
+
+class TestFluxConditionAction(unittest.TestCase):
+
+    def test_first_match_wins(self):
+
+        import numpy
+        from ideal_gas import IdealGas
+        from hydro_state import HydroState, primitive_fields
+        from boundaries import BoundaryConditions, Outflow
+        from vectorised_hllc import calc_batched_hllc
+
+        eos = IdealGas(5./3.)
+        cells = HydroState(6, primitive_fields, ghost_cells=1)
+        cells['density'] = 1+numpy.arange(6.0)
+        cells['pressure'] = 1+numpy.arange(6.0)[::-1]
+        cells['energy'] = eos.vectorised_dp2e(cells['density'], cells['pressure'])
+        cells['sound_speed'] = eos.vectorised_dp2c(cells['density'], cells['pressure'])
+        boundary_conditions = BoundaryConditions(Outflow(), Outflow())
+        velocity_list = numpy.zeros(7)
+
+        def wall(grid, cells, velocity_list, indices):
+            return {'mass':numpy.zeros(len(indices)),
+                    'momentum':-numpy.ones(len(indices)),
+                    'energy':numpy.zeros(len(indices))}
+
+        fca = FluxConditionAction([{'condition':lambda grid, cells, velocity_list:
+                                    numpy.arange(len(velocity_list))<2,
+                                    'action':wall},
+                                   {'condition':lambda grid, cells, velocity_list:
+                                    numpy.ones(len(velocity_list), dtype=bool),
+                                    'action':RiemannAction(boundary_conditions)},
+                                   {'condition':lambda grid, cells, velocity_list:
+                                    numpy.arange(len(velocity_list))==0,
+                                    'action':None}],
+                                  vectorised=True)
+        res = fca(None, cells, velocity_list)
+        self.assertEqual(cells.padded('density')[-1], 6)
+        left_states, right_states = cells.interface_states()
+        expected = calc_batched_hllc(left_states, right_states, velocity_list)
+        self.assertEqual(list(res['momentum'][:2]), [-1, -1])
+        for field in ['mass','momentum','energy']:
+            self.assertTrue(numpy.allclose(res[field][2:], expected[field][2:]))
+
+    def test_steps_a_simulation(self):
+
+        import numpy
+        from checkpoint import make_shock_tube
+        from simulation import Simulation
+
+        reference = Simulation(make_shock_tube())
+        data = make_shock_tube()
+        data['flux_calculator'] = FluxConditionAction([{'condition':lambda grid, cells, velocity_list:
+                                                        numpy.ones(len(velocity_list), dtype=bool),
+                                                        'action':RiemannAction(data['boundary_conditions'])}],
+                                                      vectorised=True)
+        sim = Simulation(data)
+        for i in range(5):
+            reference.timeAdvance()
+            sim.timeAdvance()
+        self.assertEqual(sim.data['time'], reference.data['time'])
+        self.assertTrue(numpy.allclose(sim.data['cells'].storage, reference.data['cells'].storage,
+                                       rtol=1e-14))
+
+    def test_unmatched_interfaces(self):
+
+        import numpy
+
+        fca = FluxConditionAction([{'condition':lambda grid, cells, velocity_list:
+                                    numpy.zeros(len(velocity_list), dtype=bool),
+                                    'action':None}],
+                                  vectorised=True)
+        self.assertRaises(ValueError, fca, None, None, numpy.zeros(3))
+
+if __name__ == '__main__':
+
+    unittest.main()
@@ -0,0 +1,142 @@
+import unittest
+import numpy
+
+def evaluate_geometry(func, faces):
+
+    res = numpy.empty_like(faces)
+    try:
+        res[...] = func(faces)
+    except TypeError:
+        from stage_stats import count_event
+        count_event('fallbacks')
+        res[...] = numpy.vectorize(func)(faces)
+    return res
+
+class Grid:
+
+    def __init__(self, faces, geometry=None):
+
+        self.faces = numpy.array(faces, dtype='d')
+        self.geometry = geometry
+        self.update_metrics()
+
+    def update_metrics(self):
+
+        self.centres = 0.5*(self.faces[1:]+self.faces[:-1])
+        self.widths = numpy.diff(self.faces)
+        if self.geometry is None:
+            self.areas = None
+            self.volumes = None
+        else:
+            self.areas = evaluate_geometry(self.geometry['area'], self.faces)
+            self.volumes = numpy.diff(evaluate_geometry(self.geometry['volume'], self.faces))
+
+    def move(self, face_velocities, dt):
+
+        if not numpy.any(face_velocities):
+            return
+        self.faces = self.faces+dt*numpy.asarray(face_velocities)
+        self.update_metrics()
+
+    def block(self, lo, hi):
+
+        import copy
+
+        res = copy.copy(self)
+        res.faces = self.faces[lo:hi+1]
+        res.centres = self.centres[lo:hi]
+        res.widths = self.widths[lo:hi]
+        if self.areas is not None:
+            res.areas = self.areas[lo:hi+1]
+            res.volumes = self.volumes[lo:hi]
+        return res
+
+    def take(self, indices):
+
+        # The metrics of scattered cells, which share no faces
+        import copy
+
+        res = copy.copy(self)
+        res.faces = None
+        res.areas = None
+        res.centres = self.centres[indices]
+        res.widths = self.widths[indices]
+        if self.volumes is not None:
+            res.volumes = self.volumes[indices]
+        return res
+
+    def __array__(self, dtype=None):
+
+        if dtype is None:
+            return self.faces
+        return self.faces.astype(dtype)
+
+    def __len__(self):
+
+        return len(self.faces)
+
+    def __getitem__(self, index):
+
+        return self.faces[index]
+
+def as_grid(grid, geometry=None):
+
+    if isinstance(grid, Grid):
+        return grid
+    return Grid(grid, geometry)
+
+class TestGrid(unittest.TestCase):
+
+    def test_spherical_metrics(self):
+
+        from physical_geometry import spherical_geometry
+
+        faces = numpy.logspace(-1, 1, 11)
+        grid = Grid(faces, spherical_geometry)
+        self.assertTrue(numpy.allclose(grid.areas, 4*numpy.pi*faces**2))
+        self.assertTrue(numpy.allclose(grid.volumes, numpy.diff(4*numpy.pi*faces**3/3)))
+        self.assertTrue(numpy.allclose(grid.centres, 0.5*(faces[1:]+faces[:-1])))
+        self.assertTrue(numpy.allclose(grid.widths, numpy.diff(faces)))
+
+    def test_planar_area_is_broadcast(self):
+
+        from physical_geometry import planar_geometry
+
+        grid = Grid(numpy.linspace(0, 1, 5), planar_geometry)
+        self.assertEqual(list(grid.areas), [1, 1, 1, 1, 1])
+
+    def test_metrics_only_change_when_faces_move(self):
+
+        from physical_geometry import planar_geometry
+
+        grid = Grid(numpy.linspace(0, 1, 5), planar_geometry)
+        volumes = grid.volumes
+        grid.move(numpy.zeros(5), 0.1)
+        self.assertTrue(grid.volumes is volumes)
+        grid.move(numpy.linspace(0, 1, 5), 0.1)
+        self.assertAlmostEqual(grid.faces[-1], 1.1)
+        self.assertAlmostEqual(grid.volumes[-1], 0.275)
+
+    def test_block_metrics(self):
+
+        from physical_geometry import spherical_geometry
+
+        grid = Grid(numpy.linspace(1, 2, 11), spherical_geometry)
+        block = grid.block(3, 7)
+        self.assertEqual(len(block), 5)
+        self.assertTrue(numpy.array_equal(block.areas, grid.areas[3:8]))
+        self.assertTrue(numpy.array_equal(block.volumes, grid.volumes[3:7]))
+        self.assertTrue(numpy.array_equal(block.widths, grid.widths[3:7]))
+
+    def test_take_metrics(self):
+
+        from physical_geometry import spherical_geometry
+
+        grid = Grid(numpy.linspace(1, 2, 11), spherical_geometry)
+        cells = grid.take(numpy.array([0, 4, 9]))
+        self.assertTrue(numpy.array_equal(cells.volumes, grid.volumes[[0, 4, 9]]))
+        self.assertTrue(numpy.array_equal(cells.centres, grid.centres[[0, 4, 9]]))
+
+if __name__ == '__main__':
+
+    unittest.main()
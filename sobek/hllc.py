@@ -43,9 +43,10 @@ class HLLC:
     
         import numpy
     
-        local_left = numpy.copy(left)
+        fields = ['density','pressure','velocity','energy','sound_speed']
+        local_left = dict((field, left[field]) for field in fields)
         local_left['velocity'] -= velocity
-        local_right = numpy.copy(right)
+        local_right = dict((field, right[field]) for field in fields)
         local_right['velocity'] -= velocity
         
         ul = primitive2conserved(local_left)
@@ -62,13 +63,13 @@ class HLLC:
         if ws['left']>0:
             res = fl
         elif ws['left']<=0 and ws['center']>=0:
-            res = numpy.array(zip(*(fl[field]+ws['left']*(usl[field]-ul[field]) for field in fl.dtype.names)),
+            res = numpy.array(tuple(fl[field]+ws['left']*(usl[field]-ul[field]) for field in fl.dtype.names),
                               dtype=[(field,'d') for field in fl.dtype.names])
 #            res = {}
 #            for field in fl:
 #                res[field] = fl[field] + ws['left']*(usl[field]-ul[field])
         elif ws['center']<0 and ws['right']>=0:
-            res = numpy.array(zip(*(fr[field]+ws['right']*(usr[field]-ur[field]) for field in fr.dtype.names)),
+            res = numpy.array(tuple(fr[field]+ws['right']*(usr[field]-ur[field]) for field in fr.dtype.names),
                               dtype=[(field,'d') for field in fr.dtype.names])
             #res = fr + ws['right']*(usr-ur)
             #res = {}
@@ -90,8 +91,8 @@ class TestHLLC(unittest.TestCase):
         eos = IdealGas(5./3.)        
         d = 1.0
         primitive = {'density':d,'pressure':d/eos.g,'velocity':0}
-        primitive['energy'] = eos.dp2e(primitive['density'], primitive['pressure'], None)
-        primitive['sound_speed'] = eos.dp2c(primitive['density'], primitive['pressure'], None)
+        primitive['energy'] = eos.dp2e(primitive['density'], primitive['pressure'])
+        primitive['sound_speed'] = eos.dp2c(primitive['density'], primitive['pressure'])
         temp = calc_wave_speeds(primitive, primitive)
         self.assertEqual(temp['center'],0)
         self.assertEqual(temp['left'],-1)
@@ -110,8 +111,8 @@ class TestHLLC(unittest.TestCase):
         eos = IdealGas(5./3.)        
         d = 1.0
         primitive = {'density':d,'pressure':d/eos.g,'velocity':0}
-        primitive['energy'] = eos.dp2e(primitive['density'], primitive['pressure'], None)
-        primitive['sound_speed'] = eos.dp2c(primitive['density'], primitive['pressure'], None)
+        primitive['energy'] = eos.dp2e(primitive['density'], primitive['pressure'])
+        primitive['sound_speed'] = eos.dp2c(primitive['density'], primitive['pressure'])
         rs = HLLC()
         temp = rs(primitive, primitive, 0)
         self.assertEqual(temp['mass'],0)
@@ -0,0 +1,160 @@
+import unittest
+import numpy
+
+primitive_fields = ['density','pressure','velocity','energy','sound_speed']
+conserved_fields = ['mass','momentum','energy']
+
+class HydroState:
+
+    def __init__(self, shape, fields, ghost_cells=0, storage=None):
+
+        if numpy.ndim(shape)==0:
+            shape = (int(shape),)
+        self.shape = tuple(shape)
+        self.fields = list(fields)
+        self.ghost_cells = ghost_cells
+        if storage is None:
+            from stage_stats import count_event
+            count_event('allocations')
+            storage = numpy.zeros((len(self.fields),)+
+                                  self.shape[:-1]+
+                                  (self.shape[-1]+2*ghost_cells,))
+        self.storage = storage
+        self.padded_views = {}
+        self.views = {}
+        for n, field in enumerate(self.fields):
+            self.padded_views[field] = storage[n]
+            self.views[field] = storage[n][...,ghost_cells:ghost_cells+self.shape[-1]]
+        self.scratch_buffers = {}
+
+    @classmethod
+    def from_fields(cls, source, fields=None, ghost_cells=0):
+
+        if fields is None:
+            fields = source_fields(source)
+        first = numpy.asarray(source[fields[0]])
+        res = cls(first.shape, fields, ghost_cells=ghost_cells)
+        res.assign(source)
+        return res
+
+    def __getitem__(self, field):
+
+        return self.views[field]
+
+    def __setitem__(self, field, value):
+
+        self.views[field][...] = value
+
+    def __len__(self):
+
+        return self.shape[0]
+
+    def __contains__(self, field):
+
+        return field in self.views
+
+    def __repr__(self):
+
+        return 'HydroState('+', '.join(field+'='+repr(self.views[field])
+                                       for field in self.fields)+')'
+
+    @property
+    def dtype(self):
+
+        return numpy.dtype([(field,'d') for field in self.fields])
+
+    def padded(self, field):
+
+        return self.padded_views[field]
+
+    def interface_states(self):
+
+        g = self.ghost_cells
+        assert(g>0)
+        n = self.shape[-1]
+        left = HydroState(self.shape[:-1]+(n+1,), self.fields,
+                          storage=self.storage[...,g-1:g+n])
+        right = HydroState(self.shape[:-1]+(n+1,), self.fields,
+                           storage=self.storage[...,g:g+n+1])
+        return left, right
+
+    def block(self, lo, hi):
+
+        g = self.ghost_cells
+        return HydroState(self.shape[:-1]+(hi-lo,), self.fields, ghost_cells=g,
+                          storage=self.storage[...,lo:hi+2*g])
+
+    def assign(self, source):
+
+        for field in self.fields:
+            if field in source_fields(source):
+                self.views[field][...] = source[field]
+
+    def copy(self):
+
+        res = HydroState(self.shape, self.fields, ghost_cells=self.ghost_cells)
+        res.storage[...] = self.storage
+        return res
+
+    def scratch(self, name, shape=None, dtype='d'):
+
+        if shape is None:
+            shape = self.shape
+        elif numpy.ndim(shape)==0:
+            shape = (int(shape),)
+        buf = self.scratch_buffers.get(name)
+        if buf is None or buf.shape != tuple(shape) or buf.dtype != dtype:
+            from stage_stats import count_event
+            count_event('allocations')
+            buf = numpy.empty(shape, dtype=dtype)
+            self.scratch_buffers[name] = buf
+        return buf
+
+def source_fields(source):
+
+    if isinstance(source, HydroState):
+        return source.fields
+    if isinstance(source, dict):
+        return list(source.keys())
+    return list(source.dtype.names)
+
+def make_output(out, shape, fields):
+
+    if out is None:
+        return HydroState(shape, fields)
+    return out
+
+class TestHydroState(unittest.TestCase):
+
+    def test_interface_states_are_views(self):
+
+        state = HydroState(3, ['density'], ghost_cells=1)
+        state['density'] = [1.0, 2.0, 3.0]
+        state.padded('density')[0] = 0.5
+        state.padded('density')[-1] = 4.0
+        left, right = state.interface_states()
+        self.assertEqual(list(left['density']), [0.5, 1.0, 2.0, 3.0])
+        self.assertEqual(list(right['density']), [1.0, 2.0, 3.0, 4.0])
+        state['density'][1] = 7.0
+        self.assertEqual(left['density'][2], 7.0)
+        self.assertEqual(right['density'][1], 7.0)
+
+    def test_blocks_share_storage(self):
+
+        state = HydroState(6, ['density'], ghost_cells=1)
+        state['density'] = numpy.arange(6.0)
+        block = state.block(2, 4)
+        self.assertEqual(list(block['density']), [2.0, 3.0])
+        self.assertEqual(list(block.padded('density')), [1.0, 2.0, 3.0, 4.0])
+        block['density'][0] = 7.0
+        self.assertEqual(state['density'][2], 7.0)
+
+    def test_scratch_is_reused(self):
+
+        state = HydroState(5, conserved_fields)
+        self.assertTrue(state.scratch('a') is state.scratch('a'))
+        self.assertEqual(state.scratch('b', 6).shape, (6,))
+
+if __name__ == '__main__':
+
+    unittest.main()
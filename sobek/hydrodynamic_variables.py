@@ -6,17 +6,17 @@ def calc_total_energy_density(p):
 
 def primitive2conserved(primitive):
 
-    return numpy.array([(primitive['density'],
-                         primitive['density']*primitive['velocity'],
-                         calc_total_energy_density(primitive))],
-                         dtype=[('mass','f4'),('momentum','f4'),('energy','f4')])
+    return numpy.array((primitive['density'],
+                        primitive['density']*primitive['velocity'],
+                        calc_total_energy_density(primitive)),
+                        dtype=[('mass','d'),('momentum','d'),('energy','d')])
             
 def primitive2flux(primitive):
 
-    return numpy.array([primitive['density']*primitive['velocity'],
+    return numpy.array((primitive['density']*primitive['velocity'],
                         primitive['pressure']+primitive['density']*primitive['velocity']**2,
-                        (calc_total_energy_density(primitive)+primitive['pressure'])*primitive['velocity']],
-                        dtype=[('mass','f4'),('momentum','f4'),('energy','f4')])
+                        (calc_total_energy_density(primitive)+primitive['pressure'])*primitive['velocity']),
+                        dtype=[('mass','d'),('momentum','d'),('energy','d')])
             
 def conserved2primitive(c, eos):
 
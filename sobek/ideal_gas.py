@@ -26,6 +26,30 @@ class IdealGas:
     
         return math.sqrt(self.g*p/d)
         
+    def vectorised_de2p(self, d, e, out=None):
+    
+        import numpy
+        
+        res = numpy.multiply(d, e, out=out)
+        res *= self.g-1
+        return res
+        
+    def vectorised_dp2e(self, d, p, out=None):
+    
+        import numpy
+        
+        res = numpy.divide(p, d, out=out)
+        res /= self.g-1
+        return res
+        
+    def vectorised_dp2c(self, d, p, out=None):
+    
+        import numpy
+        
+        res = numpy.divide(p, d, out=out)
+        res *= self.g
+        return numpy.sqrt(res, out=out)
+        
 
 class TestIdealGas(unittest.TestCase):
 
@@ -35,7 +59,7 @@ class TestIdealGas(unittest.TestCase):
         d = 5.0
         e = 7.0
         eos = IdealGas(g)
-        self.assertEqual(eos.de2p(d,e,None),(g-1)*d*e)
+        self.assertEqual(eos.de2p(d,e),(g-1)*d*e)
         
     def test_dp2e(self):
     
@@ -43,7 +67,7 @@ class TestIdealGas(unittest.TestCase):
         d = 4.0
         p = 11.0
         eos = IdealGas(g)
-        self.assertEqual(eos.dp2e(d,p,None),p/d/(g-1))
+        self.assertEqual(eos.dp2e(d,p),p/d/(g-1))
         
     def test_dp2c(self):
     
@@ -53,7 +77,22 @@ class TestIdealGas(unittest.TestCase):
         d = 9.0
         p = 2.5
         eos = IdealGas(g)
-        self.assertEqual(eos.dp2c(d,p,None),math.sqrt(g*p/d))
+        self.assertEqual(eos.dp2c(d,p),math.sqrt(g*p/d))
+        
+    def test_vectorised_matches_scalar(self):
+    
+        import numpy
+    
+        eos = IdealGas(5./3.)
+        d_list = numpy.array([0.1, 1.0, 9.0, 1e3])
+        p_list = numpy.array([2.5, 1e-3, 4.0, 7.0])
+        e_list = eos.vectorised_dp2e(d_list, p_list)
+        for d, p, e, c, p2 in zip(d_list, p_list, e_list,
+                                  eos.vectorised_dp2c(d_list, p_list),
+                                  eos.vectorised_de2p(d_list, e_list)):
+            self.assertAlmostEqual(e, eos.dp2e(d,p))
+            self.assertAlmostEqual(c, eos.dp2c(d,p))
+            self.assertAlmostEqual(p2, p)
         
 if __name__ == '__main__':
 
@@ -0,0 +1,227 @@
+import unittest
+import math
+
+try:
+    from numba import jit
+except ImportError:
+    jit = None
+
+def optional_jit(func):
+
+    if jit is None:
+        return func
+    return jit(nopython=True, cache=True)(func)
+
+@optional_jit
+def calc_wave_speeds(dl, pl, vl, cl, dr, pr, vr, cr):
+
+    sl = min(vl-cl,vr-cr)
+    sr = max(vl+cl,vr+cr)
+    ss = (pr-pl+dl*vl*(sl-vl)-dr*vr*(sr-vr))/(dl*(sl-vl)-dr*(sr-vr))
+    return sl, sr, ss
+
+@optional_jit
+def calc_starred_state(dk, pk, vk, ek, sk, ss):
+
+    ds = dk*(sk-vk)/(sk-ss)
+    return (ds,
+            ds*ss,
+            dk*(ek+0.5*vk**2)*ds/dk+ds*(ss-vk)*(ss+pk/dk/(sk-vk)))
+
+@optional_jit
+def calc_hllc_flux(dl, pl, vl, el, cl, dr, pr, vr, er, cr, velocity):
+
+    vl = vl - velocity
+    vr = vr - velocity
+    sl, sr, ss = calc_wave_speeds(dl, pl, vl, cl, dr, pr, vr, cr)
+    if sl>0 or (sr>=0 and ss>=0):
+        dk, pk, vk, ek, sk = dl, pl, vl, el, sl
+    else:
+        dk, pk, vk, ek, sk = dr, pr, vr, er, sr
+    fm = dk*vk
+    fp = dk*vk**2+pk
+    fe = dk*vk*(0.5*vk**2+ek+pk/dk)
+    if sl<=0 and sr>=0:
+        usm, usp, use = calc_starred_state(dk, pk, vk, ek, sk, ss)
+        fm += sk*(usm-dk)
+        fp += sk*(usp-dk*vk)
+        fe += sk*(use-dk*(ek+0.5*vk**2))
+    fe += fp*velocity+0.5*fm*velocity**2
+    fp += velocity*fm
+    return fm, fp, fe
+
+@optional_jit
+def fused_update(density, pressure, velocity, energy, sound_speed,
+                 face_velocities, areas, volumes, dt, g,
+                 mass, momentum, total_energy):
+
+    # Primitive arrays include one ghost cell on each side. The new
+    # primitives of cell i are written once the flux on its right face has
+    # been computed, so they never feed back into a flux of this step.
+    n = len(mass)
+    fm, fp, fe = calc_hllc_flux(density[0], pressure[0], velocity[0], energy[0], sound_speed[0],
+                                density[1], pressure[1], velocity[1], energy[1], sound_speed[1],
+                                face_velocities[0])
+    left_mass = fm*areas[0]*dt
+    left_momentum = fp*areas[0]*dt
+    left_energy = fe*areas[0]*dt
+    for i in range(n):
+        j = i+1
+        fm, fp, fe = calc_hllc_flux(density[j], pressure[j], velocity[j], energy[j], sound_speed[j],
+                                    density[j+1], pressure[j+1], velocity[j+1], energy[j+1], sound_speed[j+1],
+                                    face_velocities[j])
+        right_mass = fm*areas[j]*dt
+        right_momentum = fp*areas[j]*dt
+        right_energy = fe*areas[j]*dt
+        mass[i] -= right_mass-left_mass
+        momentum[i] -= right_momentum-left_momentum
+        total_energy[i] -= right_energy-left_energy
+        left_mass = right_mass
+        left_momentum = right_momentum
+        left_energy = right_energy
+
+        d = mass[i]/volumes[i]
+        v = momentum[i]/mass[i]
+        e = total_energy[i]/mass[i]-v*v*0.5
+        p = d*e*(g-1)
+        density[j] = d
+        velocity[j] = v
+        energy[j] = e
+        pressure[j] = p
+        sound_speed[j] = math.sqrt(p/d*g)
+
+class FusedStep:
+
+    def __init__(self, eos):
+
+        self.g = eos.g
+
+    def __call__(self, grid, cells, extensive, grid_velocity, geometry, dt):
+
+        import numpy
+        from grid import as_grid
+
+        # Fluxes go through the faces at the start of the step, primitives
+        # are recovered in the volumes at its end.
+        grid = as_grid(grid, geometry)
+        area_list = grid.areas
+        grid.move(grid_velocity, dt)
+        fused_update(cells.padded('density'),
+                     cells.padded('pressure'),
+                     cells.padded('velocity'),
+                     cells.padded('energy'),
+                     cells.padded('sound_speed'),
+                     numpy.asarray(grid_velocity, dtype='d'),
+                     area_list, grid.volumes, dt, self.g,
+                     extensive['mass'], extensive['momentum'], extensive['energy'])
+
+def select_fused_step(data):
+
+    import warnings
+    from simple_extensive_updater import simple_extensive_updater
+    from simple_cell_updater import simple_cell_updater
+    from boundaries import BoundaryFluxCalculator
+    from vectorised_hllc import calc_batched_hllc
+
+    backend = data.get('backend', 'numpy')
+    flux_calculator = data.get('flux_calculator')
+    if backend == 'numpy':
+        return None
+    if backend != 'numba':
+        raise ValueError('unknown backend '+str(backend))
+    if jit is None:
+        reason = 'numba is not installed'
+    elif not hasattr(data['equation_of_state'], 'g'):
+        reason = 'the equation of state is not an ideal gas'
+    elif 'boundary_conditions' not in data:
+        reason = 'no boundary_conditions were given'
+    elif (not isinstance(flux_calculator, BoundaryFluxCalculator) or
+          flux_calculator.riemann_solver is not calc_batched_hllc):
+        reason = 'custom flux calculators cannot be fused'
+    elif (data['extensive_updater'] is not simple_extensive_updater or
+          data['cell_updater'] is not simple_cell_updater):
+        reason = 'custom updaters cannot be fused'
+    elif data.get('source_terms') is not None:
+        reason = 'source terms cannot be fused'
+    elif flux_calculator.reconstruction is not None:
+        reason = 'reconstruction cannot be fused'
+    else:
+        return FusedStep(data['equation_of_state'])
+    warnings.warn('numba backend unavailable ('+reason+'), using numpy')
+    return None
+
+class TestFusedUpdate(unittest.TestCase):
+
+    def test_matches_numpy_path(self):
+
+        import numpy
+        from ideal_gas import IdealGas
+        from hydro_state import HydroState, primitive_fields, conserved_fields
+        from vectorised_hllc import calc_batched_hllc
+        from simple_extensive_updater import simple_extensive_updater
+        from simple_cell_updater import simple_cell_updater
+        from physical_geometry import spherical_geometry
+
+        eos = IdealGas(5./3.)
+        from grid import Grid
+
+        grid = Grid(numpy.linspace(1, 2, 21), spherical_geometry)
+        cells = HydroState(20, primitive_fields, ghost_cells=1)
+        cells.padded('density')[...] = 1+numpy.random.rand(22)
+        cells.padded('pressure')[...] = 1+numpy.random.rand(22)
+        cells.padded('velocity')[...] = numpy.random.rand(22)-0.5
+        cells.padded('energy')[...] = eos.vectorised_dp2e(cells.padded('density'), cells.padded('pressure'))
+        cells.padded('sound_speed')[...] = eos.vectorised_dp2c(cells.padded('density'), cells.padded('pressure'))
+        volume_list = grid.volumes
+        extensive = HydroState(20, conserved_fields)
+        extensive['mass'] = cells['density']*volume_list
+        extensive['momentum'] = extensive['mass']*cells['velocity']
+        extensive['energy'] = extensive['mass']*(cells['energy']+0.5*cells['velocity']**2)
+        grid_velocity = numpy.zeros(len(grid))
+        dt = 1e-3
+
+        left, right = cells.interface_states()
+        fluxes = calc_batched_hllc(left, right, grid_velocity)
+        expected_extensive = simple_extensive_updater(grid, cells, extensive, fluxes, spherical_geometry, dt)
+        expected_cells = simple_cell_updater(grid, expected_extensive, eos, spherical_geometry, cells)
+        FusedStep(eos)(grid, cells, extensive, grid_velocity, spherical_geometry, dt)
+        for field in conserved_fields:
+            self.assertTrue(numpy.allclose(extensive[field], expected_extensive[field], rtol=1e-12))
+        for field in primitive_fields:
+            self.assertTrue(numpy.allclose(cells[field], expected_cells[field], rtol=1e-12))
+
+    def test_custom_flux_calculators_are_not_fused(self):
+
+        import warnings
+        import jit_kernels
+        from ideal_gas import IdealGas
+        from boundaries import BoundaryConditions, BoundaryFluxCalculator, Outflow
+        from flux_condition_action import FluxConditionAction
+        from vectorised_hllc import calc_vectorised_hllc
+        from simple_extensive_updater import simple_extensive_updater
+        from simple_cell_updater import simple_cell_updater
+
+        boundary_conditions = BoundaryConditions(Outflow(), Outflow())
+        data = {'backend':'numba',
+                'equation_of_state':IdealGas(5./3.),
+                'boundary_conditions':boundary_conditions,
+                'extensive_updater':simple_extensive_updater,
+                'cell_updater':simple_cell_updater}
+        saved = jit_kernels.jit
+        jit_kernels.jit = lambda *args, **kwargs: None
+        try:
+            data['flux_calculator'] = BoundaryFluxCalculator(boundary_conditions)
+            self.assertTrue(isinstance(select_fused_step(data), FusedStep))
+            for flux_calculator in [BoundaryFluxCalculator(boundary_conditions, calc_vectorised_hllc),
+                                    FluxConditionAction([])]:
+                data['flux_calculator'] = flux_calculator
+                with warnings.catch_warnings(record=True) as caught:
+                    warnings.simplefilter('always')
+                    self.assertTrue(select_fused_step(data) is None)
+                self.assertTrue('custom flux calculators' in str(caught[0].message))
+        finally:
+            jit_kernels.jit = saved
+
+if __name__ == '__main__':
+
+    unittest.main()
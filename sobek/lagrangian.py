@@ -0,0 +1,165 @@
+import unittest
+import numpy
+
+class Lagrangian:
+
+    # Faces move with the HLLC contact speed between their neighbours, so
+    # little mass crosses them and the advective part of the flux vanishes.
+    # The boundary conditions fill the ghost cells first, so the outermost
+    # faces follow their boundary; fixed_edges pins them instead.
+
+    def __init__(self, boundary_conditions, fixed_edges=False):
+
+        self.boundary_conditions = boundary_conditions
+        self.fixed_edges = fixed_edges
+        self.velocities = None
+
+    def calcContactSpeeds(self, grid, cells):
+
+        from vectorised_hllc import calc_contact_speeds
+
+        left_states, right_states = self.boundary_conditions.interface_states(grid, cells)
+        if self.velocities is None or self.velocities.shape != left_states.shape:
+            self.velocities = numpy.empty(left_states.shape)
+        return calc_contact_speeds(left_states, right_states, out=self.velocities, scratch=cells)
+
+    def fixEdges(self, velocities):
+
+        if self.fixed_edges:
+            velocities[...,0] = 0
+            velocities[...,-1] = 0
+        return velocities
+
+    def __call__(self, grid, cells):
+
+        return self.fixEdges(self.calcContactSpeeds(grid, cells))
+
+class SmoothedALE(Lagrangian):
+
+    # Arbitrary Lagrangian Eulerian motion: the contact speeds are smoothed
+    # by passes of a 1-2-1 filter over the inner faces, which keeps shocks
+    # from squeezing cells together, and scaled by weight, from 0 (Eulerian)
+    # to 1 (smoothed Lagrangian).
+
+    def __init__(self, boundary_conditions, weight=0.5, passes=2, fixed_edges=False):
+
+        Lagrangian.__init__(self, boundary_conditions, fixed_edges)
+        self.weight = weight
+        self.passes = passes
+        self.smoothed = None
+
+    def __call__(self, grid, cells):
+
+        velocities = self.calcContactSpeeds(grid, cells)
+        if self.smoothed is None or self.smoothed.shape != velocities.shape:
+            self.smoothed = numpy.empty(velocities.shape)
+        smoothed = self.smoothed
+        for i in range(self.passes):
+            smoothed[...] = velocities
+            smoothed[...,1:-1] *= 2
+            smoothed[...,1:-1] += velocities[...,:-2]
+            smoothed[...,1:-1] += velocities[...,2:]
+            smoothed[...,1:-1] *= 0.25
+            velocities, smoothed = smoothed, velocities
+        velocities *= self.weight
+        if velocities is not self.velocities:
+            self.velocities[...] = velocities
+        return self.fixEdges(self.velocities)
+
+class TestLagrangian(unittest.TestCase):
+
+    def make_data(self, grid_motion=None):
+
+        from boundaries import BoundaryConditions, Reflective
+        from physical_geometry import planar_geometry
+        from checkpoint import make_shock_tube
+
+        data = make_shock_tube(ratio=10.0)
+        data['physical_geometry'] = planar_geometry
+        data['boundary_conditions'] = BoundaryConditions(Reflective(), Reflective())
+        if grid_motion is not None:
+            data['grid_motion'] = grid_motion(data['boundary_conditions'])
+        return data
+
+    def test_cells_keep_their_mass(self):
+
+        from simulation import Simulation
+
+        sim = Simulation(self.make_data(Lagrangian))
+        mass = sim.data['extensive']['mass'].copy()
+        energy = numpy.sum(sim.data['extensive']['energy'])
+        sim.run(max_cycles=40)
+        faces = sim.data['grid'].faces
+        self.assertEqual(faces[0], 1)
+        self.assertEqual(faces[-1], 2)
+        self.assertTrue(numpy.all(numpy.diff(faces) > 0))
+        self.assertTrue(numpy.max(numpy.abs(faces-numpy.linspace(1, 2, 41))) > 1e-3)
+        self.assertTrue(numpy.allclose(sim.data['extensive']['mass'], mass, rtol=1e-10))
+        self.assertAlmostEqual(numpy.sum(sim.data['extensive']['energy']), energy, delta=1e-12*energy)
+
+    def test_fixed_edges(self):
+
+        from boundaries import BoundaryConditions, Outflow
+        from simulation import Simulation
+
+        data = self.make_data()
+        data['boundary_conditions'] = BoundaryConditions(Outflow(), Outflow())
+        data['cells']['velocity'] = 0.1*numpy.ones(40)
+        data['grid_motion'] = Lagrangian(data['boundary_conditions'], fixed_edges=True)
+        sim = Simulation(data)
+        sim.run(max_cycles=10)
+        self.assertEqual(sim.data['grid'].faces[0], 1)
+        self.assertEqual(sim.data['grid'].faces[-1], 2)
+        self.assertTrue(sim.data['grid'].faces[1] > 1.025)
+
+    def test_supersonic_flow_takes_longer_steps(self):
+
+        from boundaries import BoundaryConditions, Outflow
+        from signal_speed_cfl import SignalSpeedCFL
+        from simulation import Simulation
+
+        def make_data(grid_motion):
+            data = self.make_data()
+            data['cells']['pressure'] = numpy.ones(40)
+            data['cells']['velocity'] = 10*numpy.ones(40)
+            data['boundary_conditions'] = BoundaryConditions(Outflow(), Outflow())
+            data['time_step_function'] = SignalSpeedCFL(0.3)
+            if grid_motion is not None:
+                data['grid_motion'] = grid_motion(data['boundary_conditions'])
+            return data
+
+        eulerian = Simulation(make_data(None))
+        lagrangian = Simulation(make_data(Lagrangian))
+        eulerian.run(max_cycles=30)
+        lagrangian.run(max_cycles=30)
+        self.assertTrue(lagrangian.data['time_step_function'].last_dt >
+                        5*eulerian.data['time_step_function'].last_dt)
+        self.assertTrue(numpy.allclose(lagrangian.data['cells']['density'], 1, rtol=1e-12))
+
+    def test_smoothing(self):
+
+        from simulation import Simulation
+
+        data = self.make_data()
+        sim = Simulation(data)
+        motion = SmoothedALE(data['boundary_conditions'], weight=0.5, passes=1)
+        contact = Lagrangian(data['boundary_conditions'])(sim.data['grid'], sim.data['cells']).copy()
+        velocities = motion(sim.data['grid'], sim.data['cells'])
+        self.assertTrue(velocities is motion.velocities)
+        expected = contact.copy()
+        expected[1:-1] = 0.25*contact[:-2]+0.5*contact[1:-1]+0.25*contact[2:]
+        self.assertTrue(numpy.allclose(velocities, 0.5*expected, rtol=1e-14))
+
+    def test_zero_weight_is_eulerian(self):
+
+        from simulation import Simulation
+
+        eulerian = Simulation(self.make_data())
+        ale = Simulation(self.make_data(lambda bc: SmoothedALE(bc, weight=0.0)))
+        eulerian.run(max_cycles=10)
+        ale.run(max_cycles=10)
+        self.assertTrue(numpy.array_equal(eulerian.data['cells'].storage, ale.data['cells'].storage))
+
+if __name__ == '__main__':
+
+    unittest.main()
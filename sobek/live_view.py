@@ -0,0 +1,266 @@
+import unittest
+import numpy
+
+# Frames travel from the solver to the renderer through a ring of slots in
+# shared memory. The solver never waits: it overwrites the oldest slot, and
+# the renderer always picks up the newest complete frame, so whatever it
+# was too slow to draw is dropped. A slot's sequence number is cleared
+# while it is being written, so a reader can detect frames torn by the
+# writer and skip them. The slots are sized when the renderer starts; a
+# refined grid that outgrows them gets a ring twice its size and a new
+# renderer process, so pass capacity up front when the mesh adapts.
+
+class FrameRing:
+
+    def __init__(self, fields, capacity, slots=4):
+
+        from multiprocessing.sharedctypes import RawArray
+
+        self.fields = list(fields)
+        self.capacity = capacity
+        self.slots = slots
+        rows = 1+len(self.fields)
+        # control holds the number of the latest frame and the closed flag
+        self.control = numpy.frombuffer(RawArray('d', 2), dtype='d')
+        self.sequence = numpy.frombuffer(RawArray('d', slots), dtype='d')
+        self.headers = numpy.frombuffer(RawArray('d', 3*slots), dtype='d').reshape(slots, 3)
+        self.buffers = numpy.frombuffer(RawArray('d', slots*rows*capacity),
+                                        dtype='d').reshape(slots, rows, capacity)
+
+    def write(self, time, cycle, x, values):
+
+        n = len(x)
+        if n > self.capacity:
+            return False
+        frame = self.control[0]+1
+        slot = int(frame)%self.slots
+        self.sequence[slot] = 0
+        self.headers[slot] = time, cycle, n
+        buf = self.buffers[slot]
+        buf[0,:n] = x
+        for k, field in enumerate(self.fields):
+            buf[k+1,:n] = values[field]
+        self.sequence[slot] = frame
+        self.control[0] = frame
+        return True
+
+    def read(self, last_frame=0):
+
+        frame = self.control[0]
+        if frame <= last_frame:
+            return None
+        slot = int(frame)%self.slots
+        if self.sequence[slot] != frame:
+            return None
+        time, cycle, n = self.headers[slot]
+        n = int(n)
+        buf = self.buffers[slot][:,:n].copy()
+        if self.sequence[slot] != frame:
+            return None
+        res = {'frame':int(frame), 'time':time, 'cycle':int(cycle), 'x':buf[0]}
+        for k, field in enumerate(self.fields):
+            res[field] = buf[k+1]
+        return res
+
+    def close(self):
+
+        self.control[1] = 1
+
+    def isClosed(self):
+
+        return self.control[1] != 0
+
+class MatplotlibRenderer:
+
+    def __init__(self, fields, logx=False, pause=0.05):
+
+        self.fields = fields
+        self.logx = logx
+        self.pause = pause
+        self.figure = None
+
+    def start(self, frame):
+
+        import matplotlib.pyplot as plt
+        plt.ion()
+
+        self.plt = plt
+        self.figure = plt.figure()
+        self.axes_list = [self.figure.add_subplot(len(self.fields),1,n+1)
+                          for n in range(len(self.fields))]
+        self.plots = {}
+        for axes, field in zip(self.axes_list, self.fields):
+            plot = axes.semilogx if self.logx else axes.plot
+            self.plots[field], = plot(frame['x'], frame[field])
+            axes.set_ylabel(field)
+
+    def __call__(self, frame, dropped):
+
+        if self.figure is None:
+            self.start(frame)
+        for axes, field in zip(self.axes_list, self.fields):
+            y_list = frame[field]
+            self.plots[field].set_data(frame['x'], y_list)
+            if field == 'velocity':
+                slack = 0.1*(numpy.max(y_list)-numpy.min(y_list))
+                axes.set_ylim((numpy.min(y_list)-slack, numpy.max(y_list)+slack))
+            else:
+                axes.set_ylim((numpy.min(y_list), numpy.max(y_list)))
+            axes.set_xlim((numpy.min(frame['x']), numpy.max(frame['x'])))
+        self.plt.suptitle('t = '+str(frame['time'])+', c = '+str(frame['cycle'])+
+                          ', dropped '+str(dropped))
+        self.plt.pause(self.pause)
+
+    def idle(self):
+
+        if self.figure is None:
+            import time
+            time.sleep(self.pause)
+        else:
+            self.plt.pause(self.pause)
+
+def render_loop(ring, renderer):
+
+    last_frame = 0
+    dropped = 0
+    while True:
+        closed = ring.isClosed()
+        frame = ring.read(last_frame)
+        if frame is not None:
+            dropped += frame['frame']-last_frame-1
+            last_frame = frame['frame']
+            renderer(frame, dropped)
+        elif closed:
+            break
+        else:
+            renderer.idle()
+
+class LiveView:
+
+    def __init__(self, fields=['density','pressure','velocity'], logx=False,
+                 slots=4, pause=0.05, renderer=None, capacity=None):
+
+        self.fields = fields
+        self.slots = slots
+        self.capacity = capacity
+        if renderer is None:
+            renderer = MatplotlibRenderer(fields, logx, pause)
+        self.renderer = renderer
+        self.ring = None
+        self.process = None
+
+    def start(self, sim, capacity=None):
+
+        import multiprocessing
+
+        if numpy.ndim(sim.data['time']) > 0 or len(sim.data['cells'].shape) > 1:
+            raise ValueError('the live view shows a single run, not an ensemble')
+        capacity = max(sim.data['cells'].shape[-1], capacity or 0, self.capacity or 0)
+        self.ring = FrameRing(self.fields, capacity, self.slots)
+        self.process = multiprocessing.Process(target=render_loop,
+                                               args=(self.ring, self.renderer))
+        self.process.daemon = True
+        self.process.start()
+
+    def __call__(self, sim):
+
+        if self.ring is None:
+            self.start(sim)
+        if self.write(sim):
+            return
+        import warnings
+        capacity = 2*sim.data['cells'].shape[-1]
+        warnings.warn('the grid outgrew the live view, restarting the renderer with room for '+
+                      str(capacity)+' cells')
+        self.close()
+        self.start(sim, capacity)
+        self.write(sim)
+
+    def write(self, sim):
+
+        return self.ring.write(sim.data['time'], sim.data['cycle'],
+                               sim.data['grid'].centres, sim.data['cells'])
+
+    def close(self, wait=True):
+
+        if self.ring is None:
+            return
+        self.ring.close()
+        if wait:
+            self.process.join()
+
+class TestLiveView(unittest.TestCase):
+
+    def test_ring_keeps_latest_frame(self):
+
+        ring = FrameRing(['density'], 5, slots=2)
+        self.assertTrue(ring.read() is None)
+        for cycle in range(1, 4):
+            ring.write(0.1*cycle, cycle, numpy.arange(3.0), {'density':cycle*numpy.ones(3)})
+        frame = ring.read()
+        self.assertEqual(frame['frame'], 3)
+        self.assertEqual(frame['cycle'], 3)
+        self.assertEqual(list(frame['density']), [3.0, 3.0, 3.0])
+        self.assertTrue(ring.read(3) is None)
+        self.assertFalse(ring.write(0, 4, numpy.arange(6.0), {'density':numpy.ones(6)}))
+
+    def test_torn_frame_is_skipped(self):
+
+        ring = FrameRing(['density'], 3)
+        ring.write(0, 1, numpy.arange(3.0), {'density':numpy.ones(3)})
+        ring.sequence[1] = 0
+        self.assertTrue(ring.read() is None)
+
+    def make_recorder(self):
+
+        import time
+        from multiprocessing.sharedctypes import RawArray
+
+        seen = numpy.frombuffer(RawArray('d', 3), dtype='d')
+
+        class Recorder:
+            def __call__(self, frame, dropped):
+                seen[0] = frame['cycle']
+                seen[1] = frame['density'][0]
+                seen[2] = len(frame['x'])
+            def idle(self):
+                time.sleep(1e-3)
+
+        return seen, Recorder()
+
+    def test_renderer_process(self):
+
+        from callbacks import TestCallbacks
+        from simulation import Simulation
+
+        seen, recorder = self.make_recorder()
+        sim = Simulation(TestCallbacks('test_max_cycles').make_data())
+        view = LiveView(renderer=recorder)
+        sim.run(max_cycles=20, callbacks=[view])
+        view.close()
+        self.assertEqual(seen[0], 20)
+        self.assertEqual(seen[1], sim.data['cells']['density'][0])
+
+    def test_ring_grows_with_refinement(self):
+
+        import warnings
+        from adaptive_mesh import AdaptiveMesh, GradientCriterion
+        from checkpoint import make_shock_tube
+        from simulation import Simulation
+
+        seen, recorder = self.make_recorder()
+        sim = Simulation(make_shock_tube(ratio=10.0))
+        mesh = AdaptiveMesh([GradientCriterion('pressure')], every=5)
+        view = LiveView(renderer=recorder)
+        with warnings.catch_warnings(record=True) as caught:
+            warnings.simplefilter('always')
+            sim.run(max_cycles=20, callbacks=[mesh, view])
+        view.close()
+        self.assertTrue(len(caught) > 0)
+        self.assertTrue(view.ring.capacity >= sim.data['cells'].shape[-1] > 40)
+        self.assertEqual(seen[0], 20)
+        self.assertEqual(seen[2], sim.data['cells'].shape[-1])
+
+if __name__ == '__main__':
+
+    unittest.main()
@@ -0,0 +1,254 @@
+import unittest
+import numpy
+
+# Cells are binned into levels: a cell on level l takes steps of dt*2**l,
+# where dt is the smallest step any cell allows, and neighbouring levels
+# differ by at most one. A macro step of dt*2**top is made of 2**top
+# substeps of dt. An interface belongs to the finer of its two cells and
+# is active on the substeps where its level starts a step; its flux times
+# its own step is taken from one cell and given to the other in the same
+# substep, so mass, momentum and energy are conserved exactly. Only the
+# active interfaces are reconstructed, and only the cells next to them
+# have their primitives recovered, so a substep costs as much as the
+# interfaces it updates plus the ghost cells.
+
+def calc_levels(time_steps, max_level):
+
+    dt = numpy.min(time_steps)
+    levels = numpy.floor(numpy.log2(time_steps/dt)).astype(int)
+    numpy.clip(levels, 0, max_level, out=levels)
+    while True:
+        smoothed = levels.copy()
+        smoothed[1:] = numpy.minimum(smoothed[1:], levels[:-1]+1)
+        smoothed[:-1] = numpy.minimum(smoothed[:-1], levels[1:]+1)
+        if numpy.array_equal(smoothed, levels):
+            return dt, levels
+        levels = smoothed
+
+class LevelGroup:
+
+    # The interfaces and cells that are active on the substeps where every
+    # level up to this one starts a step.
+
+    def __init__(self, dt, cell_levels, face_levels, level, areas, buffers, ghost_cells=1):
+
+        n = len(cell_levels)
+        self.faces = numpy.flatnonzero(face_levels <= level)
+        m = len(self.faces)
+        self.padded_left = self.faces+ghost_cells-1
+        self.padded_right = self.faces+ghost_cells
+        self.weights = areas[self.faces]*dt*2.0**face_levels[self.faces]
+        self.has_left = self.faces > 0
+        self.has_right = self.faces < n
+        self.left_cells = self.faces[self.has_left]-1
+        self.right_cells = self.faces[self.has_right]
+        touched = numpy.zeros(n, dtype=bool)
+        touched[self.left_cells] = True
+        touched[self.right_cells] = True
+        self.cells = numpy.flatnonzero(touched)
+        self.cell_dts = numpy.where(cell_levels <= level, dt*2.0**cell_levels, 0)
+        self.left_states = buffers.view('left_states', m)
+        self.right_states = buffers.view('right_states', m)
+        self.fluxes = buffers.view('fluxes', m)
+        self.velocities = buffers.zeros('velocities', m)
+        self.extensive = buffers.view('extensive', len(self.cells))
+        self.primitives = buffers.view('primitives', len(self.cells))
+
+class Buffers:
+
+    def __init__(self):
+
+        self.storages = {}
+
+    def view(self, name, m):
+
+        from hydro_state import HydroState, primitive_fields, conserved_fields
+
+        fields = primitive_fields if name in ['left_states', 'right_states', 'primitives'] else conserved_fields
+        storage = self.storages.get(name)
+        if storage is None or storage.shape[-1] < m:
+            storage = numpy.empty((len(fields), m))
+            self.storages[name] = storage
+        return HydroState(m, fields, storage=storage[...,:m])
+
+    def zeros(self, name, m):
+
+        storage = self.storages.get(name)
+        if storage is None or len(storage) < m:
+            storage = numpy.zeros(m)
+            self.storages[name] = storage
+        return storage[:m]
+
+class LocalTimeStepping:
+
+    def __init__(self, data, max_level=4):
+
+        from boundaries import BoundaryFluxCalculator
+        from simple_extensive_updater import simple_extensive_updater
+        from eulerian import Eulerian
+
+        if not isinstance(data['grid_motion'], Eulerian):
+            raise ValueError('local time stepping needs a static grid, use Eulerian grid_motion')
+        if not isinstance(data['flux_calculator'], BoundaryFluxCalculator):
+            raise ValueError('local time stepping needs boundary_conditions and a BoundaryFluxCalculator')
+        if len(data['cells'].shape) != 1:
+            raise ValueError('local time stepping only supports a single one dimensional run')
+        if data['extensive_updater'] is not simple_extensive_updater:
+            raise ValueError('local time stepping applies fluxes itself, custom extensive updaters are not supported')
+        if not hasattr(data['time_step_function'], 'calcInverseTimeSteps'):
+            raise ValueError('local time stepping needs a time step function with calcInverseTimeSteps')
+        self.data = data
+        self.max_level = max_level
+        self.buffers = Buffers()
+        self.cell_updates = 0
+        self.interface_updates = 0
+
+    def calcGroups(self, remaining=None):
+
+        data = self.data
+        time_step_function = data['time_step_function']
+        time_steps = time_step_function.cfl/time_step_function.calcInverseTimeSteps(data['grid'],
+                                                                                    data['cells'])
+        dt, levels = calc_levels(time_steps, self.max_level)
+        top = numpy.max(levels)
+        if remaining is not None:
+            while top > 0 and dt*2**top > remaining:
+                top -= 1
+            numpy.minimum(levels, top, out=levels)
+            dt = min(dt, remaining)
+        face_levels = numpy.empty(len(levels)+1, dtype=int)
+        face_levels[0] = levels[0]
+        face_levels[-1] = levels[-1]
+        numpy.minimum(levels[:-1], levels[1:], out=face_levels[1:-1])
+        groups = [LevelGroup(dt, levels, face_levels, level, data['grid'].areas, self.buffers,
+                             data['cells'].ghost_cells)
+                  for level in range(top+1)]
+        return dt, top, groups
+
+    def substep(self, group, source_terms):
+
+        data = self.data
+        grid = data['grid']
+        cells = data['cells']
+        extensive = data['extensive']
+        flux_calculator = data['flux_calculator']
+        g = cells.ghost_cells
+
+        flux_calculator.boundary_conditions(grid, cells)
+        if flux_calculator.reconstruction is None:
+            numpy.take(cells.storage, group.padded_left, axis=-1, out=group.left_states.storage)
+            numpy.take(cells.storage, group.padded_right, axis=-1, out=group.right_states.storage)
+        else:
+            flux_calculator.reconstruction.faceStates(cells, grid, group.faces,
+                                                      group.left_states, group.right_states)
+        if source_terms is not None:
+            source_terms.calc(grid, cells, extensive, group.cell_dts)
+        flux_calculator.riemann_solver(group.left_states, group.right_states, group.velocities,
+                                       out=group.fluxes)
+        fluxes = group.fluxes.storage
+        fluxes *= group.weights
+        extensive.storage[...,group.left_cells] -= fluxes[...,group.has_left]
+        extensive.storage[...,group.right_cells] += fluxes[...,group.has_right]
+        if source_terms is not None:
+            source_terms.apply(extensive)
+
+        numpy.take(extensive.storage, group.cells, axis=-1, out=group.extensive.storage)
+        data['cell_updater'](grid.take(group.cells), group.extensive, data['equation_of_state'],
+                             data['physical_geometry'], group.primitives, out=group.primitives)
+        cells.storage[...,g+group.cells] = group.primitives.storage
+        self.interface_updates += len(group.faces)
+        self.cell_updates += len(group.cells)
+
+    def __call__(self, source_terms=None, remaining=None):
+
+        dt, top, groups = self.calcGroups(remaining)
+        for j in range(2**top):
+            if j == 0:
+                level = top
+            else:
+                level = min((j & -j).bit_length()-1, top)
+            self.substep(groups[level], source_terms)
+        return dt*2**top
+
+class TestLocalTimeStepping(unittest.TestCase):
+
+    def make_data(self, faces, ratio=10.0):
+
+        from checkpoint import make_shock_tube
+
+        data = make_shock_tube(len(faces)-1, ratio=ratio)
+        data['grid'] = faces
+        data['cells']['pressure'] = numpy.where(faces[:-1]<1.5, ratio, 1.0)
+        return data
+
+    def test_levels(self):
+
+        dt, levels = calc_levels(numpy.array([1.0, 8.0, 8.0, 1.1, 2.0, 100.0, 3.9]), 2)
+        self.assertEqual(dt, 1.0)
+        self.assertEqual(list(levels), [0, 1, 1, 0, 1, 2, 1])
+
+    def test_closed_box_conserves(self):
+
+        from boundaries import BoundaryConditions, Reflective
+        from simulation import Simulation
+
+        data = self.make_data(numpy.logspace(0, numpy.log10(2), 41))
+        data['boundary_conditions'] = BoundaryConditions(Reflective(), Reflective())
+        data['local_time_stepping'] = 3
+        sim = Simulation(data)
+        totals = numpy.sum(sim.data['extensive'].storage, axis=-1)
+        sim.run(t_end=0.2)
+        self.assertEqual(sim.data['time'], 0.2)
+        self.assertTrue(numpy.allclose(numpy.sum(sim.data['extensive'].storage, axis=-1)[[0, 2]],
+                                       totals[[0, 2]], rtol=1e-13))
+
+    def test_reconstructs_only_active_faces(self):
+
+        from boundaries import BoundaryConditions, Reflective
+        from muscl import MUSCLReconstruction
+        from ideal_gas import IdealGas
+        from simulation import Simulation
+
+        data = self.make_data(numpy.logspace(0, numpy.log10(2), 41))
+        data['boundary_conditions'] = BoundaryConditions(Reflective(), Reflective())
+        data['reconstruction'] = MUSCLReconstruction(IdealGas(5./3.), 'van_leer')
+        data['local_time_stepping'] = 3
+        sim = Simulation(data)
+        totals = numpy.sum(sim.data['extensive'].storage, axis=-1)
+        sim.run(t_end=0.2)
+        self.assertTrue(data['reconstruction'].left_states is None)
+        self.assertTrue(numpy.allclose(numpy.sum(sim.data['extensive'].storage, axis=-1)[[0, 2]],
+                                       totals[[0, 2]], rtol=1e-13))
+        self.assertTrue(numpy.all(sim.data['cells']['pressure'] > 0))
+
+    def test_rejects_moving_grids(self):
+
+        from lagrangian import Lagrangian
+        from simulation import Simulation
+
+        data = self.make_data(numpy.linspace(1, 2, 41))
+        data['grid_motion'] = Lagrangian(data['boundary_conditions'])
+        data['local_time_stepping'] = 3
+        self.assertRaises(ValueError, Simulation, data)
+
+    def test_fewer_updates_on_a_logarithmic_grid(self):
+
+        from simulation import Simulation
+
+        faces = numpy.logspace(-2, numpy.log10(2), 201)
+        global_stepping = Simulation(self.make_data(faces))
+        global_stepping.run(t_end=0.05)
+        data = self.make_data(faces)
+        data['local_time_stepping'] = 6
+        local_stepping = Simulation(data)
+        local_stepping.run(t_end=0.05)
+        stepper = local_stepping.local_time_stepping
+        self.assertTrue(3*stepper.cell_updates < 200*global_stepping.data['cycle'])
+        density = global_stepping.data['cells']['density']
+        error = numpy.abs(local_stepping.data['cells']['density']-density)
+        self.assertTrue(numpy.sum(error*faces[1:]-error*faces[:-1]) <
+                        0.01*numpy.sum(density*faces[1:]-density*faces[:-1]))
+
+if __name__ == '__main__':
+
+    unittest.main()
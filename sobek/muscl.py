@@ -0,0 +1,310 @@
+import unittest
+import numpy
+
+# Slope limiters take the differences to the left and right neighbours
+# and return the limited difference across the cell. All three vanish at
+# extrema and keep the reconstructed face values between the neighbouring
+# cell values, so no new extrema appear and positive fields stay positive.
+
+def calc_minmod(left, right, out=None, scratch=None):
+
+    if out is None:
+        out = numpy.empty(numpy.shape(left))
+    temp = numpy.empty_like(out) if scratch is None else scratch
+    numpy.absolute(left, out=out)
+    numpy.absolute(right, out=temp)
+    numpy.minimum(out, temp, out=out)
+    numpy.sign(left, out=temp)
+    out *= temp
+    numpy.multiply(left, right, out=temp)
+    out[temp<=0] = 0
+    return out
+
+def calc_van_leer(left, right, out=None, scratch=None):
+
+    if out is None:
+        out = numpy.empty(numpy.shape(left))
+    temp = numpy.empty_like(out) if scratch is None else scratch
+    numpy.multiply(left, right, out=out)
+    out *= 2
+    numpy.add(left, right, out=temp)
+    positive = out > 0
+    numpy.divide(out, temp, out=out, where=positive)
+    out[~positive] = 0
+    return out
+
+def calc_monotonised_central(left, right, out=None, scratch=None):
+
+    if out is None:
+        out = numpy.empty(numpy.shape(left))
+    temp = numpy.empty_like(out) if scratch is None else scratch
+    calc_minmod(left, right, out=out, scratch=temp)
+    out *= 2
+    numpy.add(left, right, out=temp)
+    temp *= 0.5
+    numpy.absolute(temp, out=temp)
+    numpy.absolute(out, out=out)
+    numpy.minimum(out, temp, out=out)
+    numpy.sign(left, out=temp)
+    out *= temp
+    return out
+
+limiters = {'minmod':calc_minmod,
+            'van_leer':calc_van_leer,
+            'mc':calc_monotonised_central}
+
+class MUSCLReconstruction:
+
+    # Piecewise linear reconstruction of density, pressure and velocity,
+    # with energy and sound speed at the faces from the equation of state.
+    # Slopes are differences over the distances between cell centres, and
+    # are extrapolated over the distance from each centre to its face, so
+    # linear profiles are exact on any grid. The slopes of the cells on
+    # either side of the outermost faces use the two layers of ghost cells
+    # the boundary conditions fill, so walls and inflows shape the
+    # reconstruction too; ghost centres mirror the edge cells. Without a
+    # grid the cells are taken to have unit width.
+
+    ghost_cells = 2
+    fields = ['density','pressure','velocity']
+
+    def __init__(self, eos, limiter='minmod'):
+
+        if not callable(limiter):
+            limiter = limiters[limiter]
+        self.eos = eos
+        self.limiter = limiter
+        self.left_states = None
+        self.right_states = None
+        self.distance_faces = None
+        self.distances = None
+
+    def calcDistances(self, grid, n):
+
+        # Centres of the padded cells g-2 to g+n+1, the distances between
+        # them, and the distances from cells g-1 to g+n to the faces between.
+        # They only change with the grid, so they are kept until it moves.
+        if grid is not None and grid.faces is self.distance_faces:
+            return self.distances
+        faces = numpy.arange(n+1.0) if grid is None else grid.faces
+        positions = numpy.empty(n+4)
+        positions[2:-2] = faces[1:]+faces[:-1]
+        positions[2:-2] *= 0.5
+        positions[1::-1] = 2*faces[0]-positions[2:4]
+        positions[-2:] = 2*faces[-1]-positions[-3:-5:-1]
+        self.distance_faces = None if grid is None else grid.faces
+        self.distances = (numpy.diff(positions), faces-positions[1:-2], positions[2:-1]-faces)
+        return self.distances
+
+    def __call__(self, cells, grid=None):
+
+        from hydro_state import HydroState, primitive_fields
+
+        g = cells.ghost_cells
+        assert(g >= self.ghost_cells)
+        n = cells.shape[-1]
+        shape = cells.shape[:-1]+(n+1,)
+        if self.left_states is None or self.left_states.shape != shape:
+            self.left_states = HydroState(shape, primitive_fields)
+            self.right_states = HydroState(shape, primitive_fields)
+        left_states = self.left_states
+        right_states = self.right_states
+        spacings, left_offsets, right_offsets = self.calcDistances(grid, n)
+        slope_shape = cells.shape[:-1]+(n+2,)
+        differences = left_states.scratch('differences', cells.shape[:-1]+(n+3,))
+        slopes = left_states.scratch('slopes', slope_shape)
+        temp = left_states.scratch('temp', slope_shape)
+        for field in self.fields:
+            # Cells g-1 to g+n of the padded array, next to the n+1 faces
+            padded = cells.padded(field)[...,g-2:g+n+2]
+            numpy.subtract(padded[...,1:], padded[...,:-1], out=differences)
+            differences /= spacings
+            self.limiter(differences[...,:-1], differences[...,1:], out=slopes, scratch=temp)
+            numpy.multiply(slopes[...,:-1], left_offsets, out=left_states[field])
+            left_states[field] += padded[...,1:-2]
+            numpy.multiply(slopes[...,1:], right_offsets, out=right_states[field])
+            numpy.subtract(padded[...,2:-1], right_states[field], out=right_states[field])
+        self.calcThermodynamics(left_states, right_states)
+        return left_states, right_states
+
+    def faceStates(self, cells, grid, faces, left_states, right_states):
+
+        # The same states at the given faces of a single run only, from the
+        # four cells around each, for callers that update part of the grid
+        g = cells.ghost_cells
+        assert(g >= self.ghost_cells)
+        spacings, left_offsets, right_offsets = self.calcDistances(grid, cells.shape[-1])
+        m = len(faces)
+        scratch = left_states.scratch
+        stencil = scratch('stencil', (4, m), dtype=int)
+        for k in range(4):
+            numpy.add(faces, g-2+k, out=stencil[k])
+        gaps = scratch('gaps', (3, m))
+        numpy.take(spacings, stencil[:3]-(g-2), out=gaps)
+        offsets = scratch('offsets', (2, m))
+        numpy.take(left_offsets, faces, out=offsets[0])
+        numpy.take(right_offsets, faces, out=offsets[1])
+        values = scratch('values', (4, m))
+        differences = scratch('differences', (3, m))
+        slopes = scratch('slopes', (2, m))
+        temp = scratch('temp', (2, m))
+        for field in self.fields:
+            numpy.take(cells.padded(field), stencil, out=values)
+            numpy.subtract(values[1:], values[:-1], out=differences)
+            differences /= gaps
+            self.limiter(differences[:-1], differences[1:], out=slopes, scratch=temp)
+            numpy.multiply(slopes[0], offsets[0], out=left_states[field])
+            left_states[field] += values[1]
+            numpy.multiply(slopes[1], offsets[1], out=right_states[field])
+            numpy.subtract(values[2], right_states[field], out=right_states[field])
+        self.calcThermodynamics(left_states, right_states)
+        return left_states, right_states
+
+    def calcThermodynamics(self, left_states, right_states):
+
+        from vectorised_eos import calc_vectorised_dp2e, calc_vectorised_dp2c
+
+        for states in [left_states, right_states]:
+            calc_vectorised_dp2e(self.eos, states['density'], states['pressure'], out=states['energy'])
+            calc_vectorised_dp2c(self.eos, states['density'], states['pressure'], out=states['sound_speed'])
+
+class TestMUSCL(unittest.TestCase):
+
+    def make_cells(self, density):
+
+        from hydro_state import HydroState, primitive_fields
+
+        cells = HydroState(len(density)-4, primitive_fields, ghost_cells=2)
+        cells.padded('density')[...] = density
+        cells.padded('pressure')[...] = 1
+        cells.padded('velocity')[...] = numpy.linspace(-1, 1, len(density))
+        return cells
+
+    def test_limiters(self):
+
+        left = numpy.array([1.0, 1.0, -2.0, 1.0, 0.0])
+        right = numpy.array([3.0, -1.0, -1.0, 0.2, 1.0])
+        self.assertEqual(list(calc_minmod(left, right)), [1.0, 0.0, -1.0, 0.2, 0.0])
+        self.assertTrue(numpy.allclose(calc_van_leer(left, right), [1.5, 0.0, -4.0/3.0, 1.0/3.0, 0.0]))
+        self.assertTrue(numpy.allclose(calc_monotonised_central(left, right), [2.0, 0.0, -1.5, 0.4, 0.0]))
+
+    def test_linear_profiles_are_exact(self):
+
+        from ideal_gas import IdealGas
+
+        density = 1+0.1*numpy.arange(10.0)
+        cells = self.make_cells(density)
+        faces = 1+0.1*(numpy.arange(7.0)+1.5)
+        for limiter in limiters:
+            left_states, right_states = MUSCLReconstruction(IdealGas(5./3.), limiter)(cells)
+            self.assertTrue(numpy.allclose(left_states['density'], faces, rtol=1e-14))
+            self.assertTrue(numpy.allclose(right_states['density'], faces, rtol=1e-14))
+            self.assertTrue(numpy.allclose(left_states['energy'], 1.5/faces, rtol=1e-14))
+
+    def test_linear_profiles_are_exact_on_logarithmic_grids(self):
+
+        from ideal_gas import IdealGas
+        from grid import Grid
+        from physical_geometry import spherical_geometry
+
+        grid = Grid(numpy.logspace(0, 1, 21), spherical_geometry)
+        centres = grid.centres
+        positions = numpy.concatenate((2*grid.faces[0]-centres[1::-1], centres,
+                                       2*grid.faces[-1]-centres[:-3:-1]))
+        cells = self.make_cells(1+0.1*positions)
+        for limiter in limiters:
+            reconstruction = MUSCLReconstruction(IdealGas(5./3.), limiter)
+            left_states, right_states = reconstruction(cells, grid)
+            self.assertTrue(numpy.allclose(left_states['density'], 1+0.1*grid.faces, rtol=1e-14))
+            self.assertTrue(numpy.allclose(right_states['density'], 1+0.1*grid.faces, rtol=1e-14))
+            left_states, right_states = reconstruction(cells)
+            self.assertTrue(numpy.max(numpy.abs(left_states['density']-1-0.1*grid.faces)) > 1e-3)
+
+    def test_face_states_match_the_full_reconstruction(self):
+
+        from ideal_gas import IdealGas
+        from grid import Grid
+        from hydro_state import HydroState, primitive_fields
+
+        grid = Grid(numpy.logspace(0, 1, 11))
+        cells = self.make_cells(numpy.array([1.0, 1.0, 1.0, 1.2, 5.0, 5.0, 4.0, 0.1, 0.1, 3.0,
+                                             2.0, 2.5, 2.0, 1.0]))
+        faces = numpy.array([0, 3, 4, 10])
+        for limiter in limiters:
+            reconstruction = MUSCLReconstruction(IdealGas(5./3.), limiter)
+            left_states, right_states = reconstruction(cells, grid)
+            face_left = HydroState(4, primitive_fields)
+            face_right = HydroState(4, primitive_fields)
+            reconstruction.faceStates(cells, grid, faces, face_left, face_right)
+            self.assertTrue(numpy.array_equal(face_left.storage, left_states.storage[...,faces]))
+            self.assertTrue(numpy.array_equal(face_right.storage, right_states.storage[...,faces]))
+
+    def test_no_new_extrema(self):
+
+        from ideal_gas import IdealGas
+
+        density = numpy.array([1.0, 1.0, 1.0, 1.2, 5.0, 5.0, 4.0, 0.1, 0.1, 3.0])
+        cells = self.make_cells(density)
+        for limiter in limiters:
+            left_states, right_states = MUSCLReconstruction(IdealGas(5./3.), limiter)(cells)
+            lower = numpy.minimum(density[1:-2], density[2:-1])
+            upper = numpy.maximum(density[1:-2], density[2:-1])
+            for states in [left_states, right_states]:
+                self.assertTrue(numpy.all(states['density'] >= lower))
+                self.assertTrue(numpy.all(states['density'] <= upper))
+
+    def test_reflective_wall_is_symmetric(self):
+
+        from ideal_gas import IdealGas
+        from boundaries import BoundaryConditions, Reflective, Outflow
+
+        cells = self.make_cells(numpy.linspace(1, 2, 10)**2)
+        BoundaryConditions(Reflective(), Outflow())(None, cells)
+        left_states, right_states = MUSCLReconstruction(IdealGas(5./3.), 'van_leer')(cells)
+        self.assertEqual(left_states['velocity'][0], -right_states['velocity'][0])
+        self.assertEqual(left_states['density'][0], right_states['density'][0])
+
+    def test_reconstruction_needs_the_default_flux_calculator(self):
+
+        from ideal_gas import IdealGas
+        from boundaries import BoundaryFluxCalculator
+        from simulation import Simulation
+        from checkpoint import make_shock_tube
+
+        data = make_shock_tube()
+        data['reconstruction'] = MUSCLReconstruction(IdealGas(5./3.))
+        data['flux_calculator'] = BoundaryFluxCalculator(data['boundary_conditions'])
+        self.assertRaises(ValueError, Simulation, data)
+
+    def test_smooth_flow_needs_fewer_cells(self):
+
+        from simulation import Simulation
+        from boundaries import BoundaryConditions, Outflow
+        from physical_geometry import planar_geometry
+        from ideal_gas import IdealGas
+        from checkpoint import make_shock_tube
+
+        def calc_error(n, reconstruction):
+            faces = numpy.linspace(0, 1, n+1)
+            centres = 0.5*(faces[1:]+faces[:-1])
+            data = make_shock_tube(n)
+            data['grid'] = faces
+            data['physical_geometry'] = planar_geometry
+            data['boundary_conditions'] = BoundaryConditions(Outflow(), Outflow())
+            data['cells']['density'] = 1+0.5*numpy.exp(-100*(centres-0.3)**2)
+            data['cells']['pressure'] = numpy.ones(n)
+            data['cells']['velocity'] = numpy.ones(n)
+            if reconstruction is not None:
+                data['reconstruction'] = MUSCLReconstruction(IdealGas(5./3.), reconstruction)
+            sim = Simulation(data)
+            sim.run(t_end=0.3)
+            exact = 1+0.5*numpy.exp(-100*(centres-0.6)**2)
+            return numpy.mean(numpy.abs(sim.data['cells']['density']-exact))
+
+        first_order = calc_error(400, None)
+        for limiter in limiters:
+            self.assertTrue(calc_error(100, limiter) < first_order)
+
+if __name__ == '__main__':
+
+    unittest.main()
@@ -0,0 +1,123 @@
+import unittest
+import numpy
+
+# Strong stability preserving Runge Kutta schemes in Shu-Osher form: each
+# stage is a forward Euler step from the previous stage, blended with the
+# state at the start of the step,
+#     u(k) = a(k)*u(0)+(1-a(k))*(u(k-1)+dt*L(u(k-1)))
+# Only the extensive state at the start of the step is kept; the stages
+# run in place on the simulation's own extensive and cell arrays.
+# Simulation only accepts an integrator on a static, Eulerian grid.
+
+ssp_weights = {1:[0.0],
+               2:[0.0, 0.5],
+               3:[0.0, 0.75, 1.0/3.0]}
+
+class SSPRungeKutta:
+
+    def __init__(self, order=2):
+
+        self.order = order
+        self.weights = ssp_weights[order]
+        self.initial = None
+
+    def __call__(self, sim, grid_velocity, dt):
+
+        from hydro_state import HydroState
+
+        extensive = sim.data['extensive']
+        if self.initial is None or self.initial.shape != extensive.shape:
+            self.initial = HydroState(extensive.shape, extensive.fields)
+        initial = self.initial
+        initial.storage[...] = extensive.storage
+        temp = initial.scratch('blend', extensive.storage.shape)
+        for weight in self.weights:
+            sim.calcExtensiveStage(grid_velocity, dt)
+            if weight > 0:
+                extensive = sim.data['extensive']
+                numpy.multiply(initial.storage, weight, out=temp)
+                extensive.storage *= 1-weight
+                extensive.storage += temp
+            sim.recoverCells()
+
+class TestRungeKutta(unittest.TestCase):
+
+    def make_data(self, n, cfl, order, reconstruction=True):
+
+        from boundaries import BoundaryConditions, Outflow
+        from physical_geometry import planar_geometry
+        from ideal_gas import IdealGas
+        from simple_cfl import SimpleCFL
+        from muscl import MUSCLReconstruction
+        from checkpoint import make_shock_tube
+
+        faces = numpy.linspace(0, 1, n+1)
+        centres = 0.5*(faces[1:]+faces[:-1])
+        data = make_shock_tube(n)
+        data['grid'] = faces
+        data['physical_geometry'] = planar_geometry
+        data['boundary_conditions'] = BoundaryConditions(Outflow(), Outflow())
+        data['time_step_function'] = SimpleCFL(cfl)
+        data['cells']['density'] = 1+0.5*numpy.exp(-100*(centres-0.3)**2)
+        data['cells']['pressure'] = numpy.ones(n)
+        data['cells']['velocity'] = numpy.ones(n)
+        if reconstruction:
+            data['reconstruction'] = MUSCLReconstruction(IdealGas(5./3.), 'mc')
+        if order is not None:
+            data['integrator'] = SSPRungeKutta(order)
+        return data
+
+    def calc_error(self, n, cfl, order):
+
+        from simulation import Simulation
+
+        sim = Simulation(self.make_data(n, cfl, order))
+        sim.run(t_end=0.3)
+        centres = sim.data['grid'].centres
+        exact = 1+0.5*numpy.exp(-100*(centres-0.6)**2)
+        return numpy.mean(numpy.abs(sim.data['cells']['density']-exact))
+
+    def test_first_order_matches_forward_euler(self):
+
+        from simulation import Simulation
+
+        euler = Simulation(self.make_data(50, 0.3, None, reconstruction=False))
+        integrated = Simulation(self.make_data(50, 0.3, 1, reconstruction=False))
+        euler.run(max_cycles=10)
+        integrated.run(max_cycles=10)
+        self.assertTrue(numpy.array_equal(euler.data['cells'].storage, integrated.data['cells'].storage))
+
+    def test_higher_order_at_larger_cfl(self):
+
+        euler = self.calc_error(100, 0.3, None)
+        for order in [2, 3]:
+            self.assertTrue(self.calc_error(100, 0.8, order) < 0.5*euler)
+        self.assertTrue(self.calc_error(200, 0.8, 3) < 0.35*self.calc_error(100, 0.8, 3))
+
+    def test_rejects_moving_grids(self):
+
+        from lagrangian import Lagrangian
+        from simulation import Simulation
+
+        data = self.make_data(50, 0.3, 2)
+        data['grid_motion'] = Lagrangian(data['boundary_conditions'])
+        self.assertRaises(ValueError, Simulation, data)
+
+    def test_stage_buffers_are_reused(self):
+
+        from simulation import Simulation
+        from stage_stats import events
+
+        sim = Simulation(self.make_data(50, 0.8, 3))
+        sim.timeAdvance()
+        initial = sim.data['integrator'].initial
+        extensive = sim.data['extensive']
+        allocations = events['allocations']
+        sim.run(max_cycles=5)
+        self.assertEqual(events['allocations'], allocations)
+        self.assertTrue(sim.data['integrator'].initial is initial)
+        self.assertTrue(sim.data['extensive'] is extensive)
+
+if __name__ == '__main__':
+
+    unittest.main()
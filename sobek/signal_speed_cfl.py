@@ -0,0 +1,190 @@
+import unittest
+import numpy
+
+class SignalSpeedCFL:
+
+    # The time step comes from the largest wave speed the Riemann solver
+    # found at either face of each cell, measured in the frame of the face.
+    # Simulation asks for the speeds buffer before each flux stage, and the
+    # next call uses what that stage wrote, so the speeds lag the cells by
+    # one step; each cell takes the larger of them and the c+|v-w| of its
+    # current state, with w the mean velocity of its faces in that stage,
+    # and the step may grow by at most a factor of growth from one call to
+    # the next. Paths that do not fill the buffer (the
+    # fused kernel, domain decomposition, local time stepping, custom flux
+    # calculators, the first step, a step after remeshing) use c+|v| alone,
+    # and Simulation warns when the buffer will never be filled.
+
+    def __init__(self, cfl, growth=1.1):
+
+        self.cfl = cfl
+        self.growth = growth
+        self.speeds = None
+        self.fresh = False
+        self.last_dt = None
+        self.face_velocities = 0
+
+    def checkpointState(self):
+
+        return {'speeds':self.speeds, 'fresh':self.fresh, 'last_dt':self.last_dt,
+                'face_velocities':self.face_velocities}
+
+    def restoreState(self, state):
+
+        self.speeds = state.get('speeds')
+        self.fresh = bool(state.get('fresh', False))
+        self.last_dt = state.get('last_dt')
+        self.face_velocities = state.get('face_velocities', 0)
+        if numpy.ndim(self.last_dt) == 0 and self.last_dt is not None:
+            self.last_dt = float(self.last_dt)
+
+    def signalSpeeds(self, shape, face_velocities=0):
+
+        if self.speeds is None or self.speeds.shape != shape:
+            self.speeds = numpy.empty(shape)
+        self.face_velocities = numpy.array(face_velocities, dtype='d')
+        self.fresh = True
+        return self.speeds
+
+    def calcInverseTimeSteps(self, grid, cells):
+
+        from grid import as_grid
+
+        cell_widths = as_grid(grid).widths
+        if self.fresh and self.speeds.shape[-1] == len(cell_widths)+1:
+            velocities = self.face_velocities
+            if numpy.ndim(velocities) > 0:
+                velocities = 0.5*(velocities[...,:-1]+velocities[...,1:])
+            speeds = cells['sound_speed']+numpy.absolute(cells['velocity']-velocities)
+            numpy.maximum(speeds, self.speeds[...,:-1], out=speeds)
+            numpy.maximum(speeds, self.speeds[...,1:], out=speeds)
+        else:
+            speeds = cells['sound_speed']+numpy.absolute(cells['velocity'])
+        return speeds/cell_widths
+
+    def __call__(self, grid, cells):
+
+        dt = self.cfl/numpy.max(self.calcInverseTimeSteps(grid, cells), axis=-1)
+        self.fresh = False
+        if self.last_dt is not None:
+            dt = numpy.minimum(dt, self.growth*self.last_dt)
+        self.last_dt = dt
+        return dt
+
+class TestSignalSpeedCFL(unittest.TestCase):
+
+    def make_data(self, time_step_function):
+
+        from checkpoint import make_shock_tube
+
+        data = make_shock_tube(ratio=10.0)
+        data['time_step_function'] = time_step_function
+        return data
+
+    def test_speeds_match_the_riemann_solver(self):
+
+        from vectorised_hllc import calc_batched_hllc, make_random_states
+
+        n = 50
+        left_states = make_random_states(n)
+        right_states = make_random_states(n)
+        velocities = numpy.random.rand(n)-0.5
+        speeds = numpy.empty(n)
+        res = calc_batched_hllc(left_states, right_states, velocities, signal_speeds=speeds)
+        self.assertTrue(numpy.array_equal(res.storage,
+                                          calc_batched_hllc(left_states, right_states,
+                                                            velocities).storage))
+        for i in range(n):
+            vl = left_states['velocity'][i]-velocities[i]
+            vr = right_states['velocity'][i]-velocities[i]
+            cl = left_states['sound_speed'][i]
+            cr = right_states['sound_speed'][i]
+            expected = max(abs(min(vl-cl, vr-cr)), abs(max(vl+cl, vr+cr)))
+            self.assertAlmostEqual(speeds[i], expected, delta=1e-14*expected)
+
+    def test_growth_is_limited(self):
+
+        from grid import Grid
+        from physical_geometry import planar_geometry
+
+        grid = Grid(numpy.linspace(0, 1, 11), planar_geometry)
+        cells = {'sound_speed':numpy.ones(10), 'velocity':numpy.zeros(10)}
+        cfl = SignalSpeedCFL(0.5, growth=1.5)
+        self.assertAlmostEqual(cfl(grid, cells), 0.05)
+        cells['sound_speed'] = 0.1*numpy.ones(10)
+        self.assertAlmostEqual(cfl(grid, cells), 0.075)
+        self.assertAlmostEqual(cfl(grid, cells), 0.1125)
+        cells['sound_speed'] = 10*numpy.ones(10)
+        self.assertAlmostEqual(cfl(grid, cells), 0.005)
+
+    def test_simulation_uses_signal_speeds(self):
+
+        from simulation import Simulation
+
+        cfl = SignalSpeedCFL(0.3)
+        sim = Simulation(self.make_data(cfl))
+        sim.timeAdvance()
+        self.assertTrue(cfl.fresh)
+        cells = sim.data['cells']
+        speeds = numpy.maximum(cfl.speeds[:-1], cfl.speeds[1:])
+        speeds = numpy.maximum(speeds, cells['sound_speed']+numpy.abs(cells['velocity']))
+        expected = 0.3/numpy.max(speeds/sim.data['grid'].widths)
+        expected = min(expected, cfl.growth*cfl.last_dt)
+        time = sim.data['time']
+        sim.timeAdvance()
+        self.assertAlmostEqual(sim.data['time']-time, expected, delta=1e-14)
+        sim.run(max_cycles=50)
+        self.assertTrue(numpy.all(sim.data['cells']['pressure'] > 0))
+
+    def test_current_cells_bound_lagged_speeds(self):
+
+        from grid import Grid
+        from physical_geometry import planar_geometry
+
+        grid = Grid(numpy.linspace(0, 1, 11), planar_geometry)
+        cells = {'sound_speed':numpy.ones(10), 'velocity':numpy.zeros(10)}
+        cfl = SignalSpeedCFL(0.5)
+        cfl.signalSpeeds((11,))[...] = 2
+        self.assertTrue(numpy.allclose(cfl.calcInverseTimeSteps(grid, cells), 20))
+        cells['velocity'][3] = 4
+        self.assertAlmostEqual(numpy.max(cfl.calcInverseTimeSteps(grid, cells)), 50)
+        cells['velocity'][...] = 4
+        cfl.signalSpeeds((11,), 4*numpy.ones(11))
+        self.assertTrue(numpy.allclose(cfl.calcInverseTimeSteps(grid, cells), 20))
+
+    def test_warns_when_speeds_are_not_collected(self):
+
+        import warnings
+        from simulation import Simulation
+        from boundaries import BoundaryFluxCalculator
+
+        data = self.make_data(SignalSpeedCFL(0.3))
+        data['flux_calculator'] = BoundaryFluxCalculator(data['boundary_conditions'],
+                                                         lambda *args, **kwargs: None)
+        with warnings.catch_warnings(record=True) as caught:
+            warnings.simplefilter('always')
+            sim = Simulation(data)
+        self.assertFalse(sim.collect_signal_speeds)
+        self.assertEqual(len(caught), 1)
+
+    def test_threaded_speeds_match_serial(self):
+
+        from simulation import Simulation
+
+        serial = Simulation(self.make_data(SignalSpeedCFL(0.3)))
+        data = self.make_data(SignalSpeedCFL(0.3))
+        data['threads'] = 2
+        data['chunk_size'] = 7
+        threaded = Simulation(data)
+        try:
+            serial.run(max_cycles=20)
+            threaded.run(max_cycles=20)
+        finally:
+            threaded.close()
+        self.assertEqual(serial.data['time'], threaded.data['time'])
+        self.assertTrue(numpy.array_equal(serial.data['time_step_function'].speeds,
+                                          threaded.data['time_step_function'].speeds))
+
+if __name__ == '__main__':
+
+    unittest.main()
@@ -1,15 +1,22 @@
-def simple_cell_updater(grid, extensive_list, eos, pg, cells):
+def simple_cell_updater(grid, extensive_list, eos, pg, cells, out=None):
 
     import numpy
-    from hydrodynamic_variables import conserved2primitive
+    from vectorised_eos import calc_vectorised_de2p, calc_vectorised_dp2c
+    from hydro_state import make_output, primitive_fields
+    from grid import as_grid
     
-    volume_list = numpy.diff([pg['volume'](r) for r in grid])
-    intensive_list = numpy.array(zip(*(extensive_list[field]/volume_list for field in extensive_list.dtype.names)),
-                                 dtype=extensive_list.dtype)
-    density_list = intensive_list['mass']
-    velocity_list = intensive_list['momentum']/intensive_list['mass']
-    thermal_energy_list = intensive_list['energy']/density_list - 0.5*velocity_list**2
-    pressure_list = numpy.vectorize(eos.de2p)(density_list, thermal_energy_list)
-    sound_speed_list = numpy.vectorize(eos.dp2c)(density_list, pressure_list)
-    return numpy.array(zip(density_list,pressure_list, velocity_list, thermal_energy_list, sound_speed_list),
-                       dtype=[('density','d'),('pressure','d'),('velocity','d'),('energy','d'),('sound_speed','d')])
\ No newline at end of file
+    volume_list = as_grid(grid, pg).volumes
+    res = make_output(out, numpy.shape(extensive_list['mass']), primitive_fields)
+    density_list = res['density']
+    velocity_list = res['velocity']
+    thermal_energy_list = res['energy']
+    kinetic_energy_list = res['sound_speed']
+    numpy.divide(extensive_list['mass'], volume_list, out=density_list)
+    numpy.divide(extensive_list['momentum'], extensive_list['mass'], out=velocity_list)
+    numpy.divide(extensive_list['energy'], extensive_list['mass'], out=thermal_energy_list)
+    numpy.multiply(velocity_list, velocity_list, out=kinetic_energy_list)
+    kinetic_energy_list *= 0.5
+    thermal_energy_list -= kinetic_energy_list
+    calc_vectorised_de2p(eos, density_list, thermal_energy_list, out=res['pressure'])
+    calc_vectorised_dp2c(eos, density_list, res['pressure'], out=res['sound_speed'])
+    return res
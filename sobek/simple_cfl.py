@@ -4,10 +4,17 @@ class SimpleCFL:
     
         self.cfl = cfl
         
+    def calcInverseTimeSteps(self, grid, cells):
+    
+        import numpy
+        from grid import as_grid
+    
+        cell_widths = as_grid(grid).widths
+        return (cells['sound_speed']+numpy.absolute(cells['velocity']))/cell_widths
+        
     def __call__(self, grid, cells):
     
         import numpy
     
-        cell_widths = numpy.diff(grid)
-        inverse_time_steps = (cells['sound_speed']+numpy.absolute(cells['velocity']))/cell_widths
-        return self.cfl/numpy.max(inverse_time_steps)
\ No newline at end of file
+        inverse_time_steps = self.calcInverseTimeSteps(grid, cells)
+        return self.cfl/numpy.max(inverse_time_steps, axis=-1)
\ No newline at end of file
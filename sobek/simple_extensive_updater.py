@@ -1,11 +1,16 @@
-def simple_extensive_updater(grid, cells, extensive_list, flux_list, geometry, dt):
+def simple_extensive_updater(grid, cells, extensive_list, flux_list, geometry, dt, out=None):
 
     import numpy
+    from hydro_state import make_output
+    from grid import as_grid
 
-    area_list = numpy.vectorize(geometry['area'])(grid)
-    current_list = numpy.array(zip(*(flux_list[field]*area_list*dt for field in flux_list.dtype.names)),
-                            dtype=flux_list.dtype)
-    diff_list = numpy.array(zip(*(numpy.diff(current_list[field]) for field in current_list.dtype.names)),
-                            dtype=current_list.dtype)
-    return numpy.array(zip(*(extensive_list[field] - diff_list[field] for field in extensive_list.dtype.names)),
-                       dtype=extensive_list.dtype)
+    res = make_output(out, numpy.shape(extensive_list['mass']), extensive_list.dtype.names)
+    area_list = as_grid(grid, geometry).areas
+    current_list = res.scratch('current', numpy.shape(flux_list['mass']))
+    diff_list = res.scratch('difference')
+    for field in res.fields:
+        numpy.multiply(flux_list[field], area_list, out=current_list)
+        current_list *= dt
+        numpy.subtract(current_list[...,1:], current_list[...,:-1], out=diff_list)
+        numpy.subtract(extensive_list[field], diff_list, out=res[field])
+    return res
@@ -2,116 +2,287 @@ class Simulation:
 
     def __init__(self, 
                  data):
-        import numpy
-        from hydrodynamic_variables import primitive2conserved
+        from vectorised_eos import calc_vectorised_dp2e, calc_vectorised_dp2c
+        from hydro_state import HydroState, primitive_fields, conserved_fields
+        from jit_kernels import select_fused_step
+        from grid import as_grid
+        from boundaries import BoundaryFluxCalculator
+        from domain_decomposition import shared_hydro_state, DomainDecomposition
+        from threaded_step import ThreadedStep, default_chunk_size
+        from stage_stats import make_stats
+        from source_terms import make_source_terms
+        from local_time_stepping import LocalTimeStepping
+        from vectorised_hllc import calc_batched_hllc
+        from eulerian import Eulerian
     
         self.data = data
+        self.data['grid'] = as_grid(data['grid'], data['physical_geometry'])
+        if 'flux_calculator' not in data:
+            data['flux_calculator'] = BoundaryFluxCalculator(data['boundary_conditions'],
+                                                             reconstruction=data.get('reconstruction'))
+        reconstruction = getattr(data['flux_calculator'], 'reconstruction', None)
+        if data.get('reconstruction') is not None and data['reconstruction'] is not reconstruction:
+            raise ValueError('reconstruction is ignored by a custom flux_calculator, '
+                             'pass it to the flux calculator instead')
+        ghost_cells = 1 if reconstruction is None else reconstruction.ghost_cells
         eos = data['equation_of_state']
-        cells = data['cells']
-        self.data['cells'] = numpy.array(zip(cells['density'],
-                                             cells['pressure'],
-                                             cells['velocity'],
-                                             numpy.vectorize(eos.dp2e)(cells['density'],
-                                                                       cells['pressure']),
-                                             numpy.vectorize(eos.dp2c)(cells['density'],
-                                                                       cells['pressure'])),
-                                         dtype=[('density','d'),
-                                                ('pressure','d'),
-                                                ('velocity','d'),
-                                                ('energy','d'),
-                                                ('sound_speed','d')])
-        volume_list = numpy.diff(numpy.vectorize(data['physical_geometry']['volume'])(data['grid']))
+        shape = self.calcStateShape()
+        blocks = data.get('domain_blocks', 1)
+        allocate = shared_hydro_state if blocks > 1 else HydroState
+        cells = allocate(shape, primitive_fields, ghost_cells=ghost_cells)
+        cells.assign(data['cells'])
+        calc_vectorised_dp2e(eos, cells['density'], cells['pressure'], out=cells['energy'])
+        calc_vectorised_dp2c(eos, cells['density'], cells['pressure'], out=cells['sound_speed'])
+        self.data['cells'] = cells
+        volume_list = self.data['grid'].volumes
         
-        cells = self.data['cells']
-        intensive_list = numpy.array(zip(cells['density'], 
-                                         cells['density']*cells['velocity'],
-                                         0.5*cells['density']*(cells['velocity']**2+cells['energy'])),
-                                     dtype=[('mass','d'),('momentum','d'),('energy','d')])
-        self.data['extensive'] = numpy.array(zip(intensive_list['mass']*volume_list,
-                                                 intensive_list['momentum']*volume_list,
-                                                 intensive_list['energy']*volume_list),
-                                             dtype=[('mass','d'),('momentum','d'),('energy','d')])
+        extensive = allocate(shape, conserved_fields)
+        extensive['mass'] = cells['density']*volume_list
+        extensive['momentum'] = cells['density']*cells['velocity']*volume_list
+        extensive['energy'] = cells['density']*(0.5*cells['velocity']**2+cells['energy'])*volume_list
+        self.data['extensive'] = extensive
+        self.fluxes = HydroState(shape[:-1]+(len(data['grid']),), conserved_fields)
+        self.source_terms = make_source_terms(data)
+        if self.source_terms is not None and (data.get('threads', 1) > 1 or blocks > 1):
+            raise ValueError('source terms are not supported with threads or domain_blocks')
+        self.fused_step = select_fused_step(data)
+        self.threaded_step = None
+        if self.fused_step is None and data.get('threads', 1) > 1:
+            self.threaded_step = ThreadedStep(data, data['threads'],
+                                              data.get('chunk_size', default_chunk_size))
         self.data['time'] = 0
         self.data['cycle'] = 0
+        self.stats = make_stats(data)
+        self.diagnostics = data.get('diagnostics')
+        self.decomposition = None
+        if blocks > 1:
+            self.decomposition = DomainDecomposition(data, blocks)
+        self.local_time_stepping = None
+        if data.get('local_time_stepping'):
+            if self.fused_step is not None or self.threaded_step is not None or blocks > 1:
+                raise ValueError('local time stepping is not supported with the numba backend, threads or domain_blocks')
+            self.local_time_stepping = LocalTimeStepping(data, data['local_time_stepping'])
+        self.integrator = data.get('integrator')
+        if self.integrator is not None and (self.fused_step is not None or self.threaded_step is not None or
+                                            blocks > 1 or self.local_time_stepping is not None):
+            raise ValueError('integrators are not supported with the numba backend, threads, '
+                             'domain_blocks or local time stepping')
+        if self.integrator is not None and not isinstance(data['grid_motion'], Eulerian):
+            raise ValueError('integrators need a static grid, use Eulerian grid_motion')
+        self.collect_signal_speeds = False
+        if hasattr(data['time_step_function'], 'signalSpeeds'):
+            flux_calculator = data['flux_calculator']
+            self.collect_signal_speeds = (isinstance(flux_calculator, BoundaryFluxCalculator) and
+                                          flux_calculator.riemann_solver is calc_batched_hllc and
+                                          self.fused_step is None and blocks == 1 and
+                                          self.local_time_stepping is None)
+            if not self.collect_signal_speeds:
+                import warnings
+                warnings.warn('signal speeds are not collected with the numba backend, domain_blocks, '
+                              'local time stepping or a custom flux calculator, the time step '
+                              'function falls back to c+|v|')
+        
+    def close(self):
+
+        if self.decomposition is not None:
+            self.decomposition.close()
+            self.decomposition = None
+        if self.threaded_step is not None:
+            self.threaded_step.close()
+            self.threaded_step = None
+
+    def remesh(self, grid, extensive):
+
+        from hydro_state import HydroState, primitive_fields, conserved_fields
+
+        if self.threaded_step is not None or self.decomposition is not None:
+            raise ValueError('remeshing is not supported with threads or domain_blocks')
+        cells = HydroState(extensive.shape, primitive_fields,
+                           ghost_cells=self.data['cells'].ghost_cells)
+        self.data['grid'] = grid
+        self.data['extensive'] = extensive
+        self.data['cells'] = self.data['cell_updater'](grid,
+                                                       extensive,
+                                                       self.data['equation_of_state'],
+                                                       self.data['physical_geometry'],
+                                                       cells,
+                                                       out=cells)
+        self.fluxes = HydroState(extensive.shape[:-1]+(len(grid),), conserved_fields)
+
+    def calcStateShape(self):
+    
+        return (len(self.data['grid'])-1,)
         
-    def timeAdvance(self):
+    def calcTimeStep(self):
     
-        dt = self.data['time_step_function'](self.data['grid'], self.data['cells'])
+        return self.data['time_step_function'](self.data['grid'], self.data['cells'])
         
-        grid_velocity = self.data['grid_motion'](self.data['grid'], self.data['cells'])
+    def calcSignalSpeeds(self, grid_velocity):
+
+        if not self.collect_signal_speeds:
+            return None
+        return self.data['time_step_function'].signalSpeeds(self.fluxes.shape, grid_velocity)
+
+    def clipTimeStep(self, dt, t_end):
+
+        return min(dt, t_end-self.data['time'])
+
+    def advanceClock(self, dt, t_end=None):
+    
+        # A step clipped to t_end lands on it exactly, whatever the round off
+        if t_end is not None and dt == t_end-self.data['time']:
+            self.data['time'] = t_end
+        else:
+            self.data['time'] += dt
+        self.data['cycle'] += 1
+
+    def isFinished(self, t_end=None, max_cycles=None):
+
+        import numpy
+
+        return ((t_end is not None and numpy.all(self.data['time']>=t_end)) or
+                (max_cycles is not None and self.data['cycle']>=max_cycles))
+
+    def run(self, t_end=None, max_cycles=None, callbacks=[]):
+
+        assert(t_end is not None or max_cycles is not None)
+        while not self.isFinished(t_end, max_cycles):
+            self.timeAdvance(t_end)
+            for callback in callbacks:
+                callback(self)
         
-        fluxes = self.data['flux_calculator'](self.data['grid'], self.data['cells'], grid_velocity)
-                
+    def calcExtensiveStage(self, grid_velocity, dt):
+
+        stats = self.stats
+        start = stats.tick()
+        if self.source_terms is not None:
+            self.source_terms.calc(self.data['grid'],
+                                   self.data['cells'],
+                                   self.data['extensive'],
+                                   dt)
+            start = stats.tock('source_terms', start)
+
+        # Flux calculators other than the default keep the plain signature
+        extra = {}
+        if self.collect_signal_speeds:
+            extra['signal_speeds'] = self.calcSignalSpeeds(grid_velocity)
+        self.fluxes = self.data['flux_calculator'](self.data['grid'],
+                                                   self.data['cells'],
+                                                   grid_velocity,
+                                                   out=self.fluxes,
+                                                   **extra)
+        start = stats.tock('flux', start)
+            
         self.data['extensive'] = self.data['extensive_updater'](self.data['grid'],
                                                                 self.data['cells'],
                                                                 self.data['extensive'],
-                                                                fluxes,
+                                                                self.fluxes,
                                                                 self.data['physical_geometry'],
-                                                                dt)
-                                                          
+                                                                dt,
+                                                                out=self.data['extensive'])
+        if self.source_terms is not None:
+            self.source_terms.apply(self.data['extensive'])
+        stats.tock('extensive_update', start)
+
+    def recoverCells(self):
+
+        start = self.stats.tick()
         self.data['cells'] = self.data['cell_updater'](self.data['grid'],
                                                        self.data['extensive'],
                                                        self.data['equation_of_state'],
                                                        self.data['physical_geometry'],
-                                                       self.data['cells'])
-                                                                   
-        self.data['time'] += dt
-        self.data['cycle'] += 1
-    
-def flip_velocity(p):
+                                                       self.data['cells'],
+                                                       out=self.data['cells'])
+        self.stats.tock('cell_update', start)
 
-    return {field:-p[field] if field=='velocity' else p[field]}
+    def timeAdvance(self, t_end=None):
     
-def calc_gravity(cells, grid, extensives, dt):
-
-    GM = 1
-    r_list = mid_array(grid)
-    for r, ext in zip(r_list, extensives):
-        ext['energy'] -= dt*ext['momentum']*GM/r**2
-        ext['momentum'] -= dt*ext['mass']*GM/r**2
-        
-def calc_spherical_complementary(cells, grid, extensives, dt):
+        stats = self.stats
+        start = stats.tick()
+        if self.decomposition is not None:
+            clip = None
+            if t_end is not None:
+                clip = lambda dt: self.clipTimeStep(dt, t_end)
+            dt = self.decomposition.timeAdvance(clip)
+            stats.tock('decomposed_step', start)
+            self.advanceClock(dt, t_end)
+            stats.endStep(self.data['cells'])
+            if self.diagnostics is not None:
+                self.diagnostics(self)
+            return
 
-    import numpy
+        if self.local_time_stepping is not None:
+            remaining = None
+            if t_end is not None:
+                remaining = t_end-self.data['time']
+            dt = self.local_time_stepping(self.source_terms, remaining)
+            stats.tock('local_time_step', start)
+            self.advanceClock(dt, t_end)
+            stats.endStep(self.data['cells'])
+            if self.diagnostics is not None:
+                self.diagnostics(self)
+            return
 
-    volume_list = numpy.diff([(4.0/3.0)*numpy.pi*r**3 for r in grid])
-    r_list = mid_array(grid)
-    for r, ext, cell, volume in zip(r_list, extensives, cells, volume_list):
-        p = cell['pressure']
-        ext['momentum'] += 2*volume*p*dt/r
+        dt = self.calcTimeStep()
+        if t_end is not None:
+            dt = self.clipTimeStep(dt, t_end)
+        start = stats.tock('time_step', start)
         
-def calc_mass_injection(cells, grid, extensives, dt):
-
-    import numpy
-    
-    vw = 1.0
-    r_list = mid_array(grid)
-    volume_list = numpy.diff([(4.0/3.0)*numpy.pi*r**3 for r in grid])
-    for r, volume, ext in zip(r_list, volume_list, extensives):
-        mass_addition = r**(-2.5)
-        ext['mass'] += mass_addition*volume
-        ext['energy'] += 0.5*mass_addition*vw**2*volume
+        grid_velocity = self.data['grid_motion'](self.data['grid'], self.data['cells'])
+        start = stats.tock('grid_motion', start)
         
-def calc_net_source(cells, grid, extensives, dt):
+        if self.fused_step is not None:
+            self.data['boundary_conditions'](self.data['grid'], self.data['cells'])
+            self.fused_step(self.data['grid'],
+                            self.data['cells'],
+                            self.data['extensive'],
+                            grid_velocity,
+                            self.data['physical_geometry'],
+                            dt)
+            stats.tock('fused_step', start)
+        elif self.threaded_step is not None:
+            extra = {}
+            if self.collect_signal_speeds:
+                extra['signal_speeds'] = self.calcSignalSpeeds(grid_velocity)
+            self.threaded_step(self.data['grid'],
+                               self.data['cells'],
+                               self.data['extensive'],
+                               grid_velocity,
+                               self.data['physical_geometry'],
+                               dt,
+                               **extra)
+            stats.tock('threaded_step', start)
+        elif self.integrator is not None:
+            self.integrator(self, grid_velocity, dt)
+        else:
+            self.calcExtensiveStage(grid_velocity, dt)
+            start = stats.tick()
+            self.data['grid'].move(grid_velocity, dt)
+            stats.tock('grid_move', start)
+            self.recoverCells()
+                                                                   
+        self.advanceClock(dt, t_end)
+        stats.endStep(self.data['cells'])
+        if self.diagnostics is not None:
+            self.diagnostics(self)
+    
+def flip_velocity(p):
 
-    calc_gravity(cells, grid, extensives, dt)
-    calc_spherical_complementary(cells, grid, extensives, dt)
-    calc_mass_injection(cells, grid, extensives, dt)
-        
-def test():
+    return {field:-p[field] if field=='velocity' else p[field]}
+    
+def test(plot=True):
 
-    import matplotlib.pyplot as plt
-    plt.ion()
     import numpy
     from simple_cfl import SimpleCFL
     from ideal_gas import IdealGas
     from flux_condition_action import FluxConditionAction
     from hllc import HLLC
     from eulerian import Eulerian
-    from vectorised_hllc import calc_vectorised_hllc
+    from boundaries import BoundaryConditions, Outflow
     from simple_extensive_updater import simple_extensive_updater
     from simple_cell_updater import simple_cell_updater
-    from mid_array import mid_array
+    from live_view import LiveView
+    from source_terms import PointMassGravity, GeometricPressureSource, MassInjection
     
     data = {}
     #data['physical_geometry'] = {'area': lambda r: 1, 'volume': lambda r: r}
@@ -125,45 +296,20 @@ def test():
     data['equation_of_state'] = IdealGas(5./3.)
     data['grid_motion'] = Eulerian()
 
-    def flux_calculator(grid, cells, velocity_list):
-    
-        left_states = numpy.array(zip(*(numpy.concatenate(([cells[field][0]],cells[field])) for field in cells.dtype.names)),
-                                  dtype=cells.dtype)
-        right_states = numpy.array(zip(*(numpy.concatenate((cells[field],[cells[field][-1]])) for field in cells.dtype.names)),
-                                   dtype=cells.dtype)
-        return calc_vectorised_hllc(left_states, right_states, velocity_list)
-    data['flux_calculator'] = flux_calculator
+    data['boundary_conditions'] = BoundaryConditions(Outflow(), Outflow())
     data['extensive_updater'] = simple_extensive_updater
     data['cell_updater'] = simple_cell_updater
-    data['source_term'] = calc_net_source
+    data['source_terms'] = [PointMassGravity(1.0),
+                            GeometricPressureSource(2),
+                            MassInjection(rate=1.0, exponent=-2.5, wind_velocity=1.0)]
     sim = Simulation(data)
     
-    # Visualise
-    r_list = mid_array(sim.data['grid'])
-    fig = plt.figure()
-    axes_list = [fig.add_subplot(3,1,n+1) for n in range(3)]
-    plots = {}
-    for n, field in enumerate(['density','pressure','velocity']):
-        #pylab.subplot(3,1,n+1)
-        y_list = map(lambda x:x[field], sim.data['cells'])
-        plots[field], = axes_list[n].plot(r_list, map(lambda x:x[field], sim.data['cells']))
-        axes_list[n].set_ylabel(field)
-    
-    def update_figure():
-        for n, field in enumerate(['density','pressure','velocity']):
-            y_list = sim.data['cells'][field]
-            plots[field].set_ydata(y_list)
-            if field == 'velocity':
-                slack = 0.1*(numpy.max(y_list)-numpy.min(y_list))
-                axes_list[n].set_ylim((numpy.min(y_list)-slack, numpy.max(y_list)+slack))
-            else:
-                axes_list[n].set_ylim((numpy.min(y_list), numpy.max(y_list)))
-        plt.suptitle('t = '+str(sim.data['time'])+', c = '+str(sim.data['cycle']))
-        plt.pause(0.01)
-    
-    while sim.data['time']<0.1:
-        sim.timeAdvance()
-        update_figure()
+    callbacks = []
+    if plot:
+        callbacks.append(LiveView())
+    sim.run(t_end=0.1, callbacks=callbacks)
+    for callback in callbacks:
+        callback.close()
         
 if __name__ == '__main__':
 
@@ -0,0 +1,195 @@
+import unittest
+import os
+import numpy
+
+# Snapshots are copied into one of a fixed number of preallocated buffers
+# on the solver thread and compressed and written by a background thread.
+# The buffers bound the memory in flight. When all of them are waiting to
+# be written the policy decides: 'block' waits for the writer, 'drop'
+# skips the snapshot and counts it.
+
+def save_snapshot(path, arrays, compress=True):
+
+    temp_path = path+'.part'
+    with open(temp_path, 'wb') as f:
+        if compress:
+            numpy.savez_compressed(f, **arrays)
+        else:
+            numpy.savez(f, **arrays)
+    os.rename(temp_path, path)
+
+class SnapshotBuffer:
+
+    def __init__(self, sim):
+
+        self.cells = numpy.empty_like(sim.data['cells'].storage)
+        self.extensive = numpy.empty_like(sim.data['extensive'].storage)
+        self.grid = numpy.empty(len(sim.data['grid']))
+
+    def fits(self, sim):
+
+        return (self.cells.shape == sim.data['cells'].storage.shape and
+                self.extensive.shape == sim.data['extensive'].storage.shape and
+                len(self.grid) == len(sim.data['grid']))
+
+    def fill(self, sim):
+
+        self.cells[...] = sim.data['cells'].storage
+        self.extensive[...] = sim.data['extensive'].storage
+        self.grid[...] = sim.data['grid']
+        self.time = numpy.array(sim.data['time'], dtype='d')
+        self.cycle = sim.data['cycle']
+        self.cell_fields = sim.data['cells'].fields
+        self.extensive_fields = sim.data['extensive'].fields
+        self.ghost_cells = sim.data['cells'].ghost_cells
+
+    def arrays(self):
+
+        g = self.ghost_cells
+        n = self.cells.shape[-1]-2*g
+        res = {'grid':self.grid, 'time':self.time, 'cycle':self.cycle}
+        for k, field in enumerate(self.cell_fields):
+            res['cells_'+field] = self.cells[k][...,g:g+n]
+        for k, field in enumerate(self.extensive_fields):
+            res['extensive_'+field] = self.extensive[k]
+        return res
+
+class SnapshotWriter:
+
+    def __init__(self, directory, buffers=3, policy='block', compress=True, save=None):
+
+        import threading
+        import Queue
+
+        assert(policy in ['block', 'drop'])
+        if save is None:
+            save = save_snapshot
+        self.directory = directory
+        self.policy = policy
+        self.compress = compress
+        self.save = save
+        self.free = Queue.Queue()
+        for i in range(buffers):
+            self.free.put(None)
+        self.pending = Queue.Queue()
+        self.dropped = 0
+        self.written = []
+        self.error = None
+        self.thread = threading.Thread(target=self.writeLoop)
+        self.thread.daemon = True
+        self.thread.start()
+
+    def writeLoop(self):
+
+        while True:
+            item = self.pending.get()
+            if item is None:
+                break
+            path, buf = item
+            try:
+                if self.error is None:
+                    self.save(path, buf.arrays(), self.compress)
+                    self.written.append(path)
+            except Exception as error:
+                self.error = error
+            self.free.put(buf)
+
+    def __call__(self, sim):
+
+        import Queue
+
+        if self.error is not None:
+            raise self.error
+        try:
+            buf = self.free.get(self.policy == 'block')
+        except Queue.Empty:
+            self.dropped += 1
+            return
+        if buf is None or not buf.fits(sim):
+            buf = SnapshotBuffer(sim)
+        buf.fill(sim)
+        if not os.path.isdir(self.directory):
+            os.makedirs(self.directory)
+        path = os.path.join(self.directory, 'snapshot_%08d.npz' % sim.data['cycle'])
+        self.pending.put((path, buf))
+
+    def close(self):
+
+        if self.thread.is_alive():
+            self.pending.put(None)
+            self.thread.join()
+        if self.error is not None:
+            raise self.error
+
+def load_snapshot(path):
+
+    with open(path, 'rb') as f:
+        archive = numpy.load(f)
+        return dict((name, archive[name]) for name in archive.files)
+
+class TestSnapshotWriter(unittest.TestCase):
+
+    def setUp(self):
+
+        import tempfile
+
+        self.directory = tempfile.mkdtemp()
+
+    def tearDown(self):
+
+        import shutil
+
+        shutil.rmtree(self.directory)
+
+    def test_snapshots_match_state(self):
+
+        from callbacks import Scheduled
+        from checkpoint import build_simulation
+
+        sim = build_simulation('shock_tube')
+        writer = SnapshotWriter(self.directory)
+        sim.run(max_cycles=10, callbacks=[Scheduled(writer, cycle_interval=5)])
+        writer.close()
+        self.assertEqual(sorted(os.listdir(self.directory)),
+                         ['snapshot_00000005.npz', 'snapshot_00000010.npz'])
+        snapshot = load_snapshot(os.path.join(self.directory, 'snapshot_00000010.npz'))
+        self.assertEqual(snapshot['cycle'], 10)
+        self.assertEqual(snapshot['time'], sim.data['time'])
+        for field in sim.data['cells'].fields:
+            self.assertTrue(numpy.array_equal(snapshot['cells_'+field], sim.data['cells'][field]))
+        for field in sim.data['extensive'].fields:
+            self.assertTrue(numpy.array_equal(snapshot['extensive_'+field], sim.data['extensive'][field]))
+
+    def test_drop_policy(self):
+
+        import threading
+        from checkpoint import build_simulation
+
+        release = threading.Event()
+        def slow_save(path, arrays, compress):
+            release.wait()
+            save_snapshot(path, arrays, compress)
+
+        sim = build_simulation('shock_tube')
+        writer = SnapshotWriter(self.directory, buffers=2, policy='drop', save=slow_save)
+        sim.run(max_cycles=5, callbacks=[writer])
+        release.set()
+        writer.close()
+        self.assertEqual(writer.dropped, 3)
+        self.assertEqual(len(os.listdir(self.directory)), 2)
+
+    def test_errors_reach_the_solver(self):
+
+        from checkpoint import build_simulation
+
+        def failing_save(path, arrays, compress):
+            raise IOError('disk full')
+
+        sim = build_simulation('shock_tube')
+        writer = SnapshotWriter(self.directory, save=failing_save)
+        writer(sim)
+        self.assertRaises(IOError, writer.close)
+
+if __name__ == '__main__':
+
+    unittest.main()
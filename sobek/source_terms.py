@@ -0,0 +1,190 @@
+import unittest
+import numpy
+
+# A source object precomputes its radial factors in prepare(grid), which
+# runs again only when the grid has moved, and then adds dt times its
+# source, evaluated on the state at the start of the step, to the
+# accumulator out. SourceTerms adds the accumulated sources to the
+# extensive state once the fluxes have been applied. In an ensemble the
+# parameters of a source may be arrays with one value per member.
+
+def member_axis(value):
+
+    if numpy.ndim(value) == 0:
+        return value
+    return numpy.asarray(value, dtype='d')[...,numpy.newaxis]
+
+class PointMassGravity:
+
+    def __init__(self, mass=1.0):
+
+        self.mass = mass
+
+    def prepare(self, grid):
+
+        self.factors = member_axis(self.mass)/grid.centres**2
+
+    def __call__(self, grid, cells, extensive, dt, out):
+
+        temp = out.scratch('gravity')
+        numpy.multiply(extensive['momentum'], self.factors, out=temp)
+        temp *= dt
+        out['energy'] -= temp
+        numpy.multiply(extensive['mass'], self.factors, out=temp)
+        temp *= dt
+        out['momentum'] -= temp
+
+class GeometricPressureSource:
+
+    # The pressure term left over from writing the momentum equation in
+    # conservative form: 2p/r in spherical and p/r in cylindrical geometry.
+
+    def __init__(self, dimension=2):
+
+        self.dimension = dimension
+
+    def prepare(self, grid):
+
+        self.factors = self.dimension*grid.volumes/grid.centres
+
+    def __call__(self, grid, cells, extensive, dt, out):
+
+        temp = out.scratch('pressure')
+        numpy.multiply(cells['pressure'], self.factors, out=temp)
+        temp *= dt
+        out['momentum'] += temp
+
+class MassInjection:
+
+    def __init__(self, rate=1.0, exponent=-2.5, wind_velocity=1.0):
+
+        self.rate = rate
+        self.exponent = exponent
+        self.wind_velocity = wind_velocity
+
+    def prepare(self, grid):
+
+        self.mass_factors = member_axis(self.rate)*grid.centres**member_axis(self.exponent)*grid.volumes
+        self.energy_factors = 0.5*member_axis(self.wind_velocity)**2*self.mass_factors
+
+    def __call__(self, grid, cells, extensive, dt, out):
+
+        temp = out.scratch('injection')
+        numpy.multiply(self.mass_factors, dt, out=temp)
+        out['mass'] += temp
+        numpy.multiply(self.energy_factors, dt, out=temp)
+        out['energy'] += temp
+
+class SourceTerms:
+
+    def __init__(self, sources):
+
+        self.sources = list(sources)
+        self.faces = None
+        self.increments = None
+
+    def prepare(self, grid, extensive):
+
+        from hydro_state import HydroState
+
+        if self.faces is not grid.faces:
+            for source in self.sources:
+                source.prepare(grid)
+            self.faces = grid.faces
+        if self.increments is None or self.increments.shape != extensive.shape:
+            self.increments = HydroState(extensive.shape, extensive.fields)
+
+    def calc(self, grid, cells, extensive, dt):
+
+        self.prepare(grid, extensive)
+        self.increments.storage[...] = 0
+        for source in self.sources:
+            source(grid, cells, extensive, dt, self.increments)
+        return self.increments
+
+    def apply(self, extensive):
+
+        extensive.storage += self.increments.storage
+
+def make_source_terms(data):
+
+    sources = data.get('source_terms')
+    if sources is None or isinstance(sources, SourceTerms):
+        return sources
+    return SourceTerms(sources)
+
+class TestSourceTerms(unittest.TestCase):
+
+    def make_state(self):
+
+        from grid import Grid
+        from hydro_state import HydroState, primitive_fields, conserved_fields
+        from physical_geometry import spherical_geometry
+
+        grid = Grid(numpy.logspace(-1, 1, 11), spherical_geometry)
+        cells = HydroState(10, primitive_fields)
+        cells['pressure'] = 1+numpy.arange(10.0)
+        extensive = HydroState(10, conserved_fields)
+        extensive['mass'] = 2*grid.volumes
+        extensive['momentum'] = -grid.volumes
+        extensive['energy'] = 3*grid.volumes
+        return grid, cells, extensive
+
+    def test_matches_loop_physics(self):
+
+        grid, cells, extensive = self.make_state()
+        dt = 0.01
+        sources = SourceTerms([PointMassGravity(1e-3), GeometricPressureSource(2), MassInjection()])
+        increments = sources.calc(grid, cells, extensive, dt)
+        for i, r in enumerate(grid.centres):
+            volume = grid.volumes[i]
+            mass = dt*r**(-2.5)*volume
+            momentum = (-dt*extensive['mass'][i]*1e-3/r**2+
+                        2*volume*cells['pressure'][i]*dt/r)
+            energy = -dt*extensive['momentum'][i]*1e-3/r**2+0.5*mass
+            self.assertAlmostEqual(increments['mass'][i], mass, delta=1e-12*abs(mass))
+            self.assertAlmostEqual(increments['momentum'][i], momentum, delta=1e-12*abs(momentum))
+            self.assertAlmostEqual(increments['energy'][i], energy, delta=1e-12*abs(energy))
+
+    def test_factors_follow_the_grid(self):
+
+        grid, cells, extensive = self.make_state()
+        gravity = PointMassGravity()
+        sources = SourceTerms([gravity])
+        sources.calc(grid, cells, extensive, 0.1)
+        factors = gravity.factors
+        sources.calc(grid, cells, extensive, 0.1)
+        self.assertTrue(gravity.factors is factors)
+        grid.move(0.01*numpy.ones(11), 1.0)
+        sources.calc(grid, cells, extensive, 0.1)
+        self.assertTrue(numpy.allclose(gravity.factors, 1/grid.centres**2))
+
+    def test_simulation_stage(self):
+
+        from simulation import Simulation
+        from checkpoint import make_shock_tube
+        from physical_geometry import planar_geometry
+
+        def make_data(sources):
+            data = make_shock_tube()
+            data['physical_geometry'] = planar_geometry
+            if sources is not None:
+                data['source_terms'] = sources
+            return data
+
+        with_sources = Simulation(make_data([MassInjection(rate=0.0, exponent=0.0, wind_velocity=0.0)]))
+        without = Simulation(make_data(None))
+        injected = Simulation(make_data([MassInjection(rate=1.0, exponent=0.0, wind_velocity=0.0)]))
+        for i in range(5):
+            with_sources.timeAdvance()
+            without.timeAdvance()
+            injected.timeAdvance()
+        self.assertTrue(numpy.array_equal(with_sources.data['cells'].storage,
+                                          without.data['cells'].storage))
+        self.assertAlmostEqual(numpy.sum(injected.data['extensive']['mass'])-
+                               numpy.sum(without.data['extensive']['mass']),
+                               numpy.sum(injected.data['grid'].volumes)*injected.data['time'])
+
+if __name__ == '__main__':
+
+    unittest.main()
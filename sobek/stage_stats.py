@@ -0,0 +1,214 @@
+import unittest
+
+# Event counters bumped by the stages themselves: buffer allocations in
+# HydroState and scalar fallbacks (numpy.vectorize over scalar methods).
+# They stay on permanently, since they are only touched when such an
+# event happens.
+events = {'allocations':0, 'fallbacks':0}
+
+def count_event(name, n=1):
+
+    events[name] += n
+
+class NullStats:
+
+    def __init__(self):
+
+        pass
+
+    def tick(self):
+
+        return 0
+
+    def tock(self, stage, start):
+
+        return 0
+
+    def endStep(self, cells):
+
+        pass
+
+class StageStats:
+
+    def __init__(self, clock=None):
+
+        import timeit
+
+        if clock is None:
+            clock = timeit.default_timer
+        self.clock = clock
+        self.stages = []
+        self.totals = {}
+        self.current = {}
+        self.steps = []
+        self.cell_steps = 0
+        self.last_events = dict(events)
+
+    def tick(self):
+
+        return self.clock()
+
+    def tock(self, stage, start):
+
+        now = self.clock()
+        if stage not in self.totals:
+            self.stages.append(stage)
+            self.totals[stage] = 0.0
+        self.current[stage] = self.current.get(stage, 0.0)+now-start
+        return now
+
+    def endStep(self, cells):
+
+        import numpy
+
+        row = {'cells':int(numpy.prod(cells.shape))}
+        for stage in self.stages:
+            row[stage] = self.current.get(stage, 0.0)
+            self.totals[stage] += row[stage]
+        for name in sorted(events):
+            row[name] = events[name]-self.last_events[name]
+        self.last_events = dict(events)
+        self.cell_steps += row['cells']
+        self.steps.append(row)
+        self.current = {}
+
+    def summary(self):
+
+        total_time = sum(self.totals.values())
+        res = {'steps':len(self.steps),
+               'cell_steps':self.cell_steps,
+               'total_time':total_time,
+               'cell_steps_per_second':self.cell_steps/total_time if total_time>0 else 0.0,
+               'stages':{},
+               'events':{}}
+        for stage in self.stages:
+            res['stages'][stage] = {'total':self.totals[stage],
+                                    'mean':self.totals[stage]/len(self.steps),
+                                    'fraction':self.totals[stage]/total_time if total_time>0 else 0.0}
+        for name in sorted(events):
+            res['events'][name] = sum(row[name] for row in self.steps)
+        return res
+
+    def columns(self):
+
+        return ['step','cells']+self.stages+sorted(events)
+
+    def writeJSON(self, f):
+
+        import json
+
+        res = self.summary()
+        res['per_step'] = [dict(row, step=n) for n, row in enumerate(self.steps)]
+        json.dump(res, f, indent=1, sort_keys=True)
+
+    def writeCSV(self, f):
+
+        import csv
+
+        writer = csv.DictWriter(f, self.columns(), restval=0.0)
+        writer.writeheader()
+        for n, row in enumerate(self.steps):
+            writer.writerow(dict(row, step=n))
+
+    def report(self):
+
+        res = self.summary()
+        lines = ['%d steps, %.4g cell steps per second' %
+                 (res['steps'], res['cell_steps_per_second'])]
+        for stage in self.stages:
+            lines.append('%-20s %10.4g s %6.1f%%' %
+                         (stage, res['stages'][stage]['total'],
+                          100*res['stages'][stage]['fraction']))
+        for name in sorted(res['events']):
+            lines.append('%-20s %10d' % (name, res['events'][name]))
+        return '\n'.join(lines)
+
+def make_stats(data):
+
+    if data.get('profile', False):
+        return StageStats()
+    return NullStats()
+
+class TestStageStats(unittest.TestCase):
+
+    def test_stages_and_events(self):
+
+        from hydro_state import HydroState
+
+        now = [0.0]
+        def clock():
+            return now[0]
+        stats = StageStats(clock)
+        cells = HydroState((2, 5), ['density'])
+        for step in range(3):
+            start = stats.tick()
+            now[0] += 1.0
+            start = stats.tock('flux', start)
+            now[0] += 3.0
+            stats.tock('update', start)
+            count_event('fallbacks', 2)
+            stats.endStep(cells)
+        res = stats.summary()
+        self.assertEqual(res['steps'], 3)
+        self.assertEqual(res['cell_steps'], 30)
+        self.assertEqual(res['cell_steps_per_second'], 2.5)
+        self.assertEqual(res['stages']['update']['total'], 9.0)
+        self.assertEqual(res['stages']['flux']['fraction'], 0.25)
+        self.assertEqual(res['events']['fallbacks'], 6)
+
+    def test_export(self):
+
+        import json
+        from StringIO import StringIO
+        from hydro_state import HydroState
+
+        stats = StageStats()
+        start = stats.tick()
+        stats.tock('flux', start)
+        stats.endStep(HydroState(4, ['density']))
+        f = StringIO()
+        stats.writeJSON(f)
+        self.assertEqual(json.loads(f.getvalue())['per_step'][0]['cells'], 4)
+        f = StringIO()
+        stats.writeCSV(f)
+        lines = f.getvalue().splitlines()
+        self.assertEqual(lines[0].split(','), stats.columns())
+        self.assertEqual(len(lines), 2)
+
+    def test_simulation_profile(self):
+
+        import numpy
+        from simulation import Simulation
+        from ideal_gas import IdealGas
+        from simple_cfl import SimpleCFL
+        from eulerian import Eulerian
+        from boundaries import BoundaryConditions, Outflow
+        from simple_extensive_updater import simple_extensive_updater
+        from simple_cell_updater import simple_cell_updater
+        from physical_geometry import planar_geometry
+
+        data = {}
+        data['grid'] = numpy.linspace(0, 1, 11)
+        data['cells'] = {'density':numpy.ones(10),
+                         'pressure':numpy.ones(10),
+                         'velocity':numpy.zeros(10)}
+        data['equation_of_state'] = IdealGas(5./3.)
+        data['physical_geometry'] = planar_geometry
+        data['time_step_function'] = SimpleCFL(0.3)
+        data['grid_motion'] = Eulerian()
+        data['boundary_conditions'] = BoundaryConditions(Outflow(), Outflow())
+        data['extensive_updater'] = simple_extensive_updater
+        data['cell_updater'] = simple_cell_updater
+        data['profile'] = True
+        sim = Simulation(data)
+        for i in range(4):
+            sim.timeAdvance()
+        res = sim.stats.summary()
+        self.assertEqual(res['cell_steps'], 40)
+        self.assertEqual(sim.stats.stages,
+                         ['time_step','grid_motion','flux','extensive_update','grid_move','cell_update'])
+        self.assertEqual([row['allocations'] for row in sim.stats.steps[1:]], [0, 0, 0])
+
+if __name__ == '__main__':
+
+    unittest.main()
@@ -0,0 +1,238 @@
+import unittest
+import os
+
+# Each member is described by a job holding the base data, the configure
+# function and its parameters, which is handed to the worker as it is. With
+# more than one process the job is pickled, so the base data and configure
+# must be picklable: module level functions and classes rather than lambdas
+# or nested functions. A single process runs the jobs in place.
+
+def expand_parameter_grid(parameter_grid):
+
+    import itertools
+
+    names = sorted(parameter_grid.keys())
+    return [dict(zip(names, values))
+            for values in itertools.product(*(parameter_grid[name] for name in names))]
+
+def assign_parameters(data, parameters):
+
+    for name in parameters:
+        data[name] = parameters[name]
+
+def member_path(output_dir, index):
+
+    return os.path.join(output_dir, 'run_%05d.npz' % index)
+
+def encode_parameters(parameters):
+
+    import json
+
+    return json.dumps(parameters, sort_keys=True, default=repr)
+
+def is_finished(output_dir, index, parameters):
+
+    # A member only counts as done if its file was written for the same
+    # parameters, so a changed or reordered grid reruns stale members.
+    import numpy
+
+    path = member_path(output_dir, index)
+    if not os.path.exists(path):
+        return False
+    try:
+        with open(path, 'rb') as f:
+            stored = str(numpy.load(f)['parameters'])
+    except (IOError, KeyError, ValueError):
+        return False
+    return stored == encode_parameters(parameters)
+
+def run_member(job):
+
+    import copy
+    import time
+    import numpy
+    from simulation import Simulation
+
+    data = copy.deepcopy(job['base_data'])
+    job['configure'](data, job['parameters'])
+    diagnostics = data.get('diagnostics')
+    if diagnostics is not None:
+        # The columns go into the member file rather than a shared path
+        diagnostics.path = None
+    start = time.time()
+    sim = Simulation(data)
+    sim.run(t_end=job['t_end'], max_cycles=job['max_cycles'])
+    wall_time = time.time()-start
+
+    arrays = {}
+    for field in sim.data['cells'].fields:
+        arrays['cells_'+field] = sim.data['cells'][field]
+    for field in sim.data['extensive'].fields:
+        arrays['extensive_'+field] = sim.data['extensive'][field]
+    arrays['grid'] = numpy.asarray(sim.data['grid'])
+    arrays['time'] = sim.data['time']
+    arrays['cycle'] = sim.data['cycle']
+    arrays['wall_time'] = wall_time
+    arrays['parameters'] = encode_parameters(job['parameters'])
+    if diagnostics is not None and diagnostics.store is not None:
+        for column in diagnostics.store.columns:
+            arrays['diagnostics_'+column] = diagnostics[column]
+
+    # Write under a temporary name first, so an interrupted member is
+    # never mistaken for a finished one.
+    path = member_path(job['output_dir'], job['index'])
+    temp_path = path+'.part'
+    with open(temp_path, 'wb') as f:
+        numpy.savez(f, **arrays)
+    os.rename(temp_path, path)
+    return job['index']
+
+def run_sweep(base_data, parameter_grid, output_dir,
+              t_end=None, max_cycles=None, processes=None, configure=None):
+
+    import multiprocessing
+
+    assert(t_end is not None or max_cycles is not None)
+    if configure is None:
+        configure = assign_parameters
+    if not os.path.isdir(output_dir):
+        os.makedirs(output_dir)
+
+    members = expand_parameter_grid(parameter_grid)
+    pending = [index for index in range(len(members))
+               if not is_finished(output_dir, index, members[index])]
+    jobs = [{'index':index,
+             'base_data':base_data,
+             'parameters':members[index],
+             'configure':configure,
+             'output_dir':output_dir,
+             't_end':t_end,
+             'max_cycles':max_cycles}
+            for index in pending]
+
+    if processes == 1 or len(jobs) <= 1:
+        for job in jobs:
+            run_member(job)
+    else:
+        pool = multiprocessing.Pool(processes)
+        try:
+            for index in pool.imap_unordered(run_member, jobs):
+                pass
+        finally:
+            pool.close()
+            pool.join()
+
+    return [{'index':index,
+             'parameters':members[index],
+             'path':member_path(output_dir, index),
+             'skipped':index not in pending}
+            for index in range(len(members))]
+
+def load_member(path):
+
+    import json
+    import numpy
+
+    with open(path, 'rb') as f:
+        archive = numpy.load(f)
+        res = dict((name, archive[name]) for name in archive.files)
+    res['parameters'] = json.loads(str(res['parameters']))
+    return res
+
+def configure_shock_tube(data, parameters):
+
+    import numpy
+    from simple_cfl import SimpleCFL
+
+    r_list = numpy.linspace(0, 1, 21)[:-1]
+    data['cells']['pressure'] = numpy.where(r_list<0.5, parameters['ratio'], 1.0)
+    data['time_step_function'] = SimpleCFL(parameters['cfl'])
+
+class TestSweep(unittest.TestCase):
+
+    def make_data(self):
+
+        import numpy
+        from ideal_gas import IdealGas
+        from eulerian import Eulerian
+        from boundaries import BoundaryConditions, Outflow
+        from simple_extensive_updater import simple_extensive_updater
+        from simple_cell_updater import simple_cell_updater
+        from physical_geometry import planar_geometry
+
+        data = {}
+        data['grid'] = numpy.linspace(0, 1, 21)
+        data['cells'] = {'density':numpy.ones(20),
+                         'pressure':numpy.ones(20),
+                         'velocity':numpy.zeros(20)}
+        data['equation_of_state'] = IdealGas(5./3.)
+        data['physical_geometry'] = planar_geometry
+        data['grid_motion'] = Eulerian()
+        data['boundary_conditions'] = BoundaryConditions(Outflow(), Outflow())
+        data['extensive_updater'] = simple_extensive_updater
+        data['cell_updater'] = simple_cell_updater
+        return data
+
+    def test_sweep_and_resume(self):
+
+        import shutil
+        import tempfile
+
+        data = self.make_data()
+        configure = configure_shock_tube
+        output_dir = tempfile.mkdtemp()
+        try:
+            grid = {'ratio':[2.0, 4.0], 'cfl':[0.3]}
+            res = run_sweep(data, grid, output_dir, max_cycles=5, processes=2, configure=configure)
+            self.assertEqual(len(res), 2)
+            self.assertFalse(any(member['skipped'] for member in res))
+            first = load_member(res[0]['path'])
+            self.assertEqual(first['cycle'], 5)
+            self.assertEqual(first['parameters'], {'ratio':2.0, 'cfl':0.3})
+            self.assertEqual(first['cells_pressure'].shape, (20,))
+            os.remove(res[1]['path'])
+            res = run_sweep(data, grid, output_dir, max_cycles=5, processes=2, configure=configure)
+            self.assertEqual([member['skipped'] for member in res], [True, False])
+            grid = {'ratio':[4.0, 2.0], 'cfl':[0.3]}
+            res = run_sweep(data, grid, output_dir, max_cycles=5, processes=1, configure=configure)
+            self.assertEqual([member['skipped'] for member in res], [False, False])
+            self.assertEqual(load_member(res[0]['path'])['parameters'], {'ratio':4.0, 'cfl':0.3})
+            res = run_sweep(data, grid, output_dir, max_cycles=5, processes=1, configure=configure)
+            self.assertEqual([member['skipped'] for member in res], [True, True])
+        finally:
+            shutil.rmtree(output_dir)
+
+    def test_members_stop_at_t_end_with_diagnostics(self):
+
+        import shutil
+        import tempfile
+        import numpy
+        from diagnostics import Diagnostics
+        from simulation import Simulation
+
+        data = self.make_data()
+        data['diagnostics'] = Diagnostics(['total_mass','max_mach'])
+        output_dir = tempfile.mkdtemp()
+        try:
+            res = run_sweep(data, {'ratio':[2.0, 4.0], 'cfl':[0.3]}, output_dir, t_end=0.05,
+                            processes=2, configure=configure_shock_tube)
+            members = [load_member(member['path']) for member in res]
+            interactive = self.make_data()
+            configure_shock_tube(interactive, {'ratio':2.0, 'cfl':0.3})
+            sim = Simulation(interactive)
+            sim.run(t_end=0.05)
+            for member in members:
+                self.assertEqual(member['time'], 0.05)
+                self.assertEqual(len(member['diagnostics_cycle']), member['cycle'])
+                self.assertEqual(member['diagnostics_time'][-1], 0.05)
+                self.assertTrue(member['diagnostics_max_mach'][-1] > 0)
+            self.assertEqual(members[0]['cycle'], sim.data['cycle'])
+            self.assertTrue(numpy.array_equal(members[0]['cells_density'],
+                                              sim.data['cells']['density']))
+            self.assertTrue(data['diagnostics'].store is None)
+        finally:
+            shutil.rmtree(output_dir)
+
+if __name__ == '__main__':
+
+    unittest.main()
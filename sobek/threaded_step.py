@@ -0,0 +1,164 @@
+import unittest
+import numpy
+
+# Chunks of this many cells keep the five primitive fields of a chunk
+# within a typical L2 cache.
+default_chunk_size = 16384
+
+class ThreadedStep:
+
+    def __init__(self, data, threads, chunk_size=default_chunk_size):
+
+        from multiprocessing.pool import ThreadPool
+        from hydro_state import HydroState, conserved_fields
+        from boundaries import BoundaryFluxCalculator
+
+        if not isinstance(data['flux_calculator'], BoundaryFluxCalculator):
+            raise ValueError('threaded stepping needs boundary_conditions and a BoundaryFluxCalculator')
+        if data['flux_calculator'].reconstruction is not None:
+            raise ValueError('threaded stepping does not support reconstruction')
+        self.flux_calculator = data['flux_calculator']
+        self.eos = data['equation_of_state']
+        self.extensive_updater = data['extensive_updater']
+        self.cell_updater = data['cell_updater']
+        self.pool = ThreadPool(threads)
+
+        cells = data['cells']
+        extensive = data['extensive']
+        n = cells.shape[-1]
+        edges = list(range(0, n, chunk_size))+[n]
+        self.chunks = list(zip(edges[:-1], edges[1:]))
+        self.fluxes = HydroState(cells.shape[:-1]+(n+1,), conserved_fields)
+
+        # Each chunk owns the interfaces on its left edge, the last one also
+        # owns the outermost interface, so every flux is written once. The
+        # update reads one interface past the chunk, computed by its neighbour.
+        left_states, right_states = cells.interface_states()
+        self.flux_blocks = []
+        self.update_blocks = []
+        for lo, hi in self.chunks:
+            owned = hi+1 if hi == n else hi
+            self.flux_blocks.append((lo, owned,
+                                     left_states.block(lo, owned),
+                                     right_states.block(lo, owned),
+                                     self.fluxes.block(lo, owned)))
+            self.update_blocks.append((cells.block(lo, hi),
+                                       extensive.block(lo, hi),
+                                       self.fluxes.block(lo, hi+1)))
+        self.faces = None
+        self.grid_blocks = None
+
+    def calcGridBlocks(self, grid):
+
+        if self.faces is not grid.faces:
+            self.faces = grid.faces
+            self.grid_blocks = [grid.block(lo, hi) for lo, hi in self.chunks]
+        return self.grid_blocks
+
+    def __call__(self, grid, cells, extensive, grid_velocity, geometry, dt, signal_speeds=None):
+
+        grid_velocity = numpy.asarray(grid_velocity)
+
+        def calc_fluxes(k):
+            lo, owned, left_states, right_states, fluxes = self.flux_blocks[k]
+            if signal_speeds is None:
+                self.flux_calculator.riemann_solver(left_states, right_states,
+                                                    grid_velocity[...,lo:owned],
+                                                    out=fluxes)
+            else:
+                self.flux_calculator.riemann_solver(left_states, right_states,
+                                                    grid_velocity[...,lo:owned],
+                                                    out=fluxes,
+                                                    signal_speeds=signal_speeds[...,lo:owned])
+
+        def update_extensive(k):
+            cells_block, extensive_block, fluxes = self.update_blocks[k]
+            self.extensive_updater(grid_blocks[k], cells_block, extensive_block,
+                                   fluxes, geometry, dt, out=extensive_block)
+
+        def update_cells(k):
+            cells_block, extensive_block, fluxes = self.update_blocks[k]
+            self.cell_updater(grid_blocks[k], extensive_block, self.eos,
+                              geometry, cells_block, out=cells_block)
+
+        def update(k):
+            update_extensive(k)
+            update_cells(k)
+
+        chunks = range(len(self.chunks))
+        self.flux_calculator.boundary_conditions(grid, cells)
+        self.pool.map(calc_fluxes, chunks)
+        grid_blocks = self.calcGridBlocks(grid)
+        if numpy.any(grid_velocity):
+            self.pool.map(update_extensive, chunks)
+            grid.move(grid_velocity, dt)
+            grid_blocks = self.calcGridBlocks(grid)
+            self.pool.map(update_cells, chunks)
+        else:
+            self.pool.map(update, chunks)
+
+    def close(self):
+
+        self.pool.close()
+        self.pool.join()
+
+class TestThreadedStep(unittest.TestCase):
+
+    def make_data(self, grid_motion):
+
+        from ideal_gas import IdealGas
+        from simple_cfl import SimpleCFL
+        from boundaries import BoundaryConditions, Outflow, Reflective
+        from simple_extensive_updater import simple_extensive_updater
+        from simple_cell_updater import simple_cell_updater
+        from physical_geometry import spherical_geometry
+
+        grid = numpy.linspace(1, 2, 101)
+        data = {}
+        data['grid'] = grid
+        data['cells'] = {'density':numpy.ones(100),
+                         'pressure':numpy.where(grid[:-1]<1.5, 2.0, 1.0),
+                         'velocity':numpy.zeros(100)}
+        data['equation_of_state'] = IdealGas(5./3.)
+        data['physical_geometry'] = spherical_geometry
+        data['time_step_function'] = SimpleCFL(0.3)
+        data['grid_motion'] = grid_motion
+        data['boundary_conditions'] = BoundaryConditions(Reflective(), Outflow())
+        data['extensive_updater'] = simple_extensive_updater
+        data['cell_updater'] = simple_cell_updater
+        return data
+
+    def check_matches_serial_run(self, grid_motion):
+
+        from simulation import Simulation
+
+        serial = Simulation(self.make_data(grid_motion))
+        data = self.make_data(grid_motion)
+        data['threads'] = 3
+        data['chunk_size'] = 7
+        threaded = Simulation(data)
+        try:
+            for i in range(30):
+                serial.timeAdvance()
+                threaded.timeAdvance()
+        finally:
+            threaded.close()
+        self.assertTrue(numpy.array_equal(numpy.asarray(serial.data['grid']),
+                                          numpy.asarray(threaded.data['grid'])))
+        for field in serial.data['cells'].fields:
+            self.assertTrue(numpy.array_equal(serial.data['cells'][field],
+                                              threaded.data['cells'][field]))
+
+    def test_static_grid(self):
+
+        from eulerian import Eulerian
+
+        self.check_matches_serial_run(Eulerian())
+
+    def test_moving_grid(self):
+
+        self.check_matches_serial_run(lambda grid, cells: 0.01*numpy.asarray(grid))
+
+if __name__ == '__main__':
+
+    unittest.main()
@@ -0,0 +1,31 @@
+import numpy
+
+# An equation of state may provide vectorised_de2p, vectorised_dp2e and
+# vectorised_dp2c, which take whole arrays and an optional out buffer.
+# Equations of state that only provide the scalar methods fall back to
+# numpy.vectorize.
+
+def call_vectorised(eos, name, first, second, out):
+
+    batched = getattr(eos, 'vectorised_'+name, None)
+    if batched is not None:
+        return batched(first, second, out=out)
+    from stage_stats import count_event
+    count_event('fallbacks')
+    res = numpy.vectorize(getattr(eos, name))(first, second)
+    if out is None:
+        return res
+    out[...] = res
+    return out
+
+def calc_vectorised_de2p(eos, d, e, out=None):
+
+    return call_vectorised(eos, 'de2p', d, e, out)
+
+def calc_vectorised_dp2e(eos, d, p, out=None):
+
+    return call_vectorised(eos, 'dp2e', d, p, out)
+
+def calc_vectorised_dp2c(eos, d, p, out=None):
+
+    return call_vectorised(eos, 'dp2c', d, p, out)
@@ -1,14 +1,16 @@
+import unittest
 import numpy
 
+from hydro_state import conserved_fields, make_output
+
 def primitives2conserveds(primitives):
 
     densities = primitives['density']
     velocities = primitives['velocity']
     energies = primitives['energy']
-    return numpy.array(zip(densities,
-                           densities*velocities,
-                           densities*(0.5*velocities**2+energies)),
-                       dtype=[('mass','d'),('momentum','d'),('energy','d')])
+    return {'mass':densities,
+            'momentum':densities*velocities,
+            'energy':densities*(0.5*velocities**2+energies)}
                        
 def calc_center_wave_speeds(left, right, sl, sr):
 
@@ -30,8 +32,9 @@ def calc_starred_states(states, sk, ss):
     vk = states['velocity']
     ds = dk*(sk-vk)/(sk-ss)
     ek = dk*(states['energy']+0.5*vk**2)
-    return numpy.array(zip(ds,ds*ss,ek*ds/dk+ds*(ss-vk)*(ss+pk/dk/(sk-vk))),
-                        dtype=[('mass','d'),('momentum','d'),('energy','d')])
+    return {'mass':ds,
+            'momentum':ds*ss,
+            'energy':ek*ds/dk+ds*(ss-vk)*(ss+pk/dk/(sk-vk))}
                         
 def primitives2fluxes(primitives):
 
@@ -39,17 +42,16 @@ def primitives2fluxes(primitives):
     velocities = primitives['velocity']
     pressures = primitives['pressure']
     energies = primitives['energy']
-    return numpy.array(zip(densities*velocities,
-                           densities*velocities**2+pressures,
-                           densities*velocities*(0.5*velocities**2+energies+pressures/densities)),
-                       dtype=[('mass','d'),('momentum','d'),('energy','d')])
+    return {'mass':densities*velocities,
+            'momentum':densities*velocities**2+pressures,
+            'energy':densities*velocities*(0.5*velocities**2+energies+pressures/densities)}
 
-def calc_vectorised_hllc(left_states, right_states, velocities):
+def calc_vectorised_hllc(left_states, right_states, velocities, out=None):
 
-    local_left_states = left_states.copy()
-    local_left_states['velocity'] -= velocities
-    local_right_states = right_states.copy()
-    local_right_states['velocity'] -= velocities
+    local_left_states = dict((field, left_states[field]) for field in ['density','pressure','energy','sound_speed'])
+    local_left_states['velocity'] = left_states['velocity'] - velocities
+    local_right_states = dict((field, right_states[field]) for field in ['density','pressure','energy','sound_speed'])
+    local_right_states['velocity'] = right_states['velocity'] - velocities
     
     ul_list = primitives2conserveds(local_left_states)
     ur_list = primitives2conserveds(local_right_states)
@@ -66,21 +68,266 @@ def calc_vectorised_hllc(left_states, right_states, velocities):
     fl_list = primitives2fluxes(local_left_states)
     fr_list = primitives2fluxes(local_right_states)
     
-    ql_list = numpy.array(zip(*(fl_list[field]+lws_list*(usl_list[field]-ul_list[field]) for field in fl_list.dtype.names)),
-                          dtype=fl_list.dtype)
-    qr_list = numpy.array(zip(*(fr_list[field]+rws_list*(usr_list[field]-ur_list[field]) for field in fr_list.dtype.names)),
-                          dtype=fr_list.dtype)
-    res = numpy.where(lws_list>0,
-                      fl_list,
-                      numpy.where(rws_list<0,
-                                  fr_list,
-                                  numpy.where(cws_list>=0,
-                                              ql_list,
-                                              qr_list)))
+    res = make_output(out, numpy.shape(lws_list), conserved_fields)
+    for field in conserved_fields:
+        ql_list = fl_list[field]+lws_list*(usl_list[field]-ul_list[field])
+        qr_list = fr_list[field]+rws_list*(usr_list[field]-ur_list[field])
+        res[field] = numpy.where(lws_list>0,
+                                 fl_list[field],
+                                 numpy.where(rws_list<0,
+                                             fr_list[field],
+                                             numpy.where(cws_list>=0,
+                                                         ql_list,
+                                                         qr_list)))
     res['energy'] += res['momentum']*velocities+0.5*res['mass']*velocities**2
     res['momentum'] += velocities*res['mass']
     return res
     
+def calc_batched_hllc(left_states, right_states, velocities, out=None, scratch=None,
+                      signal_speeds=None):
+
+    res = make_output(out, numpy.shape(left_states['density']), conserved_fields)
+    if scratch is None:
+        scratch = res
+    shape = res.shape
+
+    def buf(name, dtype='d'):
+        return scratch.scratch('hllc_'+name, shape, dtype)
+
+    dl = left_states['density']
+    pl = left_states['pressure']
+    el = left_states['energy']
+    cl = left_states['sound_speed']
+    dr = right_states['density']
+    pr = right_states['pressure']
+    er = right_states['energy']
+    cr = right_states['sound_speed']
+    tmp = buf('tmp')
+    corr = buf('correction')
+
+    # Wave speeds in the frame of the interface
+    vl = numpy.subtract(left_states['velocity'], velocities, out=buf('vl'))
+    vr = numpy.subtract(right_states['velocity'], velocities, out=buf('vr'))
+    sl = numpy.subtract(vl, cl, out=buf('sl'))
+    numpy.subtract(vr, cr, out=tmp)
+    numpy.minimum(sl, tmp, out=sl)
+    sr = numpy.add(vl, cl, out=buf('sr'))
+    numpy.add(vr, cr, out=tmp)
+    numpy.maximum(sr, tmp, out=sr)
+    if signal_speeds is not None:
+        numpy.absolute(sl, out=signal_speeds)
+        numpy.absolute(sr, out=tmp)
+        numpy.maximum(signal_speeds, tmp, out=signal_speeds)
+    ml = numpy.subtract(sl, vl, out=buf('ml'))
+    ml *= dl
+    mr = numpy.subtract(sr, vr, out=buf('mr'))
+    mr *= dr
+    ss = numpy.subtract(pr, pl, out=buf('ss'))
+    numpy.multiply(ml, vl, out=tmp)
+    ss += tmp
+    numpy.multiply(mr, vr, out=tmp)
+    ss -= tmp
+    numpy.subtract(ml, mr, out=tmp)
+    ss /= tmp
+
+    # Branch selection
+    star = numpy.less_equal(sl, 0, out=buf('star', bool))
+    mask = numpy.greater_equal(sr, 0, out=buf('mask', bool))
+    numpy.logical_and(star, mask, out=star)
+    use_left = numpy.greater_equal(ss, 0, out=buf('use_left', bool))
+    numpy.logical_and(use_left, star, out=use_left)
+    numpy.greater(sl, 0, out=mask)
+    numpy.logical_or(use_left, mask, out=use_left)
+
+    # Upwind side
+    side = {}
+    for name, left, right in [('density', dl, dr),
+                              ('pressure', pl, pr),
+                              ('velocity', vl, vr),
+                              ('energy', el, er),
+                              ('wave_speed', sl, sr)]:
+        side[name] = buf('side_'+name)
+        numpy.copyto(side[name], right)
+        numpy.copyto(side[name], left, where=use_left)
+    dk = side['density']
+    pk = side['pressure']
+    vk = side['velocity']
+    sk = side['wave_speed']
+    ek = side['energy']
+    ek_total = buf('ek_total')
+    numpy.multiply(vk, vk, out=ek_total)
+    ek_total *= 0.5
+    ek_total += ek
+
+    # Upwind flux
+    numpy.multiply(dk, vk, out=res['mass'])
+    numpy.multiply(res['mass'], vk, out=res['momentum'])
+    res['momentum'] += pk
+    numpy.divide(pk, dk, out=tmp)
+    tmp += ek_total
+    numpy.multiply(res['mass'], tmp, out=res['energy'])
+
+    # Starred state correction, only kept where star is set
+    with numpy.errstate(divide='ignore', invalid='ignore'):
+        ds = numpy.subtract(sk, vk, out=buf('ds'))
+        numpy.multiply(dk, ds, out=tmp)
+        numpy.subtract(sk, ss, out=ds)
+        numpy.divide(tmp, ds, out=ds)
+        numpy.subtract(ds, dk, out=corr)
+        numpy.multiply(corr, sk, out=corr)
+        numpy.add(res['mass'], corr, out=res['mass'], where=star)
+        numpy.multiply(ds, ss, out=corr)
+        numpy.multiply(dk, vk, out=tmp)
+        numpy.subtract(corr, tmp, out=corr)
+        numpy.multiply(corr, sk, out=corr)
+        numpy.add(res['momentum'], corr, out=res['momentum'], where=star)
+        numpy.subtract(sk, vk, out=tmp)
+        numpy.multiply(tmp, dk, out=tmp)
+        numpy.divide(pk, tmp, out=tmp)
+        numpy.add(tmp, ss, out=tmp)
+        numpy.subtract(ss, vk, out=corr)
+        numpy.multiply(corr, tmp, out=corr)
+        numpy.add(corr, ek_total, out=corr)
+        numpy.multiply(corr, ds, out=corr)
+        numpy.multiply(dk, ek_total, out=tmp)
+        numpy.subtract(corr, tmp, out=corr)
+        numpy.multiply(corr, sk, out=corr)
+        numpy.add(res['energy'], corr, out=res['energy'], where=star)
+
+    # Back to the lab frame
+    numpy.multiply(res['momentum'], velocities, out=tmp)
+    res['energy'] += tmp
+    numpy.multiply(res['mass'], velocities, out=tmp)
+    res['momentum'] += tmp
+    tmp *= velocities
+    tmp *= 0.5
+    res['energy'] += tmp
+    return res
+
+def calc_contact_speeds(left_states, right_states, out=None, scratch=None):
+
+    # The HLLC estimate of the contact speed, in the lab frame
+    shape = numpy.shape(left_states['density'])
+    if out is None:
+        out = numpy.empty(shape)
+
+    def buf(name):
+        if scratch is None:
+            return numpy.empty(shape)
+        return scratch.scratch('contact_'+name, shape)
+
+    dl = left_states['density']
+    pl = left_states['pressure']
+    vl = left_states['velocity']
+    cl = left_states['sound_speed']
+    dr = right_states['density']
+    pr = right_states['pressure']
+    vr = right_states['velocity']
+    cr = right_states['sound_speed']
+    tmp = buf('tmp')
+
+    ml = numpy.subtract(vl, cl, out=buf('ml'))
+    numpy.subtract(vr, cr, out=tmp)
+    numpy.minimum(ml, tmp, out=ml)
+    ml -= vl
+    ml *= dl
+    mr = numpy.add(vl, cl, out=buf('mr'))
+    numpy.add(vr, cr, out=tmp)
+    numpy.maximum(mr, tmp, out=mr)
+    mr -= vr
+    mr *= dr
+    numpy.subtract(pr, pl, out=out)
+    numpy.multiply(ml, vl, out=tmp)
+    out += tmp
+    numpy.multiply(mr, vr, out=tmp)
+    out -= tmp
+    numpy.subtract(ml, mr, out=tmp)
+    out /= tmp
+    return out
+
+def make_random_states(n, g=5./3.):
+
+    hydro_variables = ['density','pressure','velocity','energy','sound_speed']
+    res = dict((field, 10**(4*(numpy.random.rand(n)-0.5))) for field in hydro_variables)
+    res['velocity'] *= numpy.sign(numpy.random.rand(n)-0.5)
+    res['energy'] = res['pressure']/res['density']/(g-1)
+    res['sound_speed'] = numpy.sqrt(g*res['pressure']/res['density'])
+    return res
+
+class TestBatchedHLLC(unittest.TestCase):
+
+    def assertFluxesClose(self, res_1, res_2):
+
+        # The energy flux can be a small difference of large terms, so
+        # round off is measured against the largest flux component
+        scale = numpy.maximum(numpy.max([numpy.abs(res_1[field]) for field in conserved_fields], axis=0),
+                              1e-12)
+        for field in conserved_fields:
+            self.assertTrue(numpy.all(numpy.abs(res_1[field]-res_2[field])<=1e-9*scale))
+
+    def test_matches_vectorised_hllc(self):
+
+        n = 1000
+        left_states = make_random_states(n)
+        right_states = make_random_states(n)
+        velocities = 10**(4*(numpy.random.rand(n)-0.5))-10**(4*(numpy.random.rand(n)-0.5))
+        self.assertFluxesClose(calc_vectorised_hllc(left_states, right_states, velocities),
+                               calc_batched_hllc(left_states, right_states, velocities))
+
+    def test_matches_scalar_hllc(self):
+
+        from hllc import HLLC
+
+        n = 20
+        left_states = make_random_states(n)
+        right_states = make_random_states(n)
+        velocities = numpy.random.rand(n)-0.5
+        res = calc_batched_hllc(left_states, right_states, velocities)
+        rs = HLLC()
+        for i in range(n):
+            temp = rs(dict((field, left_states[field][i]) for field in left_states),
+                      dict((field, right_states[field][i]) for field in right_states),
+                      velocities[i])
+            for field in conserved_fields:
+                self.assertAlmostEqual(temp[field]/max(abs(res[field][i]),1e-12),
+                                       res[field][i]/max(abs(res[field][i]),1e-12))
+
+    def test_contact_speeds(self):
+
+        from hllc import calc_wave_speeds
+
+        n = 20
+        left_states = make_random_states(n)
+        right_states = make_random_states(n)
+        res = calc_contact_speeds(left_states, right_states)
+        for i in range(n):
+            expected = calc_wave_speeds(dict((field, left_states[field][i]) for field in left_states),
+                                        dict((field, right_states[field][i]) for field in right_states))
+            self.assertAlmostEqual(res[i], expected['center'], delta=1e-12*abs(expected['center']))
+        # No mass crosses an interface that moves with the contact
+        fluxes = calc_batched_hllc(left_states, right_states, res)
+        scale = numpy.maximum(left_states['density']*(left_states['sound_speed']+
+                                                      numpy.abs(left_states['velocity'])),
+                              right_states['density']*(right_states['sound_speed']+
+                                                       numpy.abs(right_states['velocity'])))
+        self.assertTrue(numpy.all(numpy.abs(fluxes['mass']) <= 1e-9*scale))
+
+    def test_reuses_buffers(self):
+
+        from hydro_state import HydroState
+
+        n = 10
+        left_states = make_random_states(n)
+        right_states = make_random_states(n)
+        velocities = numpy.zeros(n)
+        out = HydroState(n, conserved_fields)
+        calc_batched_hllc(left_states, right_states, velocities, out=out)
+        buffers = dict(out.scratch_buffers)
+        res = calc_batched_hllc(left_states, right_states, velocities, out=out)
+        self.assertTrue(res is out)
+        for name in buffers:
+            self.assertTrue(buffers[name] is out.scratch_buffers[name])
+    
 def test():
 
     n = 10